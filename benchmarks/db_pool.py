@@ -0,0 +1,100 @@
+"""
+    DATABASE POOL BENCHMARK
+    Throughput of the vocabulary lookup under concurrent load, with the
+    synchronous psycopg2 engine used from a thread pool (as the request
+    handlers used to do) and with the asyncpg engine used from the event loop.
+    Both engines use the pool settings of database.engine, so the
+    DRRECONCILE_DB_* variables can be tuned between runs.
+
+    Usage:
+        python -m benchmarks.db_pool --concurrency 32 --queries 2000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database.engine import get_engine, get_async_engine
+from reconciliation.vocabulary import VOCABULARY_QUERIES
+
+QUERY = VOCABULARY_QUERIES["/ethnicity"]
+
+
+def summarise(latencies, elapsed):
+    """
+        Queries per second and latency percentiles in milliseconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        "queries": len(latencies),
+        "queries_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+def run_sync(concurrency, queries):
+    """
+        Every thread borrows a connection from the psycopg2 pool for each query.
+    """
+    engine = get_engine()
+
+    def lookup(_):
+        start = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(QUERY).fetchall()
+        return time.perf_counter() - start
+
+    lookup(0)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lookup, range(queries)))
+    result = summarise(latencies, time.perf_counter() - start)
+    engine.dispose()
+    return result
+
+async def run_async(concurrency, queries):
+    """
+        concurrency tasks share the asyncpg pool until all the queries are done.
+    """
+    engine = get_async_engine()
+    latencies = []
+    remaining = iter(range(queries))
+
+    async def lookup():
+        start = time.perf_counter()
+        async with engine.connect() as conn:
+            (await conn.execute(QUERY)).fetchall()
+        return time.perf_counter() - start
+
+    async def worker():
+        for _ in remaining:
+            latencies.append(await lookup())
+
+    await lookup()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarise(latencies, time.perf_counter() - start)
+    await engine.dispose()
+    return result
+
+def main(argv=None):
+    """
+        Command line entry point, it prints both results as JSON.
+    """
+    parser = argparse.ArgumentParser(description="Sync vs async engine throughput")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    results = {
+        "concurrency": args.concurrency,
+        "sync_psycopg2": run_sync(args.concurrency, args.queries),
+        "async_asyncpg": asyncio.run(run_async(args.concurrency, args.queries)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
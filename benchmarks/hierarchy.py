@@ -0,0 +1,126 @@
+"""
+    HIERARCHICAL MATCHING BENCHMARK
+    Comparisons and recall of the hierarchical matcher against the exhaustive
+    scoring of every label, on the ethnicity descriptions and on a generated
+    three-level vocabulary of the size of a terminology chapter. Every query is
+    built from a known label: the leaf term, the leaf term with a typo, and the
+    lowercase full label; recall@k is the share of the queries whose label is
+    among the k best candidates.
+
+    Usage:
+        python -m benchmarks.hierarchy --chapters 12 --blocks 8 --leaves 10 --output hierarchy.json
+"""
+import argparse
+import json
+import random
+import time
+from faker import Faker
+from database.ethnicity import ETHNICITY_DESCRIPTIONS
+from reconciliation.helper import partial_ratio
+from reconciliation.hierarchy import SEPARATOR, HierarchicalMatcher
+
+SEED = 0
+
+
+def ethnicity_rows():
+    """
+        The ethnicity table rows, with the ids of the loader.
+    """
+    return [(5000 + i, description) for i, (_, description) in enumerate(ETHNICITY_DESCRIPTIONS)]
+
+def generated_rows(chapters, blocks, leaves):
+    """
+        A chapter - block - term vocabulary made of random words.
+    """
+    fake = Faker()
+    fake.seed_instance(SEED)
+    rows = []
+    for _ in range(chapters):
+        chapter = " ".join(fake.words(2)).capitalize()
+        for _ in range(blocks):
+            block = " ".join(fake.words(2)).capitalize()
+            for _ in range(leaves):
+                term = " ".join(fake.words(2))
+                rows.append((len(rows) + 1, SEPARATOR.join((chapter, block, term))))
+    return rows
+
+def typo(rng, value):
+    """
+        The value with two neighbouring characters swapped.
+    """
+    if len(value) < 4:
+        return value
+    i = rng.randrange(1, len(value) - 2)
+    return value[:i] + value[i + 1] + value[i] + value[i + 2:]
+
+def build_queries(rows, sample, rng):
+    """
+        (query, expected id) pairs built from a sample of the labels.
+    """
+    queries = []
+    for entity_id, label in rng.sample(rows, min(sample, len(rows))):
+        term = label.split(SEPARATOR)[-1]
+        queries += [(term, entity_id), (typo(rng, term), entity_id), (label.lower(), entity_id)]
+    return queries
+
+def flat_match(rows, query_string, limit):
+    """
+        Exhaustive scoring, as score_ethnicity does without pruning.
+    """
+    scored = [(entity_id, label, partial_ratio(query_string, label)) for entity_id, label in rows]
+    scored.sort(key=lambda leaf: -leaf[2])
+    return scored[:limit], len(rows)
+
+def evaluate(name, rows, queries, limit, beam):
+    """
+        Recall@limit, comparisons and time per query of both matchers.
+    """
+    matcher = HierarchicalMatcher(rows, beam=beam)
+    report = {"labels": len(rows), "queries": len(queries), "limit": limit, "beam": beam}
+    for method, match in (("flat", lambda q: flat_match(rows, q, limit)),
+                          ("hierarchical", lambda q: matcher.match(q, limit))):
+        found = comparisons = 0
+        start = time.perf_counter()
+        for query_string, expected in queries:
+            candidates, count = match(query_string)
+            comparisons += count
+            found += any(entity_id == expected for entity_id, _, _ in candidates)
+        elapsed = time.perf_counter() - start
+        report[method] = {
+            "recall": round(found / len(queries), 4),
+            "comparisons_per_query": round(comparisons / len(queries), 1),
+            "ms_per_query": round(elapsed / len(queries) * 1000, 3),
+        }
+    print(f"{name}: {json.dumps(report)}")
+    return report
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Hierarchical against exhaustive matching")
+    parser.add_argument("--chapters", type=int, default=12)
+    parser.add_argument("--blocks", type=int, default=8)
+    parser.add_argument("--leaves", type=int, default=10)
+    parser.add_argument("--sample", type=int, default=50, help="labels queried")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--beam", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(SEED)
+    results = {}
+    rows = ethnicity_rows()
+    results["ethnicity"] = evaluate("ethnicity", rows, build_queries(rows, len(rows), rng),
+                                    args.limit, args.beam)
+    rows = generated_rows(args.chapters, args.blocks, args.leaves)
+    results["generated"] = evaluate("generated", rows, build_queries(rows, args.sample, rng),
+                                    args.limit, args.beam)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
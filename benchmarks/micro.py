@@ -0,0 +1,221 @@
+"""
+    MICRO-BENCHMARKS
+    Timing of the helper scoring and encoding functions and of the per-type
+    scoring used by reconcile(). The inputs are the dirty values written by
+    generate_patient and the admission reasons of the registration table,
+    compared with the reference vocabularies, so the timings reflect the real
+    workload. The ICD-11 API is not called: the search results are built
+    from the admission reasons.
+
+    Usage:
+        python -m benchmarks.micro --output results.json
+        python -m benchmarks.micro --compare baseline.json --tolerance 0.1
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+import torch
+from database.generate_patient import ethnicity_values, sexual_orientation_values
+from database.registration import ADMISSION_REASONS
+from database.ethnicity import ETHNICITY_DESCRIPTIONS
+from database.sexual_orientation import SO_CATEGORIES
+from reconciliation.helper import (
+    partial_ratio,
+    levenshtein,
+    cosine_similarity,
+    encode,
+    encode_batch,
+    sap_encode,
+    sap_encode_batch
+)
+from reconciliation.scoring import score_ethnicity, score_sexual_orientation, score_icd11
+
+SEED = 0
+
+
+def build_inputs():
+    """
+        It builds the fixed inputs of every benchmark. The ids follow
+        the ones given by the database loaders.
+    """
+    rng = np.random.default_rng(SEED)
+    ethnicity_rows = [(5000 + i, desc) for i, (_, desc) in enumerate(ETHNICITY_DESCRIPTIONS)]
+    so_rows = [(3000 + i, name) for i, name in enumerate(SO_CATEGORIES)]
+    # ICD search results as returned by the API, with the highlighted title
+    icd_results = [
+        {"id": f"http://id.who.int/icd/entity/{i}",
+         "title": f"<em class='found'>{reason}</em>"}
+        for i, reason in enumerate(ADMISSION_REASONS)
+    ]
+    return {
+        "ethnicity_pairs": [(v, d) for v in ethnicity_values for _, d in ethnicity_rows],
+        "so_pairs": [(v, n) for v in sexual_orientation_values for _, n in so_rows],
+        "diagnosis_pairs": [(a, b) for a in ADMISSION_REASONS[:15] for b in ADMISSION_REASONS],
+        "vectors": rng.standard_normal((100, 768)).astype(np.float32),
+        "ethnicity_rows": ethnicity_rows,
+        "so_rows": so_rows,
+        "icd_results": icd_results,
+    }
+
+def build_cases(inputs):
+    """
+        Every case is (name, number of operations, function running them once).
+        The time of a run is divided by the number of operations.
+    """
+    vectors = inputs["vectors"]
+    all_pairs = inputs["ethnicity_pairs"] + inputs["so_pairs"] + inputs["diagnosis_pairs"]
+
+    def run_pairs(fn, pairs):
+        return lambda: [fn(a, b) for a, b in pairs]
+
+    def run_icd():
+        # each query is scored against the five results of its own search
+        for i, reason in enumerate(ADMISSION_REASONS):
+            score_icd11(reason, inputs["icd_results"][i:i + 5])
+
+    return [
+        ("partial_ratio.ethnicity", len(inputs["ethnicity_pairs"]),
+         run_pairs(partial_ratio, inputs["ethnicity_pairs"])),
+        ("partial_ratio.sexual_orientation", len(inputs["so_pairs"]),
+         run_pairs(partial_ratio, inputs["so_pairs"])),
+        ("partial_ratio.diagnosis", len(inputs["diagnosis_pairs"]),
+         run_pairs(partial_ratio, inputs["diagnosis_pairs"])),
+        ("levenshtein", len(all_pairs),
+         run_pairs(levenshtein, all_pairs)),
+        ("cosine_similarity", len(vectors) - 1,
+         lambda: [cosine_similarity(vectors[i], vectors[i + 1]) for i in range(len(vectors) - 1)]),
+        ("encode", len(ADMISSION_REASONS),
+         lambda: [encode(reason) for reason in ADMISSION_REASONS]),
+        ("encode_batch", len(ADMISSION_REASONS),
+         lambda: encode_batch(ADMISSION_REASONS)),
+        ("sap_encode", len(ADMISSION_REASONS),
+         lambda: [sap_encode(reason) for reason in ADMISSION_REASONS]),
+        ("sap_encode_batch", len(ADMISSION_REASONS),
+         lambda: sap_encode_batch(ADMISSION_REASONS)),
+        ("reconcile.ethnicity", len(ethnicity_values),
+         lambda: [score_ethnicity(v, inputs["ethnicity_rows"]) for v in ethnicity_values]),
+        ("reconcile.ethnicity.top5", len(ethnicity_values),
+         lambda: [score_ethnicity(v, inputs["ethnicity_rows"], 5) for v in ethnicity_values]),
+        ("reconcile.sexual_orientation", len(sexual_orientation_values),
+         lambda: [score_sexual_orientation(v, inputs["so_rows"])
+                  for v in sexual_orientation_values]),
+        ("reconcile.icd11", len(ADMISSION_REASONS), run_icd),
+    ]
+
+def time_case(fn, operations, repeat, warmup):
+    """
+        It runs the case warmup times without measuring, then repeat times,
+        and summarises the seconds per operation.
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) / operations)
+    median = statistics.median(samples)
+    return {
+        "operations": operations,
+        "repeat": repeat,
+        "min_s": min(samples),
+        "median_s": median,
+        "mean_s": statistics.fmean(samples),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "ops_per_s": 1 / median if median else None,
+    }
+
+def run(repeat=5, warmup=1, only=None):
+    """
+        It runs the selected cases and returns the results with the
+        environment they were measured in.
+    """
+    cases = build_cases(build_inputs())
+    results = {}
+    for name, operations, fn in cases:
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        results[name] = time_case(fn, operations, repeat, warmup)
+        print(f"{name:36s} {results[name]['median_s'] * 1e6:12.1f} us/op", file=sys.stderr)
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "seed": SEED,
+        },
+        "results": results,
+    }
+
+def compare(current, baseline, tolerance=0.1):
+    """
+        It compares the median of every case with the saved baseline.
+        A case is a regression when it is slower than the baseline
+        by more than the tolerance (0.1 = 10%).
+    """
+    report = {}
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median_s"] / base["median_s"]
+        report[name] = {
+            "baseline_median_s": base["median_s"],
+            "median_s": result["median_s"],
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1 + tolerance,
+        }
+    return report
+
+def main(argv=None):
+    """
+        Command line entry point. The exit status is 1 when the comparison
+        with the baseline finds a regression.
+    """
+    parser = argparse.ArgumentParser(description="DrReconcile micro-benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch intra-op threads, fix it for comparable runs")
+    parser.add_argument("--only", nargs="*", help="run only the cases with these prefixes")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    current = run(repeat=args.repeat, warmup=args.warmup, only=args.only)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        current["comparison"] = compare(current, baseline, args.tolerance)
+        current["comparison_tolerance"] = args.tolerance
+        regressions = [name for name, c in current["comparison"].items() if c["regression"]]
+
+    output = json.dumps(current, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    for name in regressions:
+        print(f"REGRESSION {name}: {current['comparison'][name]['ratio']}x baseline",
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
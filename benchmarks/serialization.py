@@ -0,0 +1,105 @@
+"""
+    RESPONSE SERIALIZATION BENCHMARK
+    Encode time and bytes on the wire of a reconcile response of generated
+    candidates, shaped as those of score_icd11 after the semantic stage:
+    the standard encoder of JSONResponse (which needs the NumPy scores turned
+    into Python floats first) against orjson, with the full and the compact
+    candidates, identity, gzip and brotli.
+
+    Usage:
+        python -m benchmarks.serialization --queries 1000 --limit 5 --output serialization.json
+"""
+import argparse
+import json
+import statistics
+import time
+import numpy as np
+from fastapi.responses import JSONResponse
+from database.registration import ADMISSION_REASONS
+from reconciliation.scoring import ICD11_TYPE, STAGE_SEMANTIC
+from reconciliation.serialization import compact_results, compress, dumps
+
+SEED = 0
+
+
+def build_response(queries, limit):
+    """
+        A response of queries keys with limit candidates each, NumPy scores.
+    """
+    rng = np.random.default_rng(SEED)
+    response = {}
+    for i in range(queries):
+        result = []
+        for j in rng.integers(0, len(ADMISSION_REASONS), limit):
+            semantic = np.float32(rng.uniform(40, 100))
+            lexical = int(rng.integers(20, 100))
+            result.append({
+                "id": f"http://id.who.int/icd/entity/{100000 + int(j)}",
+                "name": ADMISSION_REASONS[j],
+                "semantic_score": round(semantic, 2),
+                "lexical_score": lexical,
+                "score": max(semantic, lexical),
+                "match": bool(semantic >= 90 or lexical >= 90),
+                "stage": STAGE_SEMANTIC,
+                "type": ICD11_TYPE
+            })
+        response[f"q{i}"] = {"result": result, "degradation": "none"}
+    return response
+
+def python_floats(response):
+    """
+        The response with the NumPy scores as Python floats, as the standard
+        encoder needs them.
+    """
+    return {key: {**value, "result": [{k: float(v) if isinstance(v, np.floating) else v
+                                       for k, v in candidate.items()}
+                                      for candidate in value["result"]]}
+            for key, value in response.items()}
+
+def timed(function, repeat):
+    """
+        The result of the function and its median time in milliseconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, round(statistics.median(samples), 3)
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Compare the response encoders")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    response = build_response(args.queries, args.limit)
+    results = {"queries": args.queries, "limit": args.limit, "encoders": {}}
+    cases = {
+        # the conversion is part of the cost of the standard encoder
+        "json": lambda: JSONResponse(content=python_floats(response)).body,
+        "orjson": lambda: dumps(response),
+        "orjson_compact": lambda: dumps(compact_results(response)),
+    }
+    for name, encode in cases.items():
+        body, encode_ms = timed(encode, args.repeat)
+        results["encoders"][name] = case = {"encode_ms": encode_ms, "identity_bytes": len(body)}
+        for encoding in ("gzip", "br"):
+            compressed, compress_ms = timed(lambda: compress(body, encoding), args.repeat)
+            case[f"{encoding}_bytes"] = len(compressed)
+            case[f"{encoding}_ms"] = compress_ms
+        print(f"{name:15} {case}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+    UPLOAD FORMAT BENCHMARK
+    Time to read a reconciled file with uploads.iter_updates and to build the
+    updates /fetch-update-reconciled-data writes with its bulk UPDATE, for the
+    same rows written as CSV, Parquet and an Arrow IPC stream. The database is
+    not involved: the write is the same whatever the format.
+
+    Usage:
+        python -m benchmarks.upload_formats --rows 5000000 --output results.json
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database.ethnicity import ETHNICITY_DESCRIPTIONS
+from reconciliation.uploads import iter_updates
+
+SEED = 0
+
+
+def build_table(rows):
+    """
+        patientid, ethnicity and ethnicity_id columns, with 1% of missing values.
+    """
+    rng = np.random.default_rng(SEED)
+    labels = np.array([description for _, description in ETHNICITY_DESCRIPTIONS])
+    choice = rng.integers(0, len(labels), rows)
+    values = labels[choice].astype(object)
+    values[rng.random(rows) < 0.01] = None
+    return pa.table({
+        "patientid": np.arange(1, rows + 1, dtype=np.int64),
+        "ethnicity": pa.array(values, type=pa.string()),
+        "ethnicity_id": pa.array((choice + 5000).astype(str), type=pa.string()),
+    })
+
+def write_files(table, directory):
+    """
+        The table written in every format, format -> path.
+    """
+    paths = {fmt: os.path.join(directory, f"upload.{ext}")
+             for fmt, ext in (("csv", "csv"), ("parquet", "parquet"), ("arrow", "arrows"))}
+    table.to_pandas().to_csv(paths["csv"], index=False)
+    pq.write_table(table, paths["parquet"])
+    with pa.OSFile(paths["arrow"], "wb") as sink:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=65_536)
+    return paths
+
+def read_updates(path, fmt):
+    """
+        The updates and entity ids of the file, as the endpoint collects them.
+    """
+    updates, update_ids = {}, {}
+    with open(path, "rb") as f:
+        for patientids, values, ids in iter_updates(f, fmt, "ethnicity"):
+            updates.update(zip(patientids, values))
+            update_ids.update(zip(patientids, ids))
+    return updates, update_ids
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Compare the upload formats")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    table = build_table(args.rows)
+    results = {"rows": args.rows, "formats": {}}
+    with tempfile.TemporaryDirectory(prefix="drreconcile-upload-") as directory:
+        for fmt, path in write_files(table, directory).items():
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                updates, _ = read_updates(path, fmt)
+                samples.append(time.perf_counter() - start)
+            median = statistics.median(samples)
+            results["formats"][fmt] = {
+                "file_mib": round(os.path.getsize(path) / 2**20, 1),
+                "updates": len(updates),
+                "median_s": round(median, 3),
+                "min_s": round(min(samples), 3),
+                "rows_per_s": round(args.rows / median),
+            }
+            print(f"{fmt:8} {results['formats'][fmt]}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+    WORKER MEMORY
+    Memory of a running server and its workers, read from /proc (Linux only).
+    RSS counts the shared pages in every process that maps them, so it
+    overstates the memory of pre-forked workers; PSS divides every shared page
+    between the processes sharing it, so the PSS of the processes adds up to
+    the real memory use, and the private memory of a worker is what one
+    more worker would cost.
+
+    Usage:
+        python -m benchmarks.worker_memory <pid of serve.py or of the uvicorn parent>
+"""
+import argparse
+import json
+import os
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def children(pid):
+    """
+        The pids of the direct children of a process, without the resource
+        tracker of multiprocessing, which `uvicorn --workers` also starts.
+    """
+    pids = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children", encoding="utf-8") as f:
+            pids.extend(int(child) for child in f.read().split())
+    return [child for child in pids if not is_resource_tracker(child)]
+
+def is_resource_tracker(pid):
+    """
+        True when the process is the resource tracker of multiprocessing.
+    """
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return b"multiprocessing.resource_tracker" in f.read()
+
+def memory(pid):
+    """
+        The memory of a process in MiB, from /proc/<pid>/smaps_rollup.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    return {
+        "rss_mib": round(values["Rss"], 1),
+        "pss_mib": round(values["Pss"], 1),
+        "shared_mib": round(values["Shared_Clean"] + values["Shared_Dirty"], 1),
+        "private_mib": round(values["Private_Clean"] + values["Private_Dirty"], 1),
+    }
+
+def report(pid):
+    """
+        The memory of the parent and of every worker, and the totals.
+    """
+    processes = {"parent": memory(pid)}
+    workers = [memory(child) for child in children(pid)]
+    processes["workers"] = workers
+    processes["total_pss_mib"] = round(processes["parent"]["pss_mib"]
+                                       + sum(w["pss_mib"] for w in workers), 1)
+    if workers:
+        processes["mean_worker_private_mib"] = round(
+            sum(w["private_mib"] for w in workers) / len(workers), 1)
+    return processes
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Memory of a server and its workers")
+    parser.add_argument("pid", type=int)
+    args = parser.parse_args(argv)
+    print(json.dumps(report(args.pid), indent=2))
+
+
+if __name__ == "__main__":
+    main()
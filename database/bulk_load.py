@@ -0,0 +1,37 @@
+"""
+    BULK LOAD
+    Loading DataFrames with the PostgreSQL COPY command, which is much faster
+    than the INSERT statements issued by the default DataFrame.to_sql.
+"""
+import csv
+import io
+
+
+def copy_dataframe(df, table, cursor):
+    """
+        This function streams the DataFrame as CSV into COPY ... FROM STDIN,
+        using a psycopg2 cursor. The columns of the DataFrame must have
+        the names of the table columns, missing values are loaded as NULL.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_MINIMAL)
+    buffer.seek(0)
+    columns = ", ".join(df.columns)
+    cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def psql_insert_copy(table, conn, keys, data_iter):
+    """
+        This function can be passed as method to DataFrame.to_sql,
+        so that the rows are written with COPY instead of INSERT. It follows
+        the example of the pandas documentation:
+        https://pandas.pydata.org/docs/user_guide/io.html#io-sql-method
+    """
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cursor:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(data_iter)
+        buffer.seek(0)
+        columns = ", ".join(f'"{k}"' for k in keys)
+        table_name = f"{table.schema}.{table.name}" if table.schema else table.name
+        cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                           buffer)
@@ -1,19 +1,85 @@
 """
     ENGINE
+    Connection settings are read from the environment, with the defaults of
+    the local development database:
+    DRRECONCILE_DB_USER, DRRECONCILE_DB_PASSWORD, DRRECONCILE_DB_HOST,
+    DRRECONCILE_DB_PORT, DRRECONCILE_DB_NAME
+    and the pool is tuned with:
+    DRRECONCILE_DB_POOL_SIZE, DRRECONCILE_DB_MAX_OVERFLOW, DRRECONCILE_DB_POOL_PRE_PING,
+    DRRECONCILE_DB_POOL_RECYCLE, DRRECONCILE_DB_STATEMENT_TIMEOUT_MS,
+    DRRECONCILE_DB_PREPARED_STATEMENT_CACHE_SIZE
 """
-
+import asyncio
+import os
+import weakref
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+def _setting(name, default):
+    return os.environ.get(f"DRRECONCILE_DB_{name}") or default
+
+def database_url(driver):
+    """
+        It builds the URL of the healthcare database for the given driver.
+    """
+    user = _setting("USER", "myuser")
+    password = _setting("PASSWORD", "mypassword")
+    host = _setting("HOST", "localhost")
+    port = _setting("PORT", "5432")
+    database = _setting("NAME", "healthcare")
+    return f"postgresql+{driver}://{user}:{password}@{host}:{port}/{database}"
+
+def pool_settings():
+    """
+        Pool size, overflow, pre-ping and recycle time shared by both engines.
+    """
+    return {
+        "pool_size": int(_setting("POOL_SIZE", "5")),
+        "max_overflow": int(_setting("MAX_OVERFLOW", "10")),
+        "pool_pre_ping": _setting("POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(_setting("POOL_RECYCLE", "1800")),
+    }
+
+def statement_timeout_ms():
+    """
+        Statements running longer than this are cancelled by the server, 0 disables it.
+    """
+    return int(_setting("STATEMENT_TIMEOUT_MS", "30000"))
 
 def get_engine():
     """
-        SQLAlchemy enstablished the connection with the database by creating an engine 
+        SQLAlchemy enstablished the connection with the database by creating an engine
         object based on the URL containing username, password, host and port.
-        The engine connect the PostgreSQL psycopg2 driver to a 
+        The engine connect the PostgreSQL psycopg2 driver to a
         PostgreSQL-dialect database healthcare.
     """
-    user = "myuser"
-    password = "mypassword"
-    host = "localhost"
-    port = "5432"
-    database = "healthcare"
-    return create_engine(f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}")
+    return create_engine(
+        database_url("psycopg2"),
+        connect_args={"options": f"-c statement_timeout={statement_timeout_ms()}"},
+        **pool_settings()
+    )
+
+# one async engine per event loop, because asyncpg connections
+# cannot be shared between loops
+_async_engines = weakref.WeakKeyDictionary()
+
+def get_async_engine():
+    """
+        The async engine connects with asyncpg, so the request handlers can
+        await the database instead of blocking the event loop. The asyncpg
+        adapter keeps a cache of prepared statements per connection, so the
+        hot lookup queries are parsed and planned once per connection.
+        It must be called from a running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    engine = _async_engines.get(loop)
+    if engine is None:
+        cache_size = _setting("PREPARED_STATEMENT_CACHE_SIZE", "100")
+        engine = create_async_engine(
+            f"{database_url('asyncpg')}?prepared_statement_cache_size={cache_size}",
+            connect_args={"server_settings": {"statement_timeout": str(statement_timeout_ms())}},
+            **pool_settings()
+        )
+        _async_engines[loop] = engine
+    return engine
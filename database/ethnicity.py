@@ -4,6 +4,28 @@
 import pandas as pd
 from database.engine import get_engine
 
+# Hardcoded EthnicCode and Description pairs from the National code
+ETHNICITY_DESCRIPTIONS = [
+    ("A", "White - British"),
+    ("B", "White - Irish"),
+    ("C", "White - Any other White background"),
+    ("D", "Mixed - White and Black Caribbean"),
+    ("E", "Mixed - White and Black African"),
+    ("F", "Mixed - White and Asian"),
+    ("G", "Mixed - Any other mixed background"),
+    ("H", "Asian or Asian British - Indian"),
+    ("J", "Asian or Asian British - Pakistani"),
+    ("K", "Asian or Asian British - Bangladeshi"),
+    ("L", "Asian or Asian British - Any other Asian background"),
+    ("M", "Black or Black British - Caribbean"),
+    ("N", "Black or Black British - African"),
+    ("P", "Black or Black British - Any other Black background"),
+    ("R", "Other Ethnic Groups - Chinese"),
+    ("S", "Other Ethnic Groups - Any other ethnic group"),
+    ("Z", "Not stated"),
+    ("99", "Not known"),
+]
+
 
 def load_ethnicity():
     """
@@ -13,28 +35,6 @@ def load_ethnicity():
     NHS Ethnicity from the following link:
     https://digital.nhs.uk/data-and-information/data-collections-and-data-sets/data-sets/mental-health-services-data-set/submit-data/data-quality-of-protected-characteristics-and-other-vulnerable-groups/ethnicity
     """
-    # Hardcoded EthnicCode and Description pairs from the National code
-    ethnicity_descriptions = [
-        ("A", "White - British"),
-        ("B", "White - Irish"),
-        ("C", "White - Any other White background"),
-        ("D", "Mixed - White and Black Caribbean"),
-        ("E", "Mixed - White and Black African"),
-        ("F", "Mixed - White and Asian"),
-        ("G", "Mixed - Any other mixed background"),
-        ("H", "Asian or Asian British - Indian"),
-        ("J", "Asian or Asian British - Pakistani"),
-        ("K", "Asian or Asian British - Bangladeshi"),
-        ("L", "Asian or Asian British - Any other Asian background"),
-        ("M", "Black or Black British - Caribbean"),
-        ("N", "Black or Black British - African"),
-        ("P", "Black or Black British - Any other Black background"),
-        ("R", "Other Ethnic Groups - Chinese"),
-        ("S", "Other Ethnic Groups - Any other ethnic group"),
-        ("Z", "Not stated"),
-        ("99", "Not known"),
-    ]
-
     # Create the DataFrame
     ethnicity_df = pd.DataFrame([
         {
@@ -42,7 +42,7 @@ def load_ethnicity():
             "ethniccode": code,
             "description": desc
         }
-        for i, (code, desc) in enumerate(ethnicity_descriptions)
+        for i, (code, desc) in enumerate(ETHNICITY_DESCRIPTIONS)
     ])
 
     # Insert into the "ethnicity" table (append mode, don't overwrite)
@@ -4,6 +4,7 @@
 
 import pandas as pd
 from database.engine import get_engine
+from database.bulk_load import psql_insert_copy
 from database.generate_patient import generate_patient
 
 def load_patient():
@@ -22,6 +23,7 @@ def load_patient():
     df_patients.to_sql("patient",
                        engine,
                        if_exists="append",
-                       index=False)
+                       index=False,
+                       method=psql_insert_copy)
 
     print("Patient data inserted successfully.")
@@ -6,9 +6,27 @@ from datetime import timedelta
 import pandas as pd
 from faker import Faker
 from database.engine import get_engine
+from database.bulk_load import psql_insert_copy
 
 fake = Faker()
 
+STATUS_OPTIONS = ['standard', 'unknown patient', 'remotely registered']
+# reasons for admission written as free text, like in a real registration system
+ADMISSION_REASONS = [
+    "Chest pain", "Abdominal pain", "Shortness of breath", "Fever", "Cough",
+    "Headache", "Dizziness", "Fracture", "Infection", "Seizure",
+    "Mental health crisis", "Hypertension", "Diabetes complications",
+    "Back pain", "Pregnancy-related issue", "Post-surgical complication",
+    "Skin rash", "Allergic reaction", "Vomiting", "Unexplained weight loss",
+    "Trauma", "Dehydration", "Burns", "Stroke", "Heart attack",
+    "Palpitations", "Anemia", "Loss of consciousness", "Drug overdose", 
+    "Alcohol intoxication","Gastrointestinal bleeding", "Constipation", 
+    "Diarrhea", "Asthma exacerbation", "Kidney stones",
+    "Hematuria (blood in urine)", "Joint pain", "Swelling of limbs", 
+    "Hearing loss", "Vision changes", "Tachycardia", "Bradycardia", 
+    "Panic attack", "Chest injury", "Foreign body ingestion"
+]
+
 def generate_registration(registration_id,
                           patient_id,
                           hospital_ids,
@@ -51,21 +69,6 @@ def load_registration():
     """
     patient_ids = list(range(1000, 2000))
     hospital_ids = list(range(1, 395))
-    status_options = ['standard', 'unknown patient', 'remotely registered']
-    admission_reasons = [
-        "Chest pain", "Abdominal pain", "Shortness of breath", "Fever", "Cough",
-        "Headache", "Dizziness", "Fracture", "Infection", "Seizure",
-        "Mental health crisis", "Hypertension", "Diabetes complications",
-        "Back pain", "Pregnancy-related issue", "Post-surgical complication",
-        "Skin rash", "Allergic reaction", "Vomiting", "Unexplained weight loss",
-        "Trauma", "Dehydration", "Burns", "Stroke", "Heart attack",
-        "Palpitations", "Anemia", "Loss of consciousness", "Drug overdose", 
-        "Alcohol intoxication","Gastrointestinal bleeding", "Constipation", 
-        "Diarrhea", "Asthma exacerbation", "Kidney stones",
-        "Hematuria (blood in urine)", "Joint pain", "Swelling of limbs", 
-        "Hearing loss", "Vision changes", "Tachycardia", "Bradycardia", 
-        "Panic attack", "Chest injury", "Foreign body ingestion"
-    ]
 
     registrations = []
     reg_id = 6000
@@ -75,8 +78,8 @@ def load_registration():
         registrations.append(generate_registration(reg_id,
                                                    pid,
                                                    hospital_ids,
-                                                   status_options,
-                                                   admission_reasons))
+                                                   STATUS_OPTIONS,
+                                                   ADMISSION_REASONS))
         reg_id += 1
 
         # Random chance of having more registrations
@@ -86,8 +89,8 @@ def load_registration():
             registrations.append(generate_registration(reg_id,
                                                        pid,
                                                        hospital_ids,
-                                                       status_options,
-                                                       admission_reasons))
+                                                       STATUS_OPTIONS,
+                                                       ADMISSION_REASONS))
             reg_id += 1
 
     # Convert to DataFrame
@@ -97,7 +100,8 @@ def load_registration():
     registration_df.to_sql("registration",
                            engine,
                            if_exists="append",
-                           index=False)
+                           index=False,
+                           method=psql_insert_copy)
 
     print("Registration data inserted successfully.")
 
@@ -4,6 +4,17 @@
 import pandas as pd
 from database.engine import get_engine
 
+# Define the 6 sexual orientation categories
+SO_CATEGORIES = [
+    "Straight or Heterosexual",
+    "Gay or Lesbian",
+    "Bisexual",
+    "All other sexual orientations",
+    "Not answered",
+    "Does not apply"
+]
+
+
 def load_so():
     """
         This function first defines a list of the sexual orientation categories, 
@@ -13,20 +24,10 @@ def load_so():
         NHS sexual orientation data from this link:
         https://digital.nhs.uk/data-and-information/data-collections-and-data-sets/data-sets/mental-health-services-data-set/submit-data/data-quality-of-protected-characteristics-and-other-vulnerable-groups/sexual-orientation
     """
-    # Define the 6 sexual orientation categories
-    so_categories = [
-        "Straight or Heterosexual",
-        "Gay or Lesbian",
-        "Bisexual",
-        "All other sexual orientations",
-        "Not answered",
-        "Does not apply"
-    ]
-
     # Create DataFrame
     so_df = pd.DataFrame({
-        "soid": [3000 + i for i in range(len(so_categories))],
-        "soname": so_categories
+        "soid": [3000 + i for i in range(len(SO_CATEGORIES))],
+        "soname": SO_CATEGORIES
     })
 
     engine = get_engine()
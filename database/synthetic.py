@@ -0,0 +1,309 @@
+"""
+    SYNTHETIC DATA
+    Scalable generator of patients and registrations for load testing.
+    The rows are built a column at a time with NumPy sampling, instead of one
+    dictionary per row with Faker, the work is split in shards generated by
+    separate processes, and every shard is loaded with COPY.
+    A shard only depends on the seed, on its index and on the reference date
+    (--today), so the same seed and date always produce the same data whatever
+    the number of workers.
+    The ids are loaded explicitly, so the serial sequences of the tables are
+    moved past them at the end of the load.
+
+    Usage:
+        python -m database.synthetic --patients 10000000 --registrations-per-patient 3 \\
+            --workers 8 --seed 0 --today 2025-01-01 --load-reference
+"""
+import argparse
+import os
+import time
+from datetime import date
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from faker import Faker
+from sqlalchemy import text
+from database.engine import get_engine
+from database.bulk_load import copy_dataframe
+from database.data import load_csv_data
+from database.generate_patient import ethnicity_values, sexual_orientation_values
+from database.registration import ADMISSION_REASONS, STATUS_OPTIONS
+
+PATIENT_COLUMNS = [
+    "patientid", "title", "firstname", "middlename", "lastname", "previous_lastname",
+    "nhsnumber", "dob", "dod", "age", "ethnicity", "sexual_orientation"
+]
+REGISTRATION_COLUMNS = [
+    "registrationid", "dateregistration", "registrationstatus", "datedischarge",
+    "patientid", "orgid", "reason_for_admission"
+]
+# size of the Faker name pools the names are sampled from
+NAME_POOL_SIZE = 5000
+# columns loaded with explicit ids, whose serial sequence must follow them
+SERIAL_COLUMNS = (("patient", "patientid"), ("registration", "registrationid"))
+
+
+def build_name_pools(seed, size=NAME_POOL_SIZE):
+    """
+        Faker is only used to build pools of prefixes and names,
+        which are then sampled with NumPy.
+    """
+    fake = Faker()
+    Faker.seed(seed)
+    return {
+        "prefix": np.array(sorted({fake.prefix() for _ in range(200)})),
+        "first_name": np.array([fake.first_name() for _ in range(size)]),
+        "last_name": np.array([fake.last_name() for _ in range(size)]),
+    }
+
+def generate_patients(rng, pools, first_index, count, today=None):
+    """
+        It generates count patients, with patientid 1000 + index and the
+        same distributions of generate_patient: DOB within 100 years, 30%
+        deceased, 70% with a middle name, 50% of the women with a previous
+        last name.
+    """
+    today = np.datetime64(today or date.today(), "D")
+    index = np.arange(first_index, first_index + count, dtype=np.int64)
+
+    dob = today - rng.integers(0, 100 * 365, count).astype("timedelta64[D]")
+    # date of death between 1 year after birth and today, for 30% of the patients
+    lived = (today - dob).astype(np.int64)
+    deceased = (rng.random(count) < 0.3) & (lived > 365)
+    dod_offset = 365 + (rng.random(count) * np.maximum(lived - 365, 0)).astype(np.int64)
+    dod = np.where(deceased, dob + dod_offset.astype("timedelta64[D]"),
+                   np.datetime64("NaT", "D"))
+    end = np.where(deceased, dod, today)
+    age = end.astype("datetime64[Y]").astype(int) - dob.astype("datetime64[Y]").astype(int)
+
+    female = rng.random(count) < 0.5
+    has_middle = rng.random(count) < 0.7
+    has_previous = female & (rng.random(count) < 0.5)
+
+    def sample(pool):
+        return pool[rng.integers(0, len(pool), count)]
+
+    middle = sample(pools["first_name"]).astype(object)
+    middle[~has_middle] = None
+    previous = sample(pools["last_name"]).astype(object)
+    previous[~has_previous] = None
+
+    return pd.DataFrame({
+        "patientid": 1000 + index,
+        "title": sample(pools["prefix"]),
+        "firstname": sample(pools["first_name"]),
+        "middlename": middle,
+        "lastname": sample(pools["last_name"]),
+        "previous_lastname": previous,
+        "nhsnumber": (9000000000 + index).astype(str),
+        "dob": dob,
+        "dod": dod,
+        "age": age,
+        # dirty values, to be reconciled
+        "ethnicity": sample(np.array(ethnicity_values)),
+        "sexual_orientation": sample(np.array(sexual_orientation_values)),
+    }, columns=PATIENT_COLUMNS)
+
+def generate_registrations(rng, patient_ids, first_id, per_patient, max_per_patient,
+                           hospitals, today=None):
+    """
+        Every patient gets at least one registration and on average per_patient,
+        never more than max_per_patient. As in generate_registration, the
+        registration is within the last 60 days and the discharge within
+        the last 30 days, but never before the registration.
+    """
+    today = np.datetime64(today or date.today(), "D")
+    extra_max = max_per_patient - 1
+    extra_p = min(max(per_patient - 1, 0) / extra_max, 1.0) if extra_max else 0.0
+    counts = 1 + rng.binomial(extra_max, extra_p, len(patient_ids))
+    patientid = np.repeat(patient_ids, counts)
+    count = len(patientid)
+
+    reg_date = today - rng.integers(0, 61, count).astype("timedelta64[D]")
+    dis_date = today - rng.integers(0, 31, count).astype("timedelta64[D]")
+    late = dis_date < reg_date
+    dis_date[late] = reg_date[late] + rng.integers(1, 6, late.sum()).astype("timedelta64[D]")
+
+    return pd.DataFrame({
+        "registrationid": first_id + np.arange(count, dtype=np.int64),
+        "dateregistration": reg_date,
+        "registrationstatus": np.array(STATUS_OPTIONS)[rng.integers(0, len(STATUS_OPTIONS),
+                                                                     count)],
+        "datedischarge": dis_date,
+        "patientid": patientid,
+        "orgid": rng.integers(1, hospitals + 1, count),
+        "reason_for_admission": np.array(ADMISSION_REASONS)[rng.integers(
+            0, len(ADMISSION_REASONS), count)],
+    }, columns=REGISTRATION_COLUMNS)
+
+def generate_shard(settings, shard):
+    """
+        It generates the patients and registrations of one shard.
+        The random generator is seeded with (seed, shard), and the registration
+        ids of a shard start at a fixed offset, so shards are independent.
+    """
+    rng = np.random.default_rng([settings["seed"], shard])
+    first_index = shard * settings["chunk_size"]
+    count = min(settings["chunk_size"], settings["patients"] - first_index)
+    patients = generate_patients(rng, settings["pools"], first_index, count,
+                                 settings["today"])
+    first_registration = (settings["registration_id_start"]
+                          + first_index * settings["max_per_patient"])
+    registrations = generate_registrations(rng, patients["patientid"].to_numpy(),
+                                           first_registration,
+                                           settings["registrations_per_patient"],
+                                           settings["max_per_patient"],
+                                           settings["hospitals"], settings["today"])
+    return patients, registrations
+
+# settings of the worker processes, set by the pool initializer
+_settings = {}
+
+def _init_worker(settings):
+    """
+        Every worker process opens its own engine.
+    """
+    _settings.update(settings)
+    if not settings["dry_run"]:
+        _settings["engine"] = get_engine()
+
+def _load_shard(shard):
+    """
+        Worker task: generate a shard and COPY it in its own transaction.
+        Patients are loaded first, because registrations reference them.
+    """
+    start = time.perf_counter()
+    patients, registrations = generate_shard(_settings, shard)
+    generated = time.perf_counter()
+    if not _settings["dry_run"]:
+        connection = _settings["engine"].raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                copy_dataframe(patients, "patient", cursor)
+                copy_dataframe(registrations, "registration", cursor)
+            connection.commit()
+        finally:
+            connection.close()
+    return {
+        "shard": shard,
+        "patients": len(patients),
+        "registrations": len(registrations),
+        "generate_s": generated - start,
+        "load_s": time.perf_counter() - generated,
+    }
+
+def load_reference():
+    """
+        It loads ethnicity, sexual orientation and hospitals,
+        which the generated rows refer to.
+    """
+    # imported here because they are only needed with --load-reference
+    # pylint: disable=import-outside-toplevel
+    from database.ethnicity import load_ethnicity
+    from database.sexual_orientation import load_so
+    from database.hospital import load_hospital
+    load_ethnicity()
+    load_so()
+    load_hospital(load_csv_data())
+
+def advance_sequences(engine):
+    """
+        COPY does not advance the serial sequences of the ids it loads, so
+        every sequence is set past the largest id of its table, and the
+        later INSERTs do not collide with the loaded rows.
+    """
+    with engine.begin() as conn:
+        for table, column in SERIAL_COLUMNS:
+            conn.execute(text(f"""
+                SELECT setval(pg_get_serial_sequence('{table}', '{column}'),
+                              (SELECT COALESCE(max({column}), 0) + 1 FROM {table}), false)
+            """))
+
+def run(patients, registrations_per_patient=1.7, max_per_patient=None, hospitals=None,
+        seed=0, workers=None, chunk_size=100_000, registration_id_start=6000,
+        today=None, dry_run=False):
+    """
+        It generates and loads the whole dataset and returns the rows
+        and the rows per second of every table.
+    """
+    if max_per_patient is None:
+        max_per_patient = max(1, int(np.ceil(2 * registrations_per_patient - 1)))
+    settings = {
+        "patients": patients,
+        "registrations_per_patient": registrations_per_patient,
+        "max_per_patient": max_per_patient,
+        "hospitals": hospitals or len(load_csv_data()),
+        "seed": seed,
+        "chunk_size": chunk_size,
+        "registration_id_start": registration_id_start,
+        "today": today or date.today(),
+        "pools": build_name_pools(seed),
+        "dry_run": dry_run,
+    }
+    shards = range((patients + chunk_size - 1) // chunk_size)
+
+    start = time.perf_counter()
+    with Pool(workers or os.cpu_count(), initializer=_init_worker,
+              initargs=(settings,)) as pool:
+        results = []
+        for result in pool.imap_unordered(_load_shard, shards):
+            results.append(result)
+            print(f"shard {result['shard']}: {result['patients']} patients, "
+                  f"{result['registrations']} registrations")
+    if not dry_run:
+        advance_sequences(get_engine())
+    elapsed = time.perf_counter() - start
+
+    total_patients = sum(r["patients"] for r in results)
+    total_registrations = sum(r["registrations"] for r in results)
+    return {
+        "patients": total_patients,
+        "registrations": total_registrations,
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round((total_patients + total_registrations) / elapsed),
+        "patients_per_second": round(total_patients / elapsed),
+        "registrations_per_second": round(total_registrations / elapsed),
+    }
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Generate and load synthetic patients")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--registrations-per-patient", type=float, default=1.7)
+    parser.add_argument("--max-registrations-per-patient", type=int, default=None)
+    parser.add_argument("--hospitals", type=int, default=None,
+                        help="number of hospitals to choose from, default all the loaded ones")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--registration-id-start", type=int, default=6000)
+    parser.add_argument("--today", type=date.fromisoformat, default=None,
+                        help="reference date of the birth and registration dates, "
+                             "YYYY-MM-DD, default the current date")
+    parser.add_argument("--load-reference", action="store_true",
+                        help="load ethnicity, sexual orientation and hospitals first")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="generate the rows without loading them")
+    args = parser.parse_args(argv)
+
+    if args.load_reference and not args.dry_run:
+        load_reference()
+
+    report = run(args.patients,
+                 registrations_per_patient=args.registrations_per_patient,
+                 max_per_patient=args.max_registrations_per_patient,
+                 hospitals=args.hospitals,
+                 seed=args.seed,
+                 workers=args.workers,
+                 chunk_size=args.chunk_size,
+                 registration_id_start=args.registration_id_start,
+                 today=args.today,
+                 dry_run=args.dry_run)
+    print(f"{report['patients']} patients and {report['registrations']} registrations "
+          f"in {report['seconds']} s ({report['rows_per_second']} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+    FAKE WHO ICD-11 API
+    Local stand-in for icdaccessmanagement.who.int (POST /connect/token) and
+    id.who.int (GET /icd/entity/search), so the service can be load tested
+    offline. The search returns the admission reasons sharing a word with the
+    query, with the highlighted titles of the real API. Every response waits
+    a configurable latency, and a configurable fraction of them fail.
+
+    Usage:
+        python -m loadtest.fake_who --port 8100 --latency-ms 150 --jitter-ms 50 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import re
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse
+from database.registration import ADMISSION_REASONS
+
+ENTITIES = [
+    {"id": f"http://id.who.int/icd/entity/{100000 + i}", "title": reason}
+    for i, reason in enumerate(ADMISSION_REASONS)
+]
+
+
+def search(term, entities=ENTITIES):
+    """
+        The entities sharing at least one word with the term, the most shared first,
+        with the matched words highlighted as in the WHO responses.
+    """
+    words = {w for w in re.split(r"\W+", term.lower()) if len(w) >= 3}
+    found = []
+    for entity in entities:
+        title_words = set(re.split(r"\W+", entity["title"].lower()))
+        shared = words & title_words
+        if shared:
+            title = re.sub(r"\b(" + "|".join(map(re.escape, sorted(shared))) + r")\b",
+                           r"<em class='found'>\1</em>", entity["title"], flags=re.IGNORECASE)
+            found.append((len(shared), {"id": entity["id"], "title": title}))
+    found.sort(key=lambda item: -item[0])
+    return [entity for _, entity in found]
+
+
+def create_app(latency_ms=100.0, jitter_ms=0.0, error_rate=0.0, seed=0):
+    """
+        It builds the fake API with the given latency and error rate.
+    """
+    app = FastAPI(title="Fake WHO ICD-11 API")
+    rng = random.Random(seed)
+    app.state.requests = {"token": 0, "search": 0, "errors": 0}
+
+    async def delay_or_fail(kind):
+        app.state.requests[kind] += 1
+        await asyncio.sleep(max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000)
+        if rng.random() < error_rate:
+            app.state.requests["errors"] += 1
+            return JSONResponse(status_code=503, content={"error": "Service Unavailable"})
+        return None
+
+    @app.post("/connect/token")
+    async def token(request: Request):
+        """
+            OAuth 2.0 client credentials token.
+        """
+        await request.body()
+        error = await delay_or_fail("token")
+        return error or {"access_token": "fake-token", "expires_in": 3600,
+                         "token_type": "Bearer", "scope": "icdapi_access"}
+
+    @app.get("/icd/entity/search")
+    async def entity_search(q: str = Query("")):
+        """
+            Entity search, only destinationEntities is returned.
+        """
+        error = await delay_or_fail("search")
+        return error or {"destinationEntities": search(q), "error": False}
+
+    @app.get("/stats")
+    async def stats():
+        """
+            Requests served so far.
+        """
+        return app.state.requests
+
+    return app
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    # imported here because the tests only need create_app
+    import uvicorn  # pylint: disable=import-outside-toplevel
+    parser = argparse.ArgumentParser(description="Fake WHO ICD-11 API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+    LOAD GENERATOR
+    Open-loop generator of OpenRefine-shaped traffic: batches of queries of one
+    column, so of one type, form-encoded as `queries` and posted to
+    /api/reconcile at a target rate, whatever the latency of the responses.
+    The latency of a batch is measured from the time it was scheduled, not from
+    the time it was sent, so a saturated service is not hidden by a generator
+    that slows down with it. Batches that would exceed max_in_flight are
+    dropped and counted.
+
+    Usage:
+        python -m loadtest.generator http://127.0.0.1:8000 --rps 20 --duration 60 \\
+            --mix ethnicity=0.4,sexual-orientation=0.3,icd11=0.3
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import httpx
+from database.generate_patient import ethnicity_values, sexual_orientation_values
+from database.registration import ADMISSION_REASONS
+
+# values of each type, as found in the columns sent by OpenRefine
+WORKLOAD = {
+    "/ethnicity": ethnicity_values,
+    "/sexual-orientation": sexual_orientation_values,
+    "/icd11": ADMISSION_REASONS,
+}
+
+
+def parse_mix(mix):
+    """
+        It parses "ethnicity=0.4,icd11=0.6" into the weight of every type.
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        type_param = "/" + name.strip().lstrip("/")
+        if type_param not in WORKLOAD:
+            raise ValueError(f"Unknown type in mix: {name}")
+        weights[type_param] = float(weight or 1)
+    return weights
+
+def make_batch(rng, type_param, batch_size, untyped_rate=0.0, limit=5):
+    """
+        A batch of queries of one column, keyed q0, q1... as OpenRefine does.
+        With probability untyped_rate the batch is sent without types.
+    """
+    typed = rng.random() >= untyped_rate
+    batch = {}
+    for i in range(batch_size):
+        query = {"query": rng.choice(WORKLOAD[type_param]), "limit": limit}
+        if typed:
+            query["type"] = type_param
+        batch[f"q{i}"] = query
+    return batch
+
+def percentile(sorted_values, fraction):
+    """
+        Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarise(samples, elapsed):
+    """
+        Latency percentiles in milliseconds, throughput and error rates of
+        a list of samples, each a dict with latency, ok, empty, dropped and queries.
+    """
+    sent = [s for s in samples if not s["dropped"]]
+    ok = [s for s in sent if s["ok"]]
+    latencies = sorted(s["latency"] for s in ok)
+    return {
+        "batches": len(samples),
+        "dropped": len(samples) - len(sent),
+        "errors": len(sent) - len(ok),
+        "error_rate": round((len(sent) - len(ok)) / len(sent), 4) if sent else None,
+        # successful responses where every query came back without candidates
+        "empty_rate": round(sum(s["empty"] for s in ok) / len(ok), 4) if ok else None,
+        "batches_per_second": round(len(ok) / elapsed, 2) if elapsed else None,
+        "queries_per_second": (round(sum(s["queries"] for s in ok) / elapsed, 2)
+                               if elapsed else None),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+    }
+
+async def _send(client, url, batch, scheduled):
+    """
+        It posts one batch and returns whether it succeeded and whether
+        every query came back empty.
+    """
+    try:
+        response = await client.post(f"{url}/api/reconcile",
+                                     data={"queries": json.dumps(batch)})
+        ok = response.status_code == 200
+        empty = ok and all(not r["result"] for r in response.json().values())
+    except (httpx.HTTPError, ValueError):
+        ok, empty = False, False
+    return {"latency": time.perf_counter() - scheduled, "ok": ok, "empty": empty}
+
+async def run(url, rps, duration, mix, batch_size=10, untyped_rate=0.0,
+              max_in_flight=256, seed=0, timeout=60.0):
+    """
+        It sends rps batches per second for duration seconds
+        and returns the report per type and for all of them.
+    """
+    rng = random.Random(seed)
+    weights = parse_mix(mix) if isinstance(mix, str) else mix
+    types, type_weights = list(weights), list(weights.values())
+    samples = []
+    in_flight = 0
+
+    async def one(client, type_param, batch, scheduled):
+        nonlocal in_flight
+        try:
+            result = await _send(client, url, batch, scheduled)
+        finally:
+            in_flight -= 1
+        samples.append({**result, "type": type_param, "dropped": False,
+                        "queries": len(batch)})
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        tasks = []
+        start = time.perf_counter()
+        for i in range(int(rps * duration)):
+            scheduled = start + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            type_param = rng.choices(types, type_weights)[0]
+            batch = make_batch(rng, type_param, batch_size, untyped_rate)
+            if in_flight >= max_in_flight:
+                samples.append({"type": type_param, "dropped": True, "ok": False,
+                                "empty": False, "latency": 0.0, "queries": len(batch)})
+                continue
+            in_flight += 1
+            tasks.append(asyncio.create_task(one(client, type_param, batch, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    report = {
+        "target_rps": rps,
+        "duration_s": round(elapsed, 2),
+        "batch_size": batch_size,
+        "all": summarise(samples, elapsed),
+    }
+    for type_param in types:
+        report[type_param] = summarise([s for s in samples if s["type"] == type_param], elapsed)
+    return report
+
+def add_arguments(parser):
+    """
+        The load options, shared with loadtest.run.
+    """
+    parser.add_argument("--rps", type=float, default=10.0, help="batches per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", default="ethnicity=0.4,sexual-orientation=0.3,icd11=0.3")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--untyped-rate", type=float, default=0.0,
+                        help="fraction of the batches sent without types")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report to this JSON file")
+
+def run_from_args(url, args):
+    """
+        It runs the load described by the parsed arguments and prints the report.
+    """
+    report = asyncio.run(run(url, args.rps, args.duration, args.mix,
+                             batch_size=args.batch_size,
+                             untyped_rate=args.untyped_rate,
+                             max_in_flight=args.max_in_flight,
+                             seed=args.seed,
+                             timeout=args.timeout))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    return report
+
+def main(argv=None):
+    """
+        Command line entry point, against a service already running.
+    """
+    parser = argparse.ArgumentParser(description="Replay OpenRefine-shaped reconcile batches")
+    parser.add_argument("url", help="base URL of the service, e.g. http://127.0.0.1:8000")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    run_from_args(args.url.rstrip("/"), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+    END-TO-END LOAD TEST
+    It starts the fake WHO ICD-11 API and the service (with serve.py) pointed
+    at it, with an empty ICD-11 cache, waits until both answer, replays the
+    load of loadtest.generator and prints the report, with the number of
+    requests the fake WHO API received. The service uses the Postgres database
+    of the DRRECONCILE_DB_* settings, populated with `python -m database.populate_db`
+    or `python -m database.synthetic`.
+
+    Usage:
+        python -m loadtest.run --workers 2 --rps 20 --duration 60 \\
+            --who-latency-ms 200 --who-jitter-ms 100 --who-error-rate 0.02
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from .generator import add_arguments, run_from_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_ready(url, timeout, process):
+    """
+        It polls the URL until it answers, or fails when the process exits or times out.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {timeout} s")
+
+def stop(process):
+    """
+        It stops a process started by the harness.
+    """
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="End-to-end load test with a fake WHO API")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--cpu-budget", type=int, default=None)
+    parser.add_argument("--who-port", type=int, default=8100)
+    parser.add_argument("--who-latency-ms", type=float, default=100.0)
+    parser.add_argument("--who-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--who-error-rate", type=float, default=0.0)
+    parser.add_argument("--icd-cache-dir", default=None,
+                        help="reuse this ICD-11 cache, default a new empty one")
+    parser.add_argument("--startup-timeout", type=float, default=300.0,
+                        help="seconds to wait for the models to load")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    who_url = f"http://127.0.0.1:{args.who_port}"
+    url = f"http://127.0.0.1:{args.port}"
+    env = {
+        **os.environ,
+        "DRRECONCILE_ICD_API_URL": who_url,
+        "DRRECONCILE_ICD_TOKEN_URL": f"{who_url}/connect/token",
+        "DRRECONCILE_ICD_CACHE_DIR": args.icd_cache_dir or tempfile.mkdtemp(
+            prefix="drreconcile-loadtest-icd-"),
+    }
+    who = subprocess.Popen([sys.executable, "-m", "loadtest.fake_who",
+                            "--port", str(args.who_port),
+                            "--latency-ms", str(args.who_latency_ms),
+                            "--jitter-ms", str(args.who_jitter_ms),
+                            "--error-rate", str(args.who_error_rate),
+                            "--seed", str(args.seed)], cwd=ROOT, env=env)
+    server_args = [sys.executable, "serve.py", "--port", str(args.port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+    if args.cpu_budget:
+        server_args += ["--cpu-budget", str(args.cpu_budget)]
+    server = subprocess.Popen(server_args, cwd=ROOT, env=env)
+    try:
+        wait_until_ready(f"{who_url}/stats", 30, who)
+        wait_until_ready(f"{url}/api/reconcile", args.startup_timeout, server)
+        report = run_from_args(url, args)
+        who_requests = httpx.get(f"{who_url}/stats").json()
+        print(json.dumps({"who_requests": who_requests}, indent=2))
+        return report
+    finally:
+        stop(server)
+        stop(who)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,22 @@
     Setup basic web API using FastAPI deployed on the uvicorn server and
     applies CORS middleware to allow cross-origin requests from 
     http://127.0.0.1:3333
+    The Prometheus metrics are exposed on /metrics.
+    The compiled vocabularies are memory-mapped before the first request.
 """
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from reconciliation.api import router as reconciliation_router
+from reconciliation.artifact import load_artifact
+from reconciliation.metrics import metrics_payload
 
 app = FastAPI(title="DrReconcile API", version="1.0.0")
 
+# memory-mapped once here, so the workers of serve.py share the pages
+load_artifact()
+
 # Add CORS middleware
 # https://fastapi.tiangolo.com/tutorial/cors/#use-corsmiddleware
 app.add_middleware(
@@ -29,5 +36,15 @@ app.add_middleware(
 app.include_router(reconciliation_router, prefix="/api",
                    tags=["Reconciliation"])
 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+        Prometheus scrape endpoint with the per-stage latency histograms
+        and the inference scheduler metrics.
+    """
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
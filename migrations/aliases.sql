@@ -0,0 +1,34 @@
+--
+-- Alias table for a database created before it was added to schema.sql, and
+-- the reviewed flag of the aliases. The aliases learned before the flag was
+-- added are kept but must be approved again. It can be run again safely.
+--
+--     psql -U <your_username> -d your_database -f migrations/aliases.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.reconciliation_alias (
+    aliasid serial NOT NULL,
+    type character varying(50) NOT NULL,
+    raw_value character varying(255) NOT NULL,
+    entity_id character varying(255) NOT NULL,
+    entity_name character varying(255) NOT NULL,
+    confidence double precision NOT NULL,
+    source character varying(255),
+    confirmations integer DEFAULT 1 NOT NULL,
+    reviewed boolean DEFAULT false NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    updated_at timestamp with time zone DEFAULT now() NOT NULL,
+    retracted_at timestamp with time zone,
+    CONSTRAINT reconciliation_alias_pkey PRIMARY KEY (aliasid),
+    CONSTRAINT reconciliation_alias_type_raw_value_key UNIQUE (type, raw_value)
+);
+
+ALTER TABLE public.reconciliation_alias
+    ADD COLUMN IF NOT EXISTS reviewed boolean DEFAULT false NOT NULL;
+
+GRANT ALL ON TABLE public.reconciliation_alias TO myuser;
+GRANT ALL ON SEQUENCE public.reconciliation_alias_aliasid_seq TO myuser;
+
+COMMIT;
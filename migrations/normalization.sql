@@ -0,0 +1,64 @@
+--
+-- Normalization objects for a database created before they were added to
+-- schema.sql: the mapping and watermark tables, the updated_at columns and
+-- their trigger. It can be run again safely.
+--
+--     psql -U <your_username> -d your_database -f migrations/normalization.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.reconciliation_mapping (
+    target character varying(100) NOT NULL,
+    raw_value character varying(255) NOT NULL,
+    entity_id character varying(255),
+    entity_name character varying(255),
+    score double precision,
+    min_score double precision,
+    reconciled_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT reconciliation_mapping_pkey PRIMARY KEY (target, raw_value)
+);
+
+ALTER TABLE public.reconciliation_mapping
+    ADD COLUMN IF NOT EXISTS min_score double precision;
+
+CREATE TABLE IF NOT EXISTS public.reconciliation_watermark (
+    target character varying(100) NOT NULL,
+    watermark timestamp with time zone NOT NULL,
+    recorded_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT reconciliation_watermark_pkey PRIMARY KEY (target)
+);
+
+ALTER TABLE public.patient
+    ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone DEFAULT now() NOT NULL;
+ALTER TABLE public.registration
+    ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone DEFAULT now() NOT NULL;
+
+CREATE INDEX IF NOT EXISTS patient_updated_at_idx ON public.patient USING btree (updated_at);
+CREATE INDEX IF NOT EXISTS registration_updated_at_idx ON public.registration USING btree (updated_at);
+
+CREATE OR REPLACE FUNCTION public.set_updated_at() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    -- the normalization job sets drreconcile.skip_tracking, so the values
+    -- it rewrites are not seen as new changes by the next incremental run
+    IF current_setting('drreconcile.skip_tracking', true) IS DISTINCT FROM 'on' THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS patient_set_updated_at ON public.patient;
+CREATE TRIGGER patient_set_updated_at BEFORE UPDATE ON public.patient
+    FOR EACH ROW EXECUTE FUNCTION public.set_updated_at();
+
+DROP TRIGGER IF EXISTS registration_set_updated_at ON public.registration;
+CREATE TRIGGER registration_set_updated_at BEFORE UPDATE ON public.registration
+    FOR EACH ROW EXECUTE FUNCTION public.set_updated_at();
+
+GRANT ALL ON TABLE public.reconciliation_mapping TO myuser;
+GRANT ALL ON TABLE public.reconciliation_watermark TO myuser;
+
+COMMIT;
@@ -0,0 +1,71 @@
+"""
+    ADMIN API
+    Endpoints reserved to the maintainers of the service. Every request must
+    carry the token configured in DRRECONCILE_ADMIN_TOKEN in the X-Admin-Token header.
+"""
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import FileResponse, JSONResponse
+from .aliases import approve_alias, list_aliases, retract_alias
+from .profiling import is_admin, list_profiles, profile_path
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """
+        Dependency rejecting the requests without a valid admin token.
+    """
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+
+@router.get("/profiles")
+async def get_profiles():
+    """
+        This endpoint lists the stored request profiles, newest first.
+    """
+    return JSONResponse(content=list_profiles())
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str):
+    """
+        This endpoint downloads the collapsed stacks of a profile, ready to be
+        turned into a flame graph with flamegraph.pl or opened in speedscope.
+    """
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return FileResponse(path, media_type="text/plain",
+                        filename=f"{profile_id}.collapsed")
+
+@router.get("/aliases")
+async def get_aliases(
+    type_param: str = Query(None, description="Only the aliases of this type"),
+    include_retracted: bool = Query(False)
+):
+    """
+        This endpoint lists the aliases learned from the confirmed matches,
+        with their confidence, provenance and number of confirmations, for review.
+    """
+    return JSONResponse(content=await list_aliases(type_param, include_retracted))
+
+@router.post("/aliases/{alias_id}/approve")
+async def approve(alias_id: int):
+    """
+        This endpoint approves an alias learned from an upload without the
+        admin token: from then on reconcile() returns it without scoring.
+    """
+    if not await approve_alias(alias_id):
+        raise HTTPException(status_code=404, detail=f"Alias not found: {alias_id}")
+    return JSONResponse(content={"status": "approved", "aliasid": alias_id})
+
+@router.delete("/aliases/{alias_id}")
+async def delete_alias(alias_id: int):
+    """
+        This endpoint retracts an alias: it is kept in the table for review,
+        but reconcile() no longer returns it.
+    """
+    if not await retract_alias(alias_id):
+        raise HTTPException(status_code=404, detail=f"Alias not found: {alias_id}")
+    return JSONResponse(content={"status": "retracted", "aliasid": alias_id})
@@ -0,0 +1,298 @@
+"""
+    ALIASES
+    Memory of the matches confirmed by the users. When a reconciled file is
+    uploaded to /fetch-update-reconciled-data, the value each row had before
+    the update and the entity it was reconciled to are stored in the
+    reconciliation_alias table, with their confidence and provenance.
+    A value that is itself a label, of the vocabulary or of the upload, was
+    relabelled rather than confirmed, and is never learned.
+    reconcile() looks every query up in an in-memory copy of the table first,
+    and a known alias is returned as a match without scoring the candidates.
+    Only the reviewed aliases are used: those uploaded with the admin token,
+    or approved with the admin endpoints. Retracted aliases are kept in the
+    table, for review, but no longer used.
+"""
+import threading
+import time
+from sqlalchemy import text
+from database.engine import get_async_engine
+from .config import ALIASES_ENABLED, ALIAS_REFRESH_S
+from .scoring import (
+    ETHNICITY_TYPE,
+    SEXUAL_ORIENTATION_TYPE,
+    ICD11_TYPE,
+    normalize,
+    so_aliases
+)
+
+STAGE_ALIAS = "alias"
+RECONCILE_TYPES = {
+    "/ethnicity": ETHNICITY_TYPE,
+    "/sexual-orientation": SEXUAL_ORIENTATION_TYPE,
+    "/icd11": ICD11_TYPE,
+}
+# confidence of a value confirmed by a user
+CONFIRMED_CONFIDENCE = 1.0
+# length of the varchar columns of reconciliation_alias
+MAX_VALUE_LENGTH = 255
+# an upload that is not reviewed cannot re-point a reviewed alias
+REPOINT_CONDITION = """EXCLUDED.reviewed
+              OR NOT reconciliation_alias.reviewed
+              OR reconciliation_alias.entity_id = EXCLUDED.entity_id"""
+
+ACTIVE_ALIASES = text("""
+    SELECT type, raw_value, entity_id, entity_name, confidence
+    FROM reconciliation_alias
+    WHERE retracted_at IS NULL AND reviewed
+""")
+
+
+class AliasMemory:
+    """
+        In-memory map (type, normalized value) -> entity of the active aliases.
+        The whole map is replaced when it is reloaded from the database, and
+        the aliases learned or retracted by this process are applied to it
+        directly, so lookups never wait for the database.
+    """
+
+    def __init__(self, refresh_s=ALIAS_REFRESH_S):
+        self.refresh_s = refresh_s
+        self._aliases = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def replace(self, rows):
+        """
+            It replaces the map with the given
+            (type, raw_value, entity_id, entity_name, confidence) rows.
+        """
+        aliases = {(type_param, normalize(raw)): (entity_id, name, confidence)
+                   for type_param, raw, entity_id, name, confidence in rows}
+        with self._lock:
+            self._aliases = aliases
+            self._loaded_at = time.monotonic()
+
+    def touch(self):
+        """
+            It keeps the current map for another refresh_s.
+        """
+        self._loaded_at = time.monotonic()
+
+    def is_stale(self):
+        """
+            True before the first load and once the map is older than refresh_s.
+        """
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_s
+
+    def add(self, type_param, raw_value, entity_id, entity_name, confidence):
+        """
+            It adds an alias learned by this process.
+        """
+        with self._lock:
+            self._aliases[(type_param, normalize(raw_value))] = (entity_id, entity_name,
+                                                                 confidence)
+
+    def update(self, rows):
+        """
+            It adds the given (type, raw_value, entity_id, entity_name, confidence) rows.
+        """
+        for type_param, raw, entity_id, name, confidence in rows:
+            self.add(type_param, raw, entity_id, name, confidence)
+
+    def discard(self, type_param, raw_value):
+        """
+            It removes a retracted alias.
+        """
+        with self._lock:
+            self._aliases.pop((type_param, normalize(raw_value)), None)
+
+    def lookup(self, type_param, query_string):
+        """
+            The alias match of the query for the type, None when unknown.
+        """
+        if not ALIASES_ENABLED:
+            return None
+        alias = self._aliases.get((type_param, normalize(query_string)))
+        if alias is None:
+            return None
+        entity_id, entity_name, confidence = alias
+        return {
+            "id": entity_id,
+            "name": entity_name,
+            "score": round(100 * confidence, 2),
+            "match": True,
+            "stage": STAGE_ALIAS,
+            "type": RECONCILE_TYPES[type_param]
+        }
+
+    def __len__(self):
+        return len(self._aliases)
+
+
+alias_memory = AliasMemory()
+
+
+async def refresh_aliases():
+    """
+        It reloads the alias memory when it is stale. The aliases only save
+        scoring work, so when the table cannot be read the memory is kept
+        as it is and the queries are scored as usual.
+    """
+    if not ALIASES_ENABLED or not alias_memory.is_stale():
+        return
+    try:
+        async with get_async_engine().connect() as conn:
+            result = await conn.execute(ACTIVE_ALIASES)
+            alias_memory.replace(result.fetchall())
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"Alias Error: {e}")
+        # retry after refresh_s instead of on every request
+        alias_memory.touch()
+
+def load_aliases(engine):
+    """
+        It loads the alias memory with a synchronous engine, for the command line jobs.
+    """
+    if not ALIASES_ENABLED:
+        return
+    with engine.connect() as conn:
+        alias_memory.replace(conn.execute(ACTIVE_ALIASES).fetchall())
+
+def entity_ids(vocabulary, type_param):
+    """
+        It returns name -> reconciliation id of the labels of a vocabulary.
+    """
+    return {name: f"{type_param}/{entity_id}" for entity_id, name in vocabulary}
+
+def canonical_values(vocabulary, type_param):
+    """
+        The normalized labels of a vocabulary, and the aliases the exact stage
+        matches for the sexual orientation labels: an alias must not take
+        them over.
+    """
+    values = set()
+    for _, name in vocabulary:
+        values.add(normalize(name))
+        if type_param == "/sexual-orientation":
+            values.update(normalize(alias) for alias in so_aliases(name))
+    return values
+
+async def learn_aliases(conn, type_param, pairs, source, canonical=(), reviewed=False):
+    """
+        It stores the confirmed (raw value, entity id, entity name) pairs in the
+        connection's transaction and returns the aliases stored, as
+        (type, raw_value, entity_id, entity_name, confidence, active, reviewed) rows.
+        The active ones are added to the memory once the transaction is committed.
+        A pair whose raw value is a canonical value or the name of one of the
+        pairs is a relabel (White - British corrected to White - Irish) and is
+        skipped, as are the values too long for the table. The aliases not
+        reviewed are kept for review, but inactive.
+        A pair confirmed again counts one more confirmation and a retracted
+        alias stays retracted. A reviewed alias stays reviewed, and an upload
+        that is not reviewed leaves it alone when it names another entity.
+    """
+    canonical = set(canonical) | {normalize(name) for _, _, name in pairs if name}
+    # one alias per normalized value, the last confirmation wins
+    aliases = {normalize(raw): (entity_id, name) for raw, entity_id, name in pairs
+               if entity_id and normalize(raw) not in canonical
+               and max(len(normalize(raw)), len(entity_id), len(name or "")) <= MAX_VALUE_LENGTH}
+    if not aliases:
+        return []
+    result = await conn.execute(
+        text(f"""
+            INSERT INTO reconciliation_alias
+                (type, raw_value, entity_id, entity_name, confidence, source, reviewed)
+            SELECT :type, v.raw_value, v.entity_id, v.entity_name, :confidence, :source,
+                   :reviewed
+            FROM unnest(CAST(:raw_values AS text[]), CAST(:entity_ids AS text[]),
+                        CAST(:entity_names AS text[]))
+                AS v(raw_value, entity_id, entity_name)
+            ON CONFLICT (type, raw_value) DO UPDATE
+            SET entity_id = EXCLUDED.entity_id,
+                entity_name = EXCLUDED.entity_name,
+                confidence = EXCLUDED.confidence,
+                source = EXCLUDED.source,
+                confirmations = reconciliation_alias.confirmations + 1,
+                reviewed = reconciliation_alias.reviewed OR EXCLUDED.reviewed,
+                updated_at = now()
+            WHERE {REPOINT_CONDITION}
+            RETURNING type, raw_value, entity_id, entity_name, confidence,
+                      retracted_at IS NULL AND reviewed AS active, reviewed
+        """),
+        {
+            "type": type_param,
+            "confidence": CONFIRMED_CONFIDENCE,
+            "source": source,
+            "reviewed": reviewed,
+            "raw_values": list(aliases),
+            "entity_ids": [entity_id for entity_id, _ in aliases.values()],
+            "entity_names": [name for _, name in aliases.values()],
+        }
+    )
+    return [tuple(row) for row in result.fetchall()]
+
+async def list_aliases(type_param=None, include_retracted=False):
+    """
+        It returns the aliases for review, the most recently confirmed first.
+    """
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(
+            text("""
+                SELECT aliasid, type, raw_value, entity_id, entity_name, confidence,
+                       source, confirmations, reviewed, created_at, updated_at,
+                       retracted_at
+                FROM reconciliation_alias
+                WHERE (CAST(:type AS text) IS NULL OR type = :type)
+                  AND (CAST(:include_retracted AS boolean) OR retracted_at IS NULL)
+                ORDER BY updated_at DESC
+            """),
+            {"type": type_param, "include_retracted": include_retracted}
+        )
+        return [
+            {
+                **row,
+                "created_at": row["created_at"].isoformat(),
+                "updated_at": row["updated_at"].isoformat(),
+                "retracted_at": row["retracted_at"] and row["retracted_at"].isoformat(),
+            } for row in result.mappings()
+        ]
+
+async def retract_alias(alias_id):
+    """
+        It retracts an alias, which is no longer used by reconcile(),
+        and returns False when there is no active alias with that id.
+    """
+    async with get_async_engine().begin() as conn:
+        row = (await conn.execute(
+            text("""
+                UPDATE reconciliation_alias
+                SET retracted_at = now()
+                WHERE aliasid = :aliasid AND retracted_at IS NULL
+                RETURNING type, raw_value
+            """),
+            {"aliasid": alias_id}
+        )).first()
+    if row is None:
+        return False
+    alias_memory.discard(row.type, row.raw_value)
+    return True
+
+async def approve_alias(alias_id):
+    """
+        It marks an alias as reviewed, so that reconcile() returns it,
+        and returns False when there is no active alias with that id.
+    """
+    async with get_async_engine().begin() as conn:
+        row = (await conn.execute(
+            text("""
+                UPDATE reconciliation_alias
+                SET reviewed = true, updated_at = now()
+                WHERE aliasid = :aliasid AND retracted_at IS NULL
+                RETURNING type, raw_value, entity_id, entity_name, confidence
+            """),
+            {"aliasid": alias_id}
+        )).first()
+    if row is None:
+        return False
+    alias_memory.add(*row)
+    return True
@@ -2,27 +2,67 @@
     RECONCILIATION SERVICE API
 """
 from urllib.parse import parse_qs
+import asyncio
 import json
-import pandas as pd
+import requests
 from sqlalchemy import text
-from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Query
+from fastapi import APIRouter, HTTPException, Request, Response, UploadFile, File, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
-from thefuzz import fuzz
-from database.engine import get_engine
+from database.engine import get_async_engine
 from .helper import (
-    partial_ratio,
-    cosine_similarity,
     get_token,
     query_icd11_api,
-    remove_html_tags,
-    sap_encode,
-    encode
+    sap_scheduler,
+    sbert_scheduler
+)
+from .admin import router as admin_router
+from .artifact import compiled_section
+from .aliases import (
+    alias_memory,
+    canonical_values,
+    entity_ids,
+    learn_aliases,
+    refresh_aliases
+)
+from .config import ICD_RESERVE_S, ICD_TIMEOUT_S, STREAM_MAX_IN_FLIGHT
+from .deadline import (
+    DEGRADATION_FAILED,
+    DEGRADATION_UNSCORED,
+    DeadlineExceeded,
+    allows,
+    begin_query,
+    budget_from_header,
+    degradation,
+    expired as deadline_expired,
+    skip,
+    start_deadline,
+    time_left
+)
+from .icd_cache import IcdUnavailable, icd_cache
+from .metrics import register_scheduler, stage, start_request, timing_headers
+from .profiling import is_admin, profile_request, profile_headers, run_profiled
+from .scoring import score_ethnicity, score_sexual_orientation, score_icd11
+from .serialization import compact_line, dumps, encode_response, is_compact
+from .streaming import BodyStreamingResponse, iter_queries, read_body
+from .type_inference import TYPES, TypeRouter, classifier_for
+from .uploads import iter_updates, upload_format
+from .vocabulary import (
+    TYPE_TARGETS,
+    VOCABULARY_QUERIES,
+    fetch_vocabularies,
+    needed_vocabularies
 )
 
 
 router = APIRouter()
+router.include_router(admin_router)
+
+# stage skipped when the ICD-11 search cannot run
+STAGE_ICD11 = "icd11"
 
-engine = get_engine()
+register_scheduler(sap_scheduler)
+register_scheduler(sbert_scheduler)
 
 
 @router.get("/reconcile")
@@ -64,6 +104,120 @@ async def get_manifest():
 
     return JSONResponse(content=manifest)
 
+def _search_icd11(search_term):
+    """
+        It returns all the ICD-11 search results of the term, for the cache.
+        Each call gets at most the time left to the request, and a call
+        abandoned because of the deadline raises DeadlineExceeded.
+    """
+    try:
+        # get the token
+        with stage("who_token", "/icd11"):
+            timeout = time_left(ICD_TIMEOUT_S)
+            access_token = get_token(timeout)
+        # query the ICD-11 API
+        with stage("icd_search", "/icd11"):
+            timeout = time_left(ICD_TIMEOUT_S)
+            return query_icd11_api(search_term, access_token, None, timeout)
+    except requests.Timeout as e:
+        if timeout < ICD_TIMEOUT_S:
+            raise DeadlineExceeded(f"ICD-11 call cut by the request budget: {e}") from e
+        raise
+
+def reconcile_query(q, vocabularies, types=None):
+    """
+        This function scores a single query against the vocabularies of
+        the ethnicity and sexual_orientation tables and the ICD-11 API,
+        and returns the best matches. A typed query is only searched in its type,
+        an untyped one in the given types, or in all of them.
+    """
+    # this is the string to reconcile
+    query_string = q.get("query", "").strip()
+    # matches to return are limited to 5
+    limit = q.get("limit", 5)
+    # type to search between ethnicity and sexual orientation
+    type_param = q.get("type")
+    if type_param:
+        types = {type_param}
+    elif types is None:
+        types = set(TYPES)
+
+    # values already confirmed by a user are returned without scoring
+    aliases = [alias for alias in (alias_memory.lookup(t, query_string) for t in sorted(types))
+               if alias is not None]
+    if aliases:
+        return aliases[:limit]
+
+    matches = []
+
+    # If type is specified as '/ethnicity', only search ethnicity
+    if "/ethnicity" in types:
+        matches.extend(score_ethnicity(query_string, vocabularies["/ethnicity"], limit))
+
+    # If type is specified as '/sexual-orientation', only search sexual_orientation
+    if "/sexual-orientation" in types:
+        rows = vocabularies["/sexual-orientation"]
+        matches.extend(score_sexual_orientation(query_string, rows,
+                                                compiled_section("/sexual-orientation", rows)))
+
+    # If type is specified as '/icd-11', only search diagnosis
+    if "/icd11" in types:
+        icd_results = []
+        # the search is skipped when the request is running out of time
+        if allows(STAGE_ICD11, ICD_RESERVE_S):
+            # the search responses are cached, the API is only called on a miss
+            try:
+                icd_results = icd_cache.search(query_string, limit, _search_icd11)
+            except (IcdUnavailable, DeadlineExceeded) as e:
+                # the other queries of the batch are still answered
+                print(f"Reconciliation Error: {e}")
+                skip(STAGE_ICD11)
+        matches.extend(score_icd11(query_string, icd_results))
+
+    # Sort matches by score in descending order and limit results
+    return sorted(matches, key=lambda x: x["score"], reverse=True)[:limit]
+
+def reconcile_key(q, vocabularies, types=None):
+    """
+        This function reconciles one query of a batch within the request budget
+        and returns its matches with its degradation fields (see deadline.py).
+        A query reached after the deadline is not scored, and an error only
+        fails its own query.
+    """
+    if deadline_expired():
+        return [], degradation(DEGRADATION_UNSCORED)
+    begin_query()
+    try:
+        matches = reconcile_query(q, vocabularies, types)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"Reconciliation Error: {e}")
+        return [], degradation(DEGRADATION_FAILED)
+    return matches, degradation()
+
+def reconcile_queries(payload, vocabularies):
+    """
+        This function reconciles every query of the payload and returns
+        the results keyed as in the payload. The untyped queries are only
+        searched in the types the router finds plausible, given the query and
+        the types of the queries before it in the batch.
+    """
+    router = TypeRouter(classifier_for(vocabularies))
+    response = {}
+    for key, q in payload.items():
+        types = None
+        if q.get("type"):
+            router.observe(q["type"])
+        else:
+            types = router.route(q.get("query", ""))
+
+        matches, fields = reconcile_key(q, vocabularies, types)
+        # a matched untyped query tells the type of the column
+        if types is not None and matches and matches[0]["match"]:
+            router.observe(matches[0]["type"][0]["id"])
+
+        response[key] = {"result": matches, **fields}
+    return response
+
 @router.post("/reconcile")
 async def reconcile(request: Request):
     """
@@ -76,9 +230,16 @@ async def reconcile(request: Request):
     For each match, it constructs a response object containing 
     the id, name, score, match status, and type metadata. 
     The response is then structured as a dictionary of query results and 
-    returned as a JSON response. If any error occurs during processing,
-    it raises an exception.
+    returned as a JSON response, with compact candidates when the request
+    asks for them with compact=1 and compressed when the client accepts it
+    (see serialization.py). The queries share the request budget and
+    each key reports its degradation (see deadline.py), so a slow stage or a
+    failing query does not lose the others. If any other error occurs
+    during processing, it raises an exception.
     """
+    timings = start_request()
+    # the budget runs from here, every stage of every query checks it
+    start_deadline(budget_from_header(request.headers.get("X-Request-Budget-Ms")))
     try:
         # Decode and parse the request body sent by OpenRefine
         raw_body = await request.body()
@@ -106,212 +267,247 @@ async def reconcile(request: Request):
             raise HTTPException(status_code=400,
                                 detail="Empty payload. Please provide a valid query.")
 
-        response = {}
-
-        with engine.connect() as conn:
-            for key, q in payload.items():
-                # this is the string to reconcile
-                query_string = q.get("query", "").strip()
-                # matches to return are limited to 5
-                limit = q.get("limit", 5)
-                # type to search between ethnicity and sexual orientation
-                type_param = q.get("type")
-                matches = []
-
-                # If type is specified as '/ethnicity', only search ethnicity
-                if type_param == "/ethnicity" or not type_param:
-                    ethnicity_query = conn.execute(
-                        text("SELECT ethnicityid, description FROM ethnicity")
-                    ).fetchall()
-
-                    for row in ethnicity_query:
-                        ethnicity_id = row[0]
-                        description = row[1]
-                        # Calculates similarity score with each entry
-                        score = partial_ratio(query_string, description)
-                        matches.append({
-                            "id": f"/ethnicity/{ethnicity_id}",
-                            "name": description,
-                            "score": score,
-                            "match": score >= 90,
-                            "type": [{"id": "/ethnicity", "name": "Ethnicity"}]
-                        })
-
-                # If type is specified as '/sexual-orientation', only search sexual_orientation
-                if type_param == "/sexual-orientation" or not type_param:
-                    so_query = conn.execute(
-                        text("SELECT soid, soname FROM sexual_orientation")
-                    ).fetchall()
-
-                    for row in so_query:
-                        so_id = row[0]
-                        soname = row[1]
-
-                        # Normalize candidate labels:
-                        # Lowercase
-                        # Remove parentheses
-                        # Split on “or” and treat as multiple aliases
-                        # (e.g., “Gay or Lesbian” becomes ["Gay", "Lesbian"])
-
-                        # Normalize and clean the soname string
-                        clean_soname = soname.lower().replace("(", "").replace(")", "")
-                        # Split and strip each alias
-                        aliases = [a.strip() for a in clean_soname.split("or")]
-                        # Lowercase the query once
-                        query_encoded = encode(query_string.lower())
-                        # Compute similarity scores for each alias
-                        scores = [
-                            cosine_similarity(query_encoded, encode(alias))
-                            for alias in aliases
-                        ]
-                        max_score = max(scores)
-                        # Semantic similarity
-                        semantic_score = max_score * 100
-
-                        # Lexical similarity
-                        lexical_score = partial_ratio(query_string, soname)
-
-                        # Match if either score is above threshold
-                        is_match = bool(semantic_score >= 90 or lexical_score >= 90)
-
-                        matches.append({
-                            "id": f"/sexual-orientation/{so_id}",
-                            "name": soname,
-                            "semantic_score": round(semantic_score, 2),
-                            "lexical_score": lexical_score,
-                            "score": max(semantic_score, lexical_score),
-                            "match": is_match,
-                            "type": [{"id": "/sexual-orientation", "name": "Sexual Orientation"}]
-                        })
-
-                # If type is specified as '/icd-11', only search diagnosis
-                if type_param == "/icd11" or not type_param:
-                    # get the token
-                    access_token = get_token()
-                    # query the ICD-11 API
-                    icd_results = query_icd11_api(query_string, access_token, limit)
-
-                    # for each term in the list
-                    for entity in icd_results:
-                        # Extract the unique ICD identifier for the entity
-                        icd_id = entity.get("id", None)
-                        # Extract and clean the title by removing any HTML tags
-                        title = remove_html_tags(entity.get("title", ""))
-                        # Calculate the similarity score between the query string and the ICD title
-                        # Semantic similarity
-                        sap_query_vec = sap_encode(query_string)
-                        sap_title_vec = sap_encode(title)
-                        sap_score = cosine_similarity(sap_query_vec, sap_title_vec) * 100
-
-                        sbert_query_vec = encode(query_string)
-                        sbert_title_vec = encode(title)
-                        sbert_score = cosine_similarity(sbert_query_vec, sbert_title_vec) * 100
-
-                        # Combine scores
-                        semantic_score = max(sap_score, sbert_score)
-                        #semantic_score = sap_score
-                        #semantic_score = sbert_score
-
-                        # Lexical similarity
-                        lexical_score = fuzz.partial_ratio(query_string, title)
-
-                        # Match logic
-                        is_match = bool(semantic_score >= 90 or lexical_score >= 90)
-                        #is_match = bool(lexical_score >= 90)
-
-                        matches.append({
-                            "id": icd_id,
-                            "name": title,
-                            "semantic_score": round(semantic_score, 2),
-                            "lexical_score": lexical_score,
-                            #"score": lexical_score,
-                            "score": max(semantic_score, lexical_score),
-                            "match": is_match,
-                            "type": [{"id": "/icd11", "name": "Diagnosis"}]
-                        })
-
-                # Sort matches by score in descending order and limit results
-                matches = sorted(matches, key=lambda x: x["score"], reverse=True)[:limit]
-
-                response[key] = {
-                    "result": matches
-                }
-
-        return JSONResponse(content=response)
+        # the scoring blocks on the models, so it runs in the threadpool and
+        # the event loop stays free to accept the concurrent requests whose
+        # texts are batched together by the inference schedulers
+        # the vocabularies are loaded once for the whole batch,
+        # awaiting the database without blocking the event loop
+        vocabularies = await fetch_vocabularies(needed_vocabularies(payload))
+        await refresh_aliases()
+
+        capture = profile_request(request, "reconcile")
+        response = await run_in_threadpool(run_profiled, capture,
+                                           reconcile_queries, payload, vocabularies)
+
+        return encode_response(response, request, timings, profile_headers(capture))
 
     except Exception as e:
         print(f"Reconciliation Error: {e}")
         raise HTTPException(status_code=500,
                             detail=f"Error performing reconciliation: {str(e)}") from e
 
-@router.post("/fetch-update-reconciled-data")
-# endpoint parameters: uploading file and selecting the type_param
-async def fetch_update_reconciled_data(
-    file: UploadFile = File(...),
-    type_param: str = Query(..., description="This is the GET id")
-):
+async def _stream_results(queries, vocabularies, compact=False,
+                         max_in_flight=STREAM_MAX_IN_FLIGHT):
     """
-       This endpoint handles a CSV file upload to update the database with reconciled values.
-       The uploaded file is read as DataFrame and for each row, the script extracts the 
-       patientid and the corresponding column value. Depending on the table, it updates 
-       specific attributes and append the results.
+        It scores the queries as they are received, at most max_in_flight
+        at a time, and yields one NDJSON line per key in completion order,
+        with compact candidates when asked (see serialization.py).
+        Reading stops while max_in_flight queries are being scored, so a large
+        batch is never held in memory. A query that fails gets an error line,
+        a malformed payload ends the stream with an error line.
     """
+    router = TypeRouter(classifier_for(vocabularies))
+    lines = asyncio.Queue()
+    slots = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+
+    async def score(key, q, types):
+        try:
+            matches, fields = await run_in_threadpool(reconcile_key, q, vocabularies, types)
+            # a matched untyped query tells the type of the column
+            if types is not None and matches and matches[0]["match"]:
+                router.observe(matches[0]["type"][0]["id"])
+            line = {"key": key, "result": matches, **fields}
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Reconciliation Error: {e}")
+            line = {"key": key, "error": str(e)}
+        finally:
+            slots.release()
+        await lines.put(line)
+
+    async def read():
+        try:
+            async for key, q in queries:
+                await slots.acquire()
+                types = None
+                if q.get("type"):
+                    router.observe(q["type"])
+                else:
+                    types = router.route(q.get("query", ""))
+                tasks.add(asyncio.create_task(score(key, q, types)))
+        except ValueError as e:
+            await lines.put({"error": str(e)})
+        await asyncio.gather(*tasks)
+        # every line has been queued
+        await lines.put(None)
+
+    reader = asyncio.create_task(read())
+    try:
+        while (line := await lines.get()) is not None:
+            yield dumps(compact_line(line) if compact else line) + b"\n"
+        await reader
+    finally:
+        reader.cancel()
+        for task in tasks:
+            task.cancel()
+
+@router.post("/reconcile/stream")
+async def reconcile_stream(request: Request):
+    """
+        Streaming variant of /reconcile for very large batches, with the same
+        body (the form sent by OpenRefine or the JSON object of the queries).
+        The queries are parsed while the body is received and every result is
+        sent as soon as it is ready, as a line {"key": ..., "result": [...]}
+        of an application/x-ndjson response, in completion order.
+        The queries share the request budget, as those of /reconcile.
+    """
+    start_request()
+    # the budget runs from here, the scoring tasks inherit it
+    start_deadline(budget_from_header(request.headers.get("X-Request-Budget-Ms")))
+    body_read = asyncio.Event()
+    queries = iter_queries(read_body(request, body_read),
+                           request.headers.get("content-type", ""))
     try:
-        df = pd.read_csv(file.file)
+        first = await anext(queries)
+    except StopAsyncIteration as e:
+        raise HTTPException(status_code=400,
+                            detail="Empty payload. Please provide a valid query.") from e
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    async def all_queries():
+        yield first
+        async for query in queries:
+            yield query
+
+    # the types of the queries are not known before reading them all
+    vocabularies = await fetch_vocabularies(set(VOCABULARY_QUERIES))
+    await refresh_aliases()
+    return BodyStreamingResponse(_stream_results(all_queries(), vocabularies,
+                                                 is_compact(request)),
+                                 body_read, media_type="application/x-ndjson")
+
+@router.get("/inference-stats")
+async def inference_stats():
+    """
+        This endpoint returns the queue depth and the batch-size metrics
+        of the SapBERT and SBERT inference schedulers.
+    """
+    return JSONResponse(content={
+        "sapbert": sap_scheduler.stats(),
+        "sbert": sbert_scheduler.stats()
+    })
 
-        # Determine the column and table to update
-        match type_param:
-            case "/ethnicity":
-                column_name = "ethnicity"
-                table = "patient"
-            case "/sexual-orientation":
-                column_name = "sexual_orientation"
-                table = "patient"
-            case "/icd11":
-                column_name = "reason_for_admission"
-                table = "registration"
-            case _:
-                raise HTTPException(status_code=400, detail=f"Unsupported type: {type_param}")
-
-        updated_rows = []
-
-        # Iterate through the DataFrame and run updates
-        with engine.begin() as conn:
-            for _, row in df.iterrows():
-                patientid = row.get("patientid")
-                value = row.get(column_name)
-
-                # skip missing values
-                if pd.isna(patientid) or pd.isna(value):
-                    continue
-
-                # for each table a different update query
-                if table == "patient":
-                    conn.execute(
-                        text(f"""
-                            UPDATE patient
-                            SET {column_name} = :value
-                            WHERE patientid = :patientid
-                        """),
-                        {"value": value, "patientid": patientid}
-                    )
-                elif table == "registration":
-                    conn.execute(
-                        text("""
-                            UPDATE registration
-                            SET reason_for_admission = :value
-                            WHERE patientid = :patientid
-                        """),
-                        {"value": value, "patientid": patientid}
-                    )
+async def _write_reconciled_values(type_param, updates, update_ids, source,
+                                   canonical=(), reviewed=False):
+    """
+        It writes all the reconciled values with a single UPDATE, joining the
+        table with the arrays of patient ids and values, in one transaction.
+        The values the rows had before the update are learned, in the same
+        transaction, as aliases of the entities they were reconciled to,
+        unless they are canonical values themselves (see learn_aliases).
+        It returns the aliases learned.
+    """
+    if not updates:
+        return []
+    table, column_name = TYPE_TARGETS[type_param]
+    patientids = list(updates)
+    async with get_async_engine().begin() as conn:
+        previous = await conn.execute(
+            text(f"""
+                SELECT patientid, {column_name} FROM {table}
+                WHERE patientid = ANY(CAST(:patientids AS integer[]))
+            """),
+            {"patientids": patientids}
+        )
+        confirmed = [(old_value, update_ids.get(patientid), updates[patientid])
+                     for patientid, old_value in previous.fetchall() if old_value]
+        await conn.execute(
+            text(f"""
+                UPDATE {table} AS t
+                SET {column_name} = u.value
+                FROM unnest(CAST(:patientids AS integer[]), CAST(:reconciled AS text[]))
+                    AS u(patientid, value)
+                WHERE t.patientid = u.patientid
+            """),
+            {"patientids": patientids, "reconciled": list(updates.values())}
+        )
+        learned = await learn_aliases(conn, type_param, confirmed, source,
+                                      canonical, reviewed)
+    # the aliases waiting for review do not short-circuit the scoring
+    alias_memory.update(row[:5] for row in learned if row[5])
+    return learned
+
+def _collect_updates(fileobj, fmt, type_param, column_name, ids_by_name):
+    """
+        It reads the uploaded file and returns the reconciled value and the
+        entity id of each patient (the last row of a patient wins), and the
+        updated rows listed in the response.
+    """
+    updated_rows = []
+    updates = {}
+    update_ids = {}
+    with stage("parse", type_param):
+        for patientids, values, ids in iter_updates(fileobj, fmt, column_name):
+            for patientid, value, entity_id in zip(patientids, values, ids):
+                updates[patientid] = value
+                update_ids[patientid] = (entity_id if entity_id is not None
+                                         else ids_by_name.get(value))
                 # updated rows will list in the Swagger UI
                 updated_rows.append({
                     "patientid": patientid,
                     "updated_field": column_name,
                     "new_value": value
                 })
+    return updates, update_ids, updated_rows
+
+@router.post("/fetch-update-reconciled-data")
+# endpoint parameters: uploading file and selecting the type_param
+async def fetch_update_reconciled_data(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    type_param: str = Query(..., description="This is the GET id"),
+    format_param: str = Query(None, alias="format",
+                              description="csv, parquet or arrow, detected when omitted")
+):
+    """
+       This endpoint handles a CSV, Parquet or Arrow IPC file upload to update
+       the database with reconciled values. The file is read a batch at a time
+       (see uploads.py) and for each row, the script extracts the
+       patientid and the corresponding column value. Depending on the table, it updates 
+       specific attributes and append the results. All the values are written
+       with a single bulk UPDATE through the async engine.
+       The replaced values are remembered as aliases of the reconciled entities,
+       whose ids are read from the <column>_id column when the file has one,
+       or looked up by name in the ethnicity and sexual orientation tables.
+       The aliases are only used by reconcile() once reviewed: at once when the
+       upload carries the X-Admin-Token header, otherwise after their approval
+       on /admin/aliases/{aliasid}/approve.
+    """
+    timings = start_request()
+    capture = profile_request(request, "update")
+    try:
+        fmt = upload_format(file.file, file.filename, file.content_type, format_param)
 
-        return {"status": "success", "updated_rows": updated_rows}
+        # Determine the column and table to update
+        if type_param not in TYPE_TARGETS:
+            raise HTTPException(status_code=400, detail=f"Unsupported type: {type_param}")
+        _, column_name = TYPE_TARGETS[type_param]
+
+        ids_by_name = {}
+        canonical = set()
+        if type_param in VOCABULARY_QUERIES:
+            vocabularies = await fetch_vocabularies({type_param})
+            ids_by_name = entity_ids(vocabularies[type_param], type_param)
+            canonical = canonical_values(vocabularies[type_param], type_param)
+
+        # the file is read in the threadpool, where the profiler samples it
+        # without seeing the other requests served by the event loop
+        updates, update_ids, updated_rows = await run_in_threadpool(
+            run_profiled, capture, _collect_updates,
+            file.file, fmt, type_param, column_name, ids_by_name)
+
+        with stage("postgres", type_param):
+            learned = await _write_reconciled_values(
+                type_param, updates, update_ids, f"upload:{file.filename}", canonical,
+                reviewed=is_admin(request.headers.get("X-Admin-Token")))
+
+        response.headers.update(timing_headers(timings))
+        response.headers.update(profile_headers(capture))
+        return {"status": "success", "updated_rows": updated_rows,
+                "learned_aliases": len(learned),
+                "aliases_pending_review": sum(1 for row in learned if not row[6])}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update database: {str(e)}") from e
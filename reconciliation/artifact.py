@@ -0,0 +1,267 @@
+"""
+    VOCABULARY ARTIFACT
+    The reference vocabularies compiled ahead of time into a single versioned
+    file: for every type the ids, labels, normalized labels, aliases, an
+    exact-match hash table and the SBERT and SapBERT embeddings of the aliases,
+    all stored as NumPy arrays. The service memory-maps the file, so a new
+    worker is ready at once and all the workers share the same pages.
+    Every type carries the fingerprint of the rows it was compiled from. When
+    the file is missing, or the rows read from the database no longer match
+    the fingerprint, the section is built from the rows instead and kept in
+    memory, as before the artifact existed.
+
+    File layout: 8 bytes magic, 8 bytes header length, JSON header,
+    then the arrays, each aligned to 64 bytes.
+
+    Usage:
+        python -m reconciliation.artifact build --output vocabulary.drvocab
+        python -m reconciliation.artifact info vocabulary.drvocab
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from .config import VOCAB_ARTIFACT
+from .helper import MODEL_NAME, SBERT_MODEL_NAME, encode_many, sap_encode_many
+from .scoring import normalize, so_aliases
+
+MAGIC = b"DRVOCAB\0"
+# 2: the sexual orientation labels are only split on the word "or"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+# aliases of the labels of each type, the label itself by default
+ALIASES = {
+    "/sexual-orientation": so_aliases,
+}
+
+
+def _slug(type_param):
+    return type_param.strip("/").replace("-", "_")
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+def fingerprint(type_param, rows):
+    """
+        It identifies the rows of a vocabulary together with everything
+        the compiled section depends on: format, normalization and models.
+    """
+    payload = json.dumps([FORMAT_VERSION, MODEL_NAME, SBERT_MODEL_NAME, type_param,
+                          [[str(i), label] for i, label in rows]])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def aliases_of(type_param, label):
+    """
+        The aliases of a label, as the scoring compares them.
+    """
+    return ALIASES.get(type_param, lambda value: [normalize(value)])(label)
+
+
+class VocabularySection:
+    """
+        The compiled vocabulary of one type. The arrays are either built in
+        memory or views of the memory-mapped artifact.
+    """
+
+    def __init__(self, type_param, fingerprint_value, arrays):
+        self.type_param = type_param
+        self.fingerprint = fingerprint_value
+        self.arrays = arrays
+        self._groups = None
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["arrays"][name]
+        except KeyError as e:
+            raise AttributeError(name) from e
+
+    def exact(self, normalized_query):
+        """
+            The indices of the rows with a label or alias equal to the
+            normalized query, found by binary search of the sorted hashes.
+        """
+        if not normalized_query:
+            return []
+        key = np.uint64(_hash(normalized_query))
+        hashes = self.arrays["exact_hashes"]
+        start = np.searchsorted(hashes, key, side="left")
+        end = np.searchsorted(hashes, key, side="right")
+        keys, rows = self.arrays["exact_keys"], self.arrays["exact_rows"]
+        return sorted({int(rows[i]) for i in range(start, end) if keys[i] == normalized_query})
+
+    def alias_groups(self):
+        """
+            The alias indices of every row, in row order.
+        """
+        if self._groups is None:
+            groups = [[] for _ in range(len(self.arrays["ids"]))]
+            for index, owner in enumerate(self.arrays["alias_owner"]):
+                groups[int(owner)].append(index)
+            self._groups = groups
+        return self._groups
+
+
+def build_section(type_param, rows, encoders=None):
+    """
+        It compiles the rows of a vocabulary. encoders is the pair of functions
+        encoding a list of texts with SBERT and SapBERT.
+    """
+    sbert_many, sapbert_many = encoders or (encode_many, sap_encode_many)
+    labels = [label for _, label in rows]
+    alias_strings, alias_owner = [], []
+    exact = []
+    for index, label in enumerate(labels):
+        aliases = aliases_of(type_param, label)
+        alias_strings.extend(aliases)
+        alias_owner.extend([index] * len(aliases))
+        exact.extend((_hash(key), key, index) for key in {normalize(label), *aliases})
+    exact.sort()
+
+    arrays = {
+        "ids": np.array([entity_id for entity_id, _ in rows], dtype=np.int64),
+        "labels": np.array(labels, dtype=str),
+        "normalized": np.array([normalize(label) for label in labels], dtype=str),
+        "alias_strings": np.array(alias_strings, dtype=str),
+        "alias_owner": np.array(alias_owner, dtype=np.int32),
+        "exact_hashes": np.array([h for h, _, _ in exact], dtype=np.uint64),
+        "exact_keys": np.array([k for _, k, _ in exact], dtype=str),
+        "exact_rows": np.array([r for _, _, r in exact], dtype=np.int32),
+        "sbert": np.asarray(sbert_many(alias_strings), dtype=np.float32),
+        "sapbert": np.asarray(sapbert_many(alias_strings), dtype=np.float32),
+    }
+    return VocabularySection(type_param, fingerprint(type_param, rows), arrays)
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def save(sections, path):
+    """
+        It writes the sections to a single artifact file, atomically.
+    """
+    arrays, header_arrays, offset = [], {}, 0
+    for section in sections:
+        for name, array in section.arrays.items():
+            array = np.ascontiguousarray(array)
+            offset = _align(offset)
+            header_arrays[f"{_slug(section.type_param)}.{name}"] = {
+                "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            arrays.append((offset, array))
+            offset += array.nbytes
+    header = json.dumps({
+        "format_version": FORMAT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "models": {"sapbert": MODEL_NAME, "sbert": SBERT_MODEL_NAME},
+        "sections": {s.type_param: {"slug": _slug(s.type_param), "fingerprint": s.fingerprint,
+                                    "rows": len(s.arrays["ids"])} for s in sections},
+        "arrays": header_arrays,
+    }).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for array_offset, array in arrays:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+def load(path):
+    """
+        It memory-maps an artifact and returns its header and its sections,
+        type -> VocabularySection. It raises ValueError when the file is not
+        an artifact of this format version.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a vocabulary artifact")
+        header = json.loads(f.read(int.from_bytes(f.read(8), "little")))
+        data_start = _align(f.tell())
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {header['format_version']}, "
+                         f"expected {FORMAT_VERSION}")
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    sections = {}
+    for type_param, info in header["sections"].items():
+        arrays = {}
+        prefix = f"{info['slug']}."
+        for key, spec in header["arrays"].items():
+            if key.startswith(prefix):
+                arrays[key[len(prefix):]] = np.ndarray(tuple(spec["shape"]),
+                                                       dtype=np.dtype(spec["dtype"]),
+                                                       buffer=mapped,
+                                                       offset=data_start + spec["offset"])
+        sections[type_param] = VocabularySection(type_param, info["fingerprint"], arrays)
+    return header, sections
+
+
+# sections of the artifact, loaded once per process
+_artifact = {"loaded": False, "sections": {}}
+# sections built from the rows when the artifact is missing or stale
+_built = {}
+_lock = threading.Lock()
+
+def load_artifact(path=VOCAB_ARTIFACT):
+    """
+        It memory-maps the artifact of the service, once per process.
+        A missing or unreadable artifact only means that the sections
+        will be built from the database rows.
+    """
+    with _lock:
+        if _artifact["loaded"]:
+            return _artifact["sections"]
+        _artifact["loaded"] = True
+        if path and os.path.exists(path):
+            try:
+                _, _artifact["sections"] = load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Vocabulary artifact error: {e}")
+        return _artifact["sections"]
+
+def compiled_section(type_param, rows):
+    """
+        The compiled vocabulary of the rows: the artifact section when its
+        fingerprint matches the rows, otherwise a section built from them.
+    """
+    value = fingerprint(type_param, rows)
+    section = load_artifact().get(type_param)
+    if section is not None and section.fingerprint == value:
+        return section
+    with _lock:
+        section = _built.get((type_param, value))
+        if section is None:
+            section = build_section(type_param, rows)
+            _built[(type_param, value)] = section
+    return section
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Compile the reference vocabularies")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile the vocabularies of the database")
+    build.add_argument("--output", default=VOCAB_ARTIFACT)
+    info = commands.add_parser("info", help="show the header of an artifact")
+    info.add_argument("path", nargs="?", default=VOCAB_ARTIFACT)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        # pylint: disable=import-outside-toplevel
+        from database.engine import get_engine
+        from .vocabulary import load_vocabularies
+        vocabularies = load_vocabularies(get_engine())
+        sections = [build_section(type_param, rows) for type_param, rows in vocabularies.items()]
+        save(sections, args.output)
+        print(f"{args.output}: {', '.join(f'{s.type_param} ({len(s.ids)} rows)' for s in sections)}")
+    else:
+        header, _ = load(args.path)
+        print(json.dumps({k: v for k, v in header.items() if k != "arrays"}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
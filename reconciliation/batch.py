@@ -0,0 +1,237 @@
+"""
+    BULK RECONCILIATION
+    Offline reconciliation of a whole column of a CSV or Parquet file, without
+    going through OpenRefine and /api/reconcile. The column is read once to
+    collect its distinct values, every distinct value is reconciled once with
+    the same scoring code as reconcile(), by several worker processes, and the
+    file is read again, a chunk at a time, to write the best match of every row.
+    Only the distinct values and their matches are kept in memory.
+
+    Usage:
+        python -m reconciliation.batch patients.parquet --column ethnicity \\
+            --type /ethnicity --output reconciled.parquet --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+from database.engine import get_engine
+from .aliases import load_aliases
+from .api import reconcile_query
+from .type_inference import TypeRouter, classifier_for
+from .vocabulary import load_vocabularies
+
+# state of the worker processes, set by the pool initializer
+_worker = {}
+
+
+def file_format(path, requested=None):
+    """
+        The format is the one requested or the one of the file extension.
+    """
+    if requested:
+        return requested
+    return "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+
+def iter_chunks(path, fmt, chunk_size, columns=None):
+    """
+        It reads the file as a sequence of DataFrames of at most chunk_size rows.
+    """
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size, dtype=str,
+                               keep_default_na=False, na_values=[""])
+
+def distinct_values(path, fmt, column, chunk_size):
+    """
+        First pass: the distinct non-empty values of the column.
+    """
+    values = set()
+    rows = 0
+    for chunk in iter_chunks(path, fmt, chunk_size, columns=[column]):
+        rows += len(chunk)
+        values.update(str(v).strip() for v in chunk[column].dropna().unique())
+    values.discard("")
+    return values, rows
+
+def _init_worker(vocabularies, type_param, threads):
+    """
+        The models are already loaded by the parent process and shared with the
+        forked workers, every worker only limits its torch threads so that the
+        workers do not compete for the same cores.
+    """
+    torch.set_num_threads(threads)
+    _worker["vocabularies"] = vocabularies
+    _worker["type"] = type_param
+    _worker["router"] = TypeRouter(classifier_for(vocabularies))
+
+def _reconcile_value(value):
+    """
+        Worker task: the best match of one distinct value,
+        as (value, id, name, score), with empty fields when nothing matched.
+    """
+    q = {"query": value, "limit": 1}
+    types = None
+    if _worker["type"]:
+        q["type"] = _worker["type"]
+    else:
+        types = _worker["router"].route(value)
+    try:
+        matches = reconcile_query(q, _worker["vocabularies"], types)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"Reconciliation Error for {value!r}: {e}", file=sys.stderr)
+        matches = []
+    if not matches:
+        return value, None, None, None
+    best = matches[0]
+    if not _worker["type"] and best["match"]:
+        _worker["router"].observe(best["type"][0]["id"])
+    return value, best["id"], best["name"], float(best["score"])
+
+def reconcile_values(values, vocabularies, type_param, workers):
+    """
+        It reconciles the distinct values with a pool of forked workers and
+        returns value -> (id, name, score).
+    """
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("fork")
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(vocabularies, type_param, threads)) as pool:
+        return {
+            value: match
+            for value, *match in pool.imap_unordered(_reconcile_value, sorted(values),
+                                                     chunksize=16)
+        }
+
+# types of the id, name and score columns of the matches
+MATCH_TYPES = (pa.string(), pa.string(), pa.float64())
+
+def _match_columns(values, column, matches):
+    """
+        The id, name and score columns of the best match of each value.
+    """
+    found = [matches.get(str(v).strip(), (None, None, None)) if v is not None else
+             (None, None, None) for v in values]
+    return {
+        f"{column}_match_id": [m[0] for m in found],
+        f"{column}_match_name": [m[1] for m in found],
+        f"{column}_match_score": [m[2] for m in found],
+    }
+
+def write_output(path, fmt, output, out_fmt, column, matches, chunk_size):
+    """
+        Second pass: every row is written with the id, name and score
+        of the best match of its value, a chunk at a time.
+    """
+    if fmt == "parquet" and out_fmt == "parquet":
+        # Arrow batches are extended without converting them to pandas
+        writer = None
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            table = pa.Table.from_batches([batch])
+            new_columns = _match_columns(batch.column(column).to_pylist(), column, matches)
+            for (name, values), arrow_type in zip(new_columns.items(), MATCH_TYPES):
+                table = table.append_column(name, pa.array(values, type=arrow_type))
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+        return
+
+    first = True
+    writer = None
+    for chunk in iter_chunks(path, fmt, chunk_size):
+        values = chunk[column].where(chunk[column].notna(), None).tolist()
+        new_columns = _match_columns(values, column, matches)
+        for name, new_values in new_columns.items():
+            chunk[name] = new_values
+        if out_fmt == "parquet":
+            if writer is None:
+                # the CSV columns are read as text, the schema is not inferred
+                # from the first chunk, whose columns may all be empty
+                match_types = dict(zip(new_columns, MATCH_TYPES))
+                schema = pa.schema([(name, match_types.get(name, pa.string()))
+                                    for name in chunk.columns])
+                writer = pq.ParquetWriter(output, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema,
+                                                    preserve_index=False))
+        else:
+            chunk.to_csv(output, mode="w" if first else "a", header=first, index=False)
+        first = False
+    if writer is not None:
+        writer.close()
+
+def run(path, column, output, type_param=None, workers=None, chunk_size=100_000,
+        input_format=None, output_format=None):
+    """
+        It reconciles the column of the file and returns the throughput report.
+    """
+    fmt = file_format(path, input_format)
+    out_fmt = file_format(output, output_format)
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    values, rows = distinct_values(path, fmt, column, chunk_size)
+    read_s = time.perf_counter() - start
+
+    engine = get_engine()
+    vocabularies = load_vocabularies(engine, [type_param] if type_param else None)
+    load_aliases(engine)
+    # the pooled connections must not be inherited by the forked workers
+    engine.dispose()
+    start = time.perf_counter()
+    matches = reconcile_values(values, vocabularies, type_param, workers)
+    reconcile_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_output(path, fmt, output, out_fmt, column, matches, chunk_size)
+    write_s = time.perf_counter() - start
+
+    total = read_s + reconcile_s + write_s
+    return {
+        "rows": rows,
+        "distinct_values": len(values),
+        "matched_values": sum(1 for m in matches.values() if m[0] is not None),
+        "read_s": round(read_s, 2),
+        "reconcile_s": round(reconcile_s, 2),
+        "write_s": round(write_s, 2),
+        "distinct_values_per_second": round(len(values) / reconcile_s, 1) if reconcile_s else None,
+        "rows_per_second": round(rows / total, 1) if total else None,
+    }
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Reconcile a column of a CSV or Parquet file")
+    parser.add_argument("input")
+    parser.add_argument("--column", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--type", dest="type_param",
+                        choices=["/ethnicity", "/sexual-orientation", "/icd11"],
+                        help="type of the column, inferred for each value when missing")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--input-format", choices=["csv", "parquet"])
+    parser.add_argument("--output-format", choices=["csv", "parquet"])
+    args = parser.parse_args(argv)
+
+    report = run(args.input, args.column, args.output,
+                 type_param=args.type_param,
+                 workers=args.workers,
+                 chunk_size=args.chunk_size,
+                 input_format=args.input_format,
+                 output_format=args.output_format)
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+    CONFIGURATION
+    Runtime settings of the reconciliation service. Every value can be
+    overridden with an environment variable so that the same code can run
+    on a laptop with OpenRefine or on a server with many concurrent users.
+"""
+import os
+import tempfile
+
+
+def env_str(name: str, default: str) -> str:
+    """
+        It reads a string setting from the environment,
+        falling back to the default when the variable is not set.
+    """
+    return os.environ.get(name) or default
+
+
+def env_int(name: str, default: int) -> int:
+    """
+        It reads an integer setting from the environment,
+        falling back to the default when the variable is not set.
+    """
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    """
+        It reads a float setting from the environment,
+        falling back to the default when the variable is not set.
+    """
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+# Micro-batching of model inference
+# a batch is flushed when it reaches BATCH_MAX_SIZE texts
+# or when the oldest text has waited BATCH_MAX_WAIT_MS milliseconds
+BATCH_MAX_SIZE = env_int("DRRECONCILE_BATCH_MAX_SIZE", 32)
+BATCH_MAX_WAIT_MS = env_float("DRRECONCILE_BATCH_MAX_WAIT_MS", 5.0)
+
+# Scoring cascade for sexual orientation and ICD-11
+# exact lookup, then lexical, then semantic: the semantic models only run
+# when the best lexical score is below CASCADE_THRESHOLD or when it does not
+# lead the second candidate by at least CASCADE_MARGIN points
+CASCADE_ENABLED = env_int("DRRECONCILE_CASCADE", 1) == 1
+CASCADE_THRESHOLD = env_float("DRRECONCILE_CASCADE_THRESHOLD", 90.0)
+CASCADE_MARGIN = env_float("DRRECONCILE_CASCADE_MARGIN", 10.0)
+# only the ethnicity descriptions whose partial ratio upper bound
+# can reach the best `limit` scores are scored
+TOPK_PRUNING = env_int("DRRECONCILE_TOPK_PRUNING", 1) == 1
+# ethnicity descriptions matched group first ("Asian or Asian British", then
+# "Indian"), only the leaves of the best groups are scored; approximate
+HIERARCHICAL_MATCHING = env_int("DRRECONCILE_HIERARCHICAL", 0) == 1
+
+# Per-stage latency metrics exported on /metrics and in the Server-Timing header
+METRICS_ENABLED = env_int("DRRECONCILE_METRICS", 1) == 1
+
+# Time budget of a reconcile request: the semantic stage and the ICD-11 search
+# are skipped when less than their reserve is left, and the queries reached
+# after the deadline are returned without candidates; 0 disables the budget
+REQUEST_BUDGET_S = env_float("DRRECONCILE_REQUEST_BUDGET_S", 20.0)
+SEMANTIC_RESERVE_S = env_float("DRRECONCILE_SEMANTIC_RESERVE_S", 1.0)
+ICD_RESERVE_S = env_float("DRRECONCILE_ICD_RESERVE_S", 2.0)
+
+# queries of /reconcile/stream scored at the same time, the body is not read
+# further while they are all in flight
+STREAM_MAX_IN_FLIGHT = env_int("DRRECONCILE_STREAM_MAX_IN_FLIGHT", 16)
+
+# Reconcile responses: with COMPACT_RESPONSES the candidates only have id,
+# name, score and match when the request has no compact parameter (off by
+# default, a request chooses with compact=1 or compact=0), and the bodies of
+# at least COMPRESS_MIN_BYTES are compressed with brotli or gzip when the
+# client accepts it
+COMPACT_RESPONSES = env_int("DRRECONCILE_COMPACT_RESPONSES", 0) == 1
+COMPRESS_MIN_BYTES = env_int("DRRECONCILE_COMPRESS_MIN_BYTES", 1024)
+
+# Token required by the admin endpoints, they are disabled when it is empty
+ADMIN_TOKEN = env_str("DRRECONCILE_ADMIN_TOKEN", "")
+
+# On-demand profiling of single requests, flagged with the X-Profile header or
+# the profile=1 query parameter together with the admin token.
+# PROFILE_SAMPLE_RATE is the fraction of flagged requests that are profiled.
+PROFILING_ENABLED = env_int("DRRECONCILE_PROFILING", 0) == 1
+PROFILE_SAMPLE_RATE = env_float("DRRECONCILE_PROFILE_SAMPLE_RATE", 1.0)
+PROFILE_INTERVAL_MS = env_float("DRRECONCILE_PROFILE_INTERVAL_MS", 5.0)
+PROFILE_DIR = env_str("DRRECONCILE_PROFILE_DIR",
+                      os.path.join(tempfile.gettempdir(), "drreconcile-profiles"))
+PROFILE_MAX_FILES = env_int("DRRECONCILE_PROFILE_MAX_FILES", 50)
+
+# Type router for queries sent without a type: only the types whose score is
+# at least TYPE_ROUTER_RELATIVE times the best one are searched, and all of
+# them are searched when the best score is below TYPE_ROUTER_MIN_SCORE
+TYPE_ROUTER_ENABLED = env_int("DRRECONCILE_TYPE_ROUTER", 1) == 1
+TYPE_ROUTER_MIN_SCORE = env_float("DRRECONCILE_TYPE_ROUTER_MIN_SCORE", 0.35)
+TYPE_ROUTER_RELATIVE = env_float("DRRECONCILE_TYPE_ROUTER_RELATIVE", 0.6)
+# weight of the types already seen in the same batch
+TYPE_ROUTER_PRIOR_WEIGHT = env_float("DRRECONCILE_TYPE_ROUTER_PRIOR_WEIGHT", 0.3)
+
+# Normalization job: mapped values are only written back when their score
+# reaches this threshold, unless the value has its own min_score
+NORMALIZE_THRESHOLD = env_float("DRRECONCILE_NORMALIZE_THRESHOLD", 90.0)
+# the incremental window starts this many seconds before the last watermark
+WATERMARK_OVERLAP_S = env_float("DRRECONCILE_WATERMARK_OVERLAP_S", 60.0)
+
+# Aliases learned from the confirmed matches, reloaded from the database
+# every ALIAS_REFRESH_S seconds so that the workers see each other's aliases
+ALIASES_ENABLED = env_int("DRRECONCILE_ALIASES", 1) == 1
+ALIAS_REFRESH_S = env_float("DRRECONCILE_ALIAS_REFRESH_S", 60.0)
+
+# Disk cache of the ICD-11 search responses: fresh for ICD_CACHE_TTL_S, then
+# served while being refreshed in the background for ICD_CACHE_STALE_S more
+ICD_CACHE_ENABLED = env_int("DRRECONCILE_ICD_CACHE", 1) == 1
+ICD_CACHE_DIR = env_str("DRRECONCILE_ICD_CACHE_DIR",
+                        os.path.join(tempfile.gettempdir(), "drreconcile-icd-cache"))
+ICD_CACHE_TTL_S = env_float("DRRECONCILE_ICD_CACHE_TTL_S", 7 * 24 * 3600.0)
+ICD_CACHE_STALE_S = env_float("DRRECONCILE_ICD_CACHE_STALE_S", 30 * 24 * 3600.0)
+# the WHO API is not called for ICD_BREAKER_RESET_S seconds
+# after ICD_BREAKER_FAILURES consecutive failures
+ICD_BREAKER_FAILURES = env_int("DRRECONCILE_ICD_BREAKER_FAILURES", 5)
+ICD_BREAKER_RESET_S = env_float("DRRECONCILE_ICD_BREAKER_RESET_S", 30.0)
+
+# WHO ICD-11 API, the URLs can point to a local stand-in for load tests
+ICD_TOKEN_URL = env_str("DRRECONCILE_ICD_TOKEN_URL",
+                        "https://icdaccessmanagement.who.int/connect/token")
+ICD_API_URL = env_str("DRRECONCILE_ICD_API_URL", "https://id.who.int")
+ICD_CLIENT_ID = env_str("DRRECONCILE_ICD_CLIENT_ID", "your_client_id")
+ICD_CLIENT_SECRET = env_str("DRRECONCILE_ICD_CLIENT_SECRET", "your_client_secret")
+ICD_TIMEOUT_S = env_float("DRRECONCILE_ICD_TIMEOUT_S", 10.0)
+
+# Vocabularies compiled by `python -m reconciliation.artifact build`,
+# memory-mapped at startup; empty to always build them from the database
+VOCAB_ARTIFACT = env_str("DRRECONCILE_VOCAB_ARTIFACT", "vocabulary.drvocab")
@@ -0,0 +1,141 @@
+"""
+    DEADLINE BUDGET
+    Every reconcile request gets a time budget, so that a slow stage (the WHO
+    API, the models) does not make the whole batch exceed the timeout of
+    OpenRefine. The deadline is kept in a context variable, copied into the
+    threadpool with the rest of the request context, and the stages check it:
+    the optional ones (ICD-11 search, semantic rescoring) are skipped when less
+    than their reserve is left, and the queries reached after the deadline are
+    not scored at all. Each key of the response reports its degradation:
+    - none: every stage ran
+    - partial: some optional stages were skipped, listed in "skipped"
+    - unscored: the deadline had passed before the query was scored
+    - failed: the query raised an error, the other keys are still returned
+    The calls to the WHO API are also given no more than the time left, so a
+    slow response cannot make the request overrun its deadline.
+"""
+import contextvars
+import time
+from .config import REQUEST_BUDGET_S
+from .metrics import DEGRADED_QUERIES, SKIPPED_STAGES
+
+DEGRADATION_NONE = "none"
+DEGRADATION_PARTIAL = "partial"
+DEGRADATION_UNSCORED = "unscored"
+DEGRADATION_FAILED = "failed"
+
+_current_deadline = contextvars.ContextVar("drreconcile_deadline", default=None)
+# stages skipped for the query being scored
+_skipped_stages = contextvars.ContextVar("drreconcile_skipped_stages", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+        The request ran out of time during a call, which was abandoned.
+    """
+
+
+class Deadline:
+    """
+        The time left to the request, measured from its start.
+    """
+
+    def __init__(self, budget_s):
+        self.budget_s = budget_s
+        self.expires_at = time.monotonic() + budget_s
+
+    def remaining(self) -> float:
+        """
+            Seconds left before the deadline, negative once it has passed.
+        """
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        """
+            True once the deadline has passed.
+        """
+        return self.remaining() <= 0
+
+
+def start_deadline(budget_s=None):
+    """
+        It starts the deadline of the current request, REQUEST_BUDGET_S by default.
+        It returns None, and nothing is ever skipped, when the budget is not positive.
+    """
+    budget_s = REQUEST_BUDGET_S if budget_s is None else budget_s
+    deadline = Deadline(budget_s) if budget_s > 0 else None
+    _current_deadline.set(deadline)
+    return deadline
+
+def budget_from_header(value):
+    """
+        The budget in seconds of an X-Request-Budget-Ms header, None when
+        it is missing or invalid. It cannot exceed REQUEST_BUDGET_S.
+    """
+    try:
+        budget_s = float(value) / 1000
+    except (TypeError, ValueError):
+        return None
+    if not budget_s > 0:
+        return None
+    return min(budget_s, REQUEST_BUDGET_S) if REQUEST_BUDGET_S > 0 else budget_s
+
+def expired() -> bool:
+    """
+        True when the current request has run out of time.
+    """
+    deadline = _current_deadline.get()
+    return deadline is not None and deadline.expired()
+
+def time_left(default_s):
+    """
+        The timeout of a call made now: default_s, or less when the current
+        request has less time left. It raises DeadlineExceeded once the
+        deadline has passed.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default_s
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("The request budget is spent.")
+    return min(default_s, remaining) if default_s is not None else remaining
+
+def allows(stage_name, reserve_s) -> bool:
+    """
+        True when the optional stage can run, with at least reserve_s seconds left.
+        Otherwise the stage is recorded as skipped for the current query.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None or deadline.remaining() > reserve_s:
+        return True
+    skip(stage_name)
+    return False
+
+def skip(stage_name):
+    """
+        It records that the stage did not run for the current query.
+    """
+    skipped = _skipped_stages.get()
+    if skipped is not None:
+        skipped.add(stage_name)
+    SKIPPED_STAGES.labels(stage_name).inc()
+
+def begin_query():
+    """
+        It starts recording the stages skipped for the next query.
+    """
+    _skipped_stages.set(set())
+
+def degradation(level=None) -> dict:
+    """
+        The degradation fields of the query just scored, or of the given level.
+    """
+    skipped = sorted(_skipped_stages.get() or ())
+    if level is None:
+        level = DEGRADATION_PARTIAL if skipped else DEGRADATION_NONE
+    DEGRADED_QUERIES.labels(level).inc()
+    fields = {"degradation": level}
+    if level == DEGRADATION_PARTIAL:
+        fields["skipped"] = skipped
+    return fields
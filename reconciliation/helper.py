@@ -2,12 +2,22 @@
     HELPER FUNCTIONS
 """
 import re
+from collections import Counter
 import requests
 from transformers import AutoTokenizer, AutoModel
 from sentence_transformers import SentenceTransformer
 import torch
 import numpy as np
-
+from .config import (
+    BATCH_MAX_SIZE,
+    BATCH_MAX_WAIT_MS,
+    ICD_API_URL,
+    ICD_TOKEN_URL,
+    ICD_CLIENT_ID,
+    ICD_CLIENT_SECRET,
+    ICD_TIMEOUT_S
+)
+from .scheduler import InferenceScheduler
 
 
 # Semantic similarity
@@ -17,6 +27,23 @@ MODEL_NAME = "cambridgeltl/SapBERT-from-PubMedBERT-fulltext"
 tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
 sap_model = AutoModel.from_pretrained(MODEL_NAME)
 
+def sap_encode_batch(texts):
+    """
+        This function runs a list of texts through SapBERT in a single forward pass.
+        The tokenizer pads every text to the length of the longest one, and
+        the [CLS] embedding of each row is returned as a NumPy array.
+    """
+    inputs = tokenizer(list(texts), return_tensors="pt", padding=True, truncation=True)
+    with torch.no_grad():
+        outputs = sap_model(**inputs)
+        embeddings = outputs.last_hidden_state[:, 0, :]
+        return list(embeddings.cpu().numpy())
+
+# every SapBERT call of the concurrent requests goes through the same queue
+sap_scheduler = InferenceScheduler("sapbert", sap_encode_batch,
+                                   max_batch_size=BATCH_MAX_SIZE,
+                                   max_wait_ms=BATCH_MAX_WAIT_MS)
+
 def sap_encode(text):
     """
         This function loads the SapBERT model, a BERT-based language model 
@@ -29,15 +56,32 @@ def sap_encode(text):
         which serves as a summary representation of the input text. 
         It converts this embedding from a PyTorch tensor 
         to a NumPy array for computing semantic similarity.
+        The text is queued in the SapBERT scheduler, so it shares 
+        the forward pass with the texts of the other in-flight requests.
     """
-    inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True)
-    with torch.no_grad():
-        outputs = sap_model(**inputs)
-        embeddings = outputs.last_hidden_state[:, 0, :]
-        return embeddings[0].cpu().numpy()
+    return sap_scheduler.submit(text).result()
+
+def sap_encode_many(texts):
+    """
+        This function encodes several texts with SapBERT,
+        submitting them together so they can be batched.
+    """
+    return sap_scheduler.map(texts)
 
 # SBERT model https://huggingface.co/sentence-transformers/all-mpnet-base-v2
-model = SentenceTransformer('sentence-transformers/all-mpnet-base-v2')
+SBERT_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+model = SentenceTransformer(SBERT_MODEL_NAME)
+
+def encode_batch(texts):
+    """
+        This function encodes a list of texts with the SentenceTransformer model
+        in a single call, returning one NumPy embedding per text.
+    """
+    return list(model.encode(list(texts), batch_size=BATCH_MAX_SIZE, convert_to_numpy=True))
+
+sbert_scheduler = InferenceScheduler("sbert", encode_batch,
+                                     max_batch_size=BATCH_MAX_SIZE,
+                                     max_wait_ms=BATCH_MAX_WAIT_MS)
 
 def encode(text):
     """
@@ -47,8 +91,16 @@ def encode(text):
         for general language tasks. The encode function takes a text string as input and 
         passes it to the model's encode method, which converts the text into a fixed-size vector. 
         The output embedding is returned as a NumPy array.
+        As for sap_encode, the text is batched with the other in-flight requests.
     """
-    return model.encode(text, convert_to_numpy=True)
+    return sbert_scheduler.submit(text).result()
+
+def encode_many(texts):
+    """
+        This function encodes several texts with SBERT,
+        submitting them together so they can be batched.
+    """
+    return sbert_scheduler.map(texts)
 
 def cosine_similarity(a, b):
     """
@@ -121,19 +173,20 @@ def generality_boost(candidate: str, term: str) -> float:
     # so a penalty of -5.0 is applied to make it rank lower
     return -5.0
 
+# expressions meaning that no value was given
+NULL_TERMS = {
+    "none", "n/a", "not applicable", "not answered", "not stated", "prefer not to say",
+    "unknown", "don't know", "does not apply", "null", "missing", "no answer"
+}
+
 def null_equivalence_score(term: str, candidate: str) -> float:
     """
         It checks whether both the term and candidate represent a "null-like" or "no data" value,
         If both do, it returns a perfect match score of 100,
         even if they're different phrases.
     """
-    null_terms = {
-        "none", "n/a", "not applicable", "not answered", "not stated", "prefer not to say",
-        "unknown", "don't know", "does not apply", "null", "missing", "no answer"
-    }
-
     # Exact or near match within null expressions
-    if term in null_terms and candidate in null_terms:
+    if term in NULL_TERMS and candidate in NULL_TERMS:
         # Considered semantically identical
         return 100.0
     # If either string is not in the set, it returns 0.0,
@@ -192,8 +245,37 @@ def partial_ratio(s1: str, s2: str) -> int:
     # Return the best match score, rounded to an integer between 0 and 100
     return int(round(max_score))
 
+def partial_ratio_bound(s1: str, s2: str) -> int:
+    """
+        An upper bound of partial_ratio(s1, s2), without any Levenshtein distance.
+        Every window of the longer string holds at most the characters the two
+        strings have in common (the intersection of their character counts),
+        so the distance of the best window is at least the length of the
+        shorter string minus that intersection. A window at distance 0 is only
+        possible when the shorter string is in the longer one, which is also
+        when the generality boost is not negative.
+    """
+    s1, s2 = s1.strip().lower(), s2.strip().lower()
+    if not s1 or not s2:
+        return 0
+    if null_equivalence_score(s1, s2) == 100.0:
+        return 100
+
+    shorter, longer = (s1, s2) if len(s1) <= len(s2) else (s2, s1)
+    len_short = len(shorter)
+    boost = generality_boost(longer, shorter)
+    common = sum((Counter(shorter) & Counter(longer)).values())
+    min_distance = max(len_short - common, 0 if boost >= 0 else 1)
+    if min_distance == 0:
+        bound = 100 + boost
+    else:
+        bound = 100 * (len_short - min_distance) / len_short + boost
+    # partial_ratio rounds the best score, which starts at 0
+    return int(round(max(0, bound)))
+
 # ICD-11 API
-def query_icd11_api(search_term: str, access_token: str, limit: int = 5):
+def query_icd11_api(search_term: str, access_token: str, limit: int = 5,
+                    timeout: float = ICD_TIMEOUT_S):
     """
         This function uses the API reference has shown in the Open-API(swagger)
         documentation: https://id.who.int/swagger/index.html
@@ -205,8 +287,10 @@ def query_icd11_api(search_term: str, access_token: str, limit: int = 5):
         entities from the destinationEntities field in the JSON response, 
         limits the number to 5. If the request fails, it raises a ValueError 
         with the status code and error message for debugging.
+        With limit None all the results are returned. The request is abandoned
+        after timeout seconds, ICD_TIMEOUT_S by default.
     """
-    url = "https://id.who.int/icd/entity/search"
+    url = f"{ICD_API_URL}/icd/entity/search"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Accept": "application/json",
@@ -215,7 +299,7 @@ def query_icd11_api(search_term: str, access_token: str, limit: int = 5):
     }
     params = {"q": search_term}
 
-    response = requests.get(url, headers=headers, params=params, timeout=10)
+    response = requests.get(url, headers=headers, params=params, timeout=timeout)
 
     if response.status_code != 200:
         raise ValueError(f"ICD-11 API error {response.status_code}: {response.text}")
@@ -223,7 +307,7 @@ def query_icd11_api(search_term: str, access_token: str, limit: int = 5):
     results = response.json().get("destinationEntities", [])[:limit]
     return results
 
-def get_token():
+def get_token(timeout: float = ICD_TIMEOUT_S):
     """
         This function sets up the ICD API authentication. It gets
         the access token using the OAuth 2.0 client credentials. 
@@ -232,11 +316,12 @@ def get_token():
         it extracts and returns the access token from the JSON response.
         If the token request fails, the function raises an error 
         showing the response status and message.
+        The request is abandoned after timeout seconds, ICD_TIMEOUT_S by default.
         Reference: https://github.com/ICD-API/Python-samples/blob/master/sample.py
     """
-    token_url = "https://icdaccessmanagement.who.int/connect/token"
-    client_id = "your_client_id"
-    client_secret = "your_client_secret"
+    token_url = ICD_TOKEN_URL
+    client_id = ICD_CLIENT_ID
+    client_secret = ICD_CLIENT_SECRET
     scope = "icdapi_access"
 
     token_data = {
@@ -246,7 +331,7 @@ def get_token():
         "scope": scope
     }
 
-    response = requests.post(token_url, data=token_data, timeout=10)
+    response = requests.post(token_url, data=token_data, timeout=timeout)
     if response.status_code != 200:
         raise ValueError(f"Token error {response.status_code}: {response.text}")
     return response.json()["access_token"]
@@ -0,0 +1,142 @@
+"""
+    HIERARCHICAL MATCHING
+    Vocabularies whose labels are paths, such as the ethnicity descriptions
+    "Asian or Asian British - Indian", are turned into a tree of headings with
+    the labels as leaves. A query is first compared with the headings of the top
+    level, and only the best groups are searched further, down to the leaves:
+    - the route score of a group is the best of the partial ratio with its
+      heading and of the largest share of the query trigrams found in one of
+      the labels below it, the second one only needing set lookups
+    - a group is kept when it is among the `beam` best of its level, or within
+      `margin` points of the best one
+    - the leaves of the groups kept are scored with the partial ratio against
+      the whole label, so their score combines the heading and the leaf
+    Labels without a separator are leaves of the top level and always scored.
+    The matcher is approximate: a label below a group left out is not returned,
+    see benchmarks/hierarchy.py for its recall against the exhaustive scoring.
+"""
+from .helper import partial_ratio
+
+SEPARATOR = " - "
+
+
+def trigrams(value):
+    """
+        The character trigrams of the lowercase value, padded with spaces.
+    """
+    value = f" {' '.join(value.lower().split())} "
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class HierarchyNode:
+    """
+        A heading of the hierarchy, with its groups and its leaves
+        (row index, id, label).
+    """
+
+    def __init__(self, heading=""):
+        self.heading = heading
+        self.groups = {}
+        self.leaves = []
+
+    def size(self):
+        """
+            Number of leaves below the node.
+        """
+        return len(self.leaves) + sum(group.size() for group in self.groups.values())
+
+
+class HierarchicalMatcher:
+    """
+        Matcher of a vocabulary of (id, label) rows whose labels are paths
+        joined by the separator. The trigrams of the labels are indexed, so the
+        best trigram overlap of a leaf below each group is found with set
+        lookups, without scoring the leaves.
+    """
+
+    def __init__(self, rows, separator=SEPARATOR, beam=3, margin=10):
+        self.separator = separator
+        self.beam = beam
+        self.margin = margin
+        self.root = HierarchyNode()
+        # trigram -> indices of the labels having it
+        self.index = {}
+        # groups above each label, from the top level down
+        self.ancestors = []
+        for index, (entity_id, label) in enumerate(rows):
+            node = self.root
+            *headings, _ = label.split(separator)
+            path, ancestors = [], []
+            for heading in headings:
+                path.append(heading)
+                node = node.groups.setdefault(heading, HierarchyNode(separator.join(path)))
+                ancestors.append(node)
+            node.leaves.append((index, entity_id, label))
+            self.ancestors.append(ancestors)
+            for trigram in trigrams(label):
+                self.index.setdefault(trigram, []).append(index)
+
+    def _overlaps(self, query_trigrams):
+        """
+            For every group, the largest share of the query trigrams
+            found in one of the labels below it.
+        """
+        hits = {}
+        for trigram in query_trigrams:
+            for index in self.index.get(trigram, ()):
+                hits[index] = hits.get(index, 0) + 1
+        overlaps = {}
+        for index, count in hits.items():
+            share = count / len(query_trigrams)
+            for group in self.ancestors[index]:
+                if share > overlaps.get(id(group), 0):
+                    overlaps[id(group)] = share
+        return overlaps
+
+    def match(self, query_string, limit=None):
+        """
+            The scored leaves [(id, label, score)] of the groups the query is
+            routed to, best first, and the number of partial ratios computed.
+        """
+        overlaps = self._overlaps(trigrams(query_string))
+        scored = []
+        comparisons = 0
+        level = [self.root]
+        while level:
+            next_level = []
+            for node in level:
+                for index, entity_id, label in node.leaves:
+                    scored.append((index, entity_id, label, partial_ratio(query_string, label)))
+                comparisons += len(node.leaves)
+                if not node.groups:
+                    continue
+
+                routes = [(max(partial_ratio(query_string, group.heading),
+                               100 * overlaps.get(id(group), 0)), group)
+                          for group in node.groups.values()]
+                comparisons += len(routes)
+                routes.sort(key=lambda route: -route[0])
+                best = routes[0][0]
+                next_level.extend(group for rank, (score, group) in enumerate(routes)
+                                  if rank < self.beam or score >= best - self.margin)
+            level = next_level
+
+        # equal scores keep the order of the rows, as in the exhaustive scoring
+        scored.sort(key=lambda leaf: (-leaf[3], leaf[0]))
+        return [leaf[1:] for leaf in scored[:limit]], comparisons
+
+
+# matchers of the vocabularies seen, by rows
+_matchers = {}
+
+def matcher_for(rows):
+    """
+        The matcher of the rows, built once.
+    """
+    key = tuple(rows)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        if len(_matchers) >= 8:
+            _matchers.clear()
+        matcher = _matchers[key] = HierarchicalMatcher(rows)
+    return matcher
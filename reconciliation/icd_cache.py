@@ -0,0 +1,254 @@
+"""
+    ICD-11 SEARCH CACHE
+    The responses of the WHO ICD-11 search are cached on disk, one JSON file per
+    normalized search term, and shared by the server workers and the command
+    line jobs. A response younger than the TTL is served as it is. An older one,
+    within the stale window, is served immediately while a background thread
+    fetches it again (stale-while-revalidate). Concurrent lookups of the same
+    term wait for a single request to the API.
+    After repeated failures the circuit breaker opens and the API is not called
+    for a while: the cached responses are served whatever their age, and the
+    terms never cached have no ICD-11 candidates until the API is back.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from .config import (
+    ICD_CACHE_ENABLED,
+    ICD_CACHE_DIR,
+    ICD_CACHE_TTL_S,
+    ICD_CACHE_STALE_S,
+    ICD_BREAKER_FAILURES,
+    ICD_BREAKER_RESET_S
+)
+from .deadline import DeadlineExceeded, time_left
+from .metrics import ICD_CACHE_LOOKUPS
+from .scoring import normalize
+
+
+class IcdUnavailable(Exception):
+    """
+        The ICD-11 API could not be called and the term is not cached.
+    """
+
+
+class CircuitBreaker:
+    """
+        It counts the consecutive failures of a remote call. After max_failures
+        of them the circuit is open and calls are refused for reset_s seconds,
+        then a single trial call is let through (half-open): its success closes
+        the circuit and its failure opens it again.
+    """
+
+    def __init__(self, max_failures=ICD_BREAKER_FAILURES, reset_s=ICD_BREAKER_RESET_S):
+        self.max_failures = max(1, int(max_failures))
+        self.reset_s = reset_s
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+            True when a call may be attempted now.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_s:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        """
+            A successful call closes the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """
+            A failed call opens the circuit once max_failures are reached,
+            or again after a failed trial.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        """
+            True while calls are refused, before the trial call.
+        """
+        return (self.opened_at is not None
+                and time.monotonic() - self.opened_at < self.reset_s)
+
+    @property
+    def state(self) -> str:
+        """
+            closed, open or half-open.
+        """
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self._trial else "open"
+
+
+class IcdSearchCache:
+    """
+        Disk cache of the ICD-11 search responses, see the module docstring.
+        search() is called with the function fetching a term from the API,
+        so the cache does not depend on how the token and the request are made.
+    """
+
+    def __init__(self, directory=ICD_CACHE_DIR, ttl_s=ICD_CACHE_TTL_S,
+                 stale_s=ICD_CACHE_STALE_S, breaker=None):
+        self.directory = directory
+        self.ttl_s = ttl_s
+        self.stale_s = stale_s
+        self.breaker = breaker or CircuitBreaker()
+        # term -> Future of the request in flight
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def read(self, key):
+        """
+            The cached entry of the key, None when it is not cached or unreadable.
+        """
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("term") == key else None
+
+    def write(self, key, results):
+        """
+            It stores the results of the key, replacing the file atomically
+            so that other processes never read a partial entry.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"term": key, "fetched_at": time.time(), "results": results}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return entry
+
+    def _fetch(self, key, fetch):
+        """
+            It fetches the key once for all the concurrent callers and caches it.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        if not leader:
+            # the leader may be a request with more time left
+            try:
+                return future.result(timeout=time_left(None))
+            except (DeadlineExceeded, FutureTimeout) as e:
+                raise IcdUnavailable("ICD-11 search abandoned: the request budget is spent") from e
+
+        try:
+            if not self.breaker.allow():
+                raise IcdUnavailable(f"ICD-11 circuit breaker is {self.breaker.state}")
+            try:
+                results = fetch(key)
+            except DeadlineExceeded as e:
+                # the request ran out of time, the API is not at fault
+                raise IcdUnavailable(f"ICD-11 search abandoned: {e}") from e
+            except Exception as e:
+                self.breaker.record_failure()
+                raise IcdUnavailable(f"ICD-11 search failed: {e}") from e
+            self.breaker.record_success()
+            try:
+                self.write(key, results)
+            except OSError as e:
+                print(f"ICD-11 cache write error: {e}")
+            future.set_result(results)
+            return results
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh(self, key, fetch):
+        """
+            Background revalidation of a stale entry, errors are only logged.
+        """
+        def run():
+            try:
+                self._fetch(key, fetch)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"ICD-11 cache refresh error for {key!r}: {e}")
+
+        with self._lock:
+            if key in self._inflight or self.breaker.is_open:
+                return
+        threading.Thread(target=run, name="icd-cache-refresh", daemon=True).start()
+
+    def search(self, search_term, limit, fetch):
+        """
+            It returns at most limit results for the term, from the cache when
+            possible. fetch(term) returns all the results of the term from the API.
+            It raises IcdUnavailable when the API cannot be called and nothing is cached.
+        """
+        if not ICD_CACHE_ENABLED:
+            return fetch(search_term)[:limit]
+        key = normalize(search_term)
+        entry = self.read(key)
+        if entry is not None:
+            age = time.time() - entry["fetched_at"]
+            if age < self.ttl_s:
+                ICD_CACHE_LOOKUPS.labels("fresh").inc()
+                return entry["results"][:limit]
+            if age < self.ttl_s + self.stale_s or self.breaker.is_open:
+                ICD_CACHE_LOOKUPS.labels("stale").inc()
+                self._refresh(key, fetch)
+                return entry["results"][:limit]
+        try:
+            results = self._fetch(key, fetch)
+        except IcdUnavailable:
+            if entry is not None:
+                # too old, but better than nothing while the API is down
+                ICD_CACHE_LOOKUPS.labels("expired").inc()
+                return entry["results"][:limit]
+            ICD_CACHE_LOOKUPS.labels("unavailable").inc()
+            raise
+        ICD_CACHE_LOOKUPS.labels("miss").inc()
+        return results[:limit]
+
+    def clear(self):
+        """
+            It removes every cached response.
+        """
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    os.remove(os.path.join(root, name))
+
+
+icd_cache = IcdSearchCache()
@@ -0,0 +1,166 @@
+"""
+    METRICS
+    Per-stage latency of the reconcile and update endpoints. Every stage is timed
+    with the stage() context manager, exported as a Prometheus histogram labelled
+    by stage and type, and summed per request into the Server-Timing header.
+    When DRRECONCILE_METRICS=0 no request timings are started and stage()
+    only costs a context variable lookup.
+    Under the pre-fork server (serve.py), PROMETHEUS_MULTIPROC_DIR is set and
+    /metrics aggregates the samples of all the workers.
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+from .config import METRICS_ENABLED
+
+STAGE_SECONDS = Histogram(
+    "drreconcile_stage_seconds",
+    "Time spent in each stage of a reconcile or update request",
+    ["stage", "type"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+             0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "drreconcile_inference_queue_depth",
+    "Texts waiting in the inference scheduler queue",
+    ["model"],
+    multiprocess_mode="livesum"
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    "drreconcile_inference_batch_size",
+    "Number of texts encoded in one forward pass",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+ROUTED_QUERIES = Counter(
+    "drreconcile_routed_queries_total",
+    "Untyped queries dispatched to each type by the type router, all when it falls back",
+    ["type"]
+)
+LEXICAL_SCORES = Counter(
+    "drreconcile_lexical_scores_total",
+    "Candidates of the top-k lexical search, scored or pruned by their upper bound",
+    ["type", "result"]
+)
+DEGRADED_QUERIES = Counter(
+    "drreconcile_query_degradation_total",
+    "Reconciled queries by degradation: none, partial, unscored or failed",
+    ["level"]
+)
+SKIPPED_STAGES = Counter(
+    "drreconcile_skipped_stages_total",
+    "Optional stages skipped because the request budget was nearly spent or the API was down",
+    ["stage"]
+)
+RESPONSE_BYTES = Counter(
+    "drreconcile_response_bytes_total",
+    "Bytes of the reconcile response bodies sent, by route and content coding",
+    ["route", "encoding"]
+)
+ICD_CACHE_LOOKUPS = Counter(
+    "drreconcile_icd_cache_lookups_total",
+    "ICD-11 search cache lookups by result: fresh, stale, miss, expired or unavailable",
+    ["result"]
+)
+
+# timings of the request being served, it is copied into the threadpool
+# together with the rest of the request context
+_current_timings = contextvars.ContextVar("drreconcile_timings", default=None)
+
+
+class StageTimings:
+    """
+        It accumulates the time spent in every stage of a single request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+
+    def add(self, name, seconds):
+        """
+            It adds the seconds to the total of the stage.
+        """
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """
+            It formats the stage totals as a Server-Timing header value,
+            durations in milliseconds.
+        """
+        total = (time.perf_counter() - self.started) * 1000
+        entries = [f"{name};dur={seconds * 1000:.2f}"
+                   for name, seconds in self.durations.items()]
+        entries.append(f"total;dur={total:.2f}")
+        return ", ".join(entries)
+
+
+def start_request():
+    """
+        It starts the timings of the current request.
+        It returns None when the metrics are disabled.
+    """
+    if not METRICS_ENABLED:
+        return None
+    timings = StageTimings()
+    _current_timings.set(timings)
+    return timings
+
+def timing_headers(timings) -> dict:
+    """
+        It returns the Server-Timing header of the request, if it was timed.
+    """
+    if timings is None:
+        return {}
+    return {"Server-Timing": timings.server_timing()}
+
+@contextmanager
+def stage(name, type_param=None):
+    """
+        It times the block as the given stage of the current request.
+        Blocks running outside of a timed request are not measured.
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name, type_param or "all").observe(elapsed)
+        timings.add(name, elapsed)
+
+def register_scheduler(scheduler):
+    """
+        It exports the queue depth and the batch sizes of an inference scheduler.
+    """
+    # the gauge is updated by the scheduler rather than read with
+    # set_function, which is not exported in multiprocess mode: the
+    # values written by every worker are summed (livesum) on /metrics
+    queue_depth = INFERENCE_QUEUE_DEPTH.labels(scheduler.name)
+    queue_depth.set(scheduler.queue_depth())
+    scheduler.on_queue = queue_depth.inc
+    batch_size = INFERENCE_BATCH_SIZE.labels(scheduler.name)
+    scheduler.on_batch = batch_size.observe
+
+def metrics_payload():
+    """
+        It returns the body and the content type of the /metrics endpoint.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,328 @@
+"""
+    NORMALIZATION
+    Server-side clean-up of patient.ethnicity, patient.sexual_orientation and
+    registration.reason_for_admission, without exporting the column to OpenRefine.
+    The distinct values of the column are read from Postgres, every value not
+    mapped yet is reconciled once, the best match of each value is stored in
+    the reconciliation_mapping table, and the column is rewritten with a single
+    UPDATE ... FROM joining the table with the mapping.
+    A value is only rewritten when its score reaches its own min_score, when
+    set, or the threshold of the run.
+    In incremental mode only the rows whose updated_at, kept by a trigger, is
+    later than the watermark of the last run are processed, and the new
+    watermark is committed in the same transaction as the mapping and the
+    updated rows. The rows rewritten by the job do not move their updated_at.
+
+    Usage:
+        python -m reconciliation.normalize --type /ethnicity --dry-run
+        python -m reconciliation.normalize --type /ethnicity --incremental
+        python -m reconciliation.normalize --type /ethnicity --threshold 95 \\
+            --value-threshold "White - Other=99"
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+from sqlalchemy import text
+from database.engine import get_engine
+from .aliases import load_aliases
+from .batch import reconcile_values
+from .config import NORMALIZE_THRESHOLD, WATERMARK_OVERLAP_S
+from .vocabulary import TYPE_TARGETS, load_vocabularies
+
+
+def target_of(type_param):
+    """
+        The table, the column and the mapping target of a type.
+    """
+    if type_param not in TYPE_TARGETS:
+        raise ValueError(f"Unsupported type: {type_param}")
+    table, column = TYPE_TARGETS[type_param]
+    return table, column, f"{table}.{column}"
+
+def parse_value_thresholds(items):
+    """
+        It parses the VALUE=SCORE pairs of --value-threshold.
+        The value is split at the last "=", so it can contain one.
+    """
+    thresholds = {}
+    for item in items or []:
+        value, sep, score = item.rpartition("=")
+        if not sep or not value:
+            raise ValueError(f"Expected VALUE=SCORE, got {item!r}")
+        thresholds[value] = float(score)
+    return thresholds
+
+def window_clause(window):
+    """
+        The condition on updated_at of the rows in the (since, until] window,
+        no condition when the window is None.
+    """
+    if window is None:
+        return ""
+    since, _ = window
+    clause = " AND t.updated_at <= :until"
+    if since is not None:
+        clause += " AND t.updated_at > :since"
+    return clause
+
+def window_params(window):
+    """
+        The bind parameters of window_clause.
+    """
+    if window is None:
+        return {}
+    since, until = window
+    return {"since": since, "until": until}
+
+def read_watermark(conn, target):
+    """
+        The watermark recorded by the last incremental run, None before the first one.
+    """
+    return conn.execute(
+        text("SELECT watermark FROM reconciliation_watermark WHERE target = :target"),
+        {"target": target}
+    ).scalar()
+
+def high_water_mark(conn, table):
+    """
+        The latest updated_at of the table, the watermark of the current run.
+    """
+    return conn.execute(text(f"SELECT max(updated_at) FROM {table}")).scalar()
+
+def save_watermark(conn, target, watermark):
+    """
+        It records the watermark of the run, in the transaction of its results.
+    """
+    conn.execute(
+        text("""
+            INSERT INTO reconciliation_watermark (target, watermark)
+            VALUES (:target, :watermark)
+            ON CONFLICT (target) DO UPDATE
+            SET watermark = EXCLUDED.watermark, recorded_at = now()
+        """),
+        {"target": target, "watermark": watermark}
+    )
+
+def pending_values(conn, table, column, target, remap=False, window=None):
+    """
+        It returns value -> rows for the distinct values of the column,
+        leaving out the values already in the mapping unless remap is set.
+        With a window, only the rows changed in the window are counted.
+    """
+    unmapped = "" if remap else f"""
+        AND NOT EXISTS (
+            SELECT 1 FROM reconciliation_mapping AS m
+            WHERE m.target = :target AND m.raw_value = t.{column}
+        )"""
+    rows = conn.execute(
+        text(f"""
+            SELECT t.{column}, count(*)
+            FROM {table} AS t
+            WHERE t.{column} IS NOT NULL
+              AND btrim(t.{column}) <> ''{unmapped}{window_clause(window)}
+            GROUP BY t.{column}
+        """),
+        {"target": target, **window_params(window)}
+    ).fetchall()
+    return dict(rows)
+
+def store_mappings(conn, target, matches):
+    """
+        It upserts the best match of every reconciled value, with one INSERT
+        from arrays. The min_score of a value already mapped is kept.
+    """
+    if not matches:
+        return
+    values = list(matches)
+    conn.execute(
+        text("""
+            INSERT INTO reconciliation_mapping
+                (target, raw_value, entity_id, entity_name, score)
+            SELECT :target, v.raw_value, v.entity_id, v.entity_name, v.score
+            FROM unnest(CAST(:values AS text[]), CAST(:ids AS text[]),
+                        CAST(:names AS text[]), CAST(:scores AS double precision[]))
+                AS v(raw_value, entity_id, entity_name, score)
+            ON CONFLICT (target, raw_value) DO UPDATE
+            SET entity_id = EXCLUDED.entity_id,
+                entity_name = EXCLUDED.entity_name,
+                score = EXCLUDED.score,
+                reconciled_at = now()
+        """),
+        {
+            "target": target,
+            "values": values,
+            "ids": [None if matches[v][0] is None else str(matches[v][0]) for v in values],
+            "names": [matches[v][1] for v in values],
+            "scores": [matches[v][2] for v in values],
+        }
+    )
+
+def set_value_thresholds(conn, target, thresholds):
+    """
+        It sets the min_score of the given mapped values.
+    """
+    if not thresholds:
+        return
+    conn.execute(
+        text("""
+            UPDATE reconciliation_mapping AS m
+            SET min_score = v.min_score
+            FROM unnest(CAST(:values AS text[]), CAST(:min_scores AS double precision[]))
+                AS v(raw_value, min_score)
+            WHERE m.target = :target AND m.raw_value = v.raw_value
+        """),
+        {"target": target, "values": list(thresholds), "min_scores": list(thresholds.values())}
+    )
+
+# a mapped value is rewritten when its match is confident enough, the same
+# condition is used by the UPDATE and by the report
+APPLY_CONDITION = """m.entity_name IS NOT NULL
+              AND m.score >= COALESCE(m.min_score, :threshold)
+              AND m.raw_value <> m.entity_name"""
+
+def applied_values(conn, target, threshold, values):
+    """
+        The values among the given ones whose mapping is applied,
+        with the min_score stored in the mapping table.
+    """
+    if not values:
+        return set()
+    rows = conn.execute(
+        text(f"""
+            SELECT m.raw_value FROM reconciliation_mapping AS m
+            WHERE m.target = :target
+              AND m.raw_value = ANY(CAST(:values AS text[]))
+              AND {APPLY_CONDITION}
+        """),
+        {"target": target, "threshold": threshold, "values": list(values)}
+    ).fetchall()
+    return {raw_value for (raw_value,) in rows}
+
+def apply_mappings(conn, table, column, target, threshold, window=None):
+    """
+        It rewrites every value of the column whose mapping is confident
+        enough with one set-based UPDATE, and returns the rows updated.
+        With a window, only the rows changed in the window are rewritten.
+        The rewritten rows keep their updated_at.
+    """
+    conn.execute(text("SET LOCAL drreconcile.skip_tracking = 'on'"))
+    result = conn.execute(
+        text(f"""
+            UPDATE {table} AS t
+            SET {column} = m.entity_name
+            FROM reconciliation_mapping AS m
+            WHERE m.target = :target
+              AND t.{column} = m.raw_value
+              AND {APPLY_CONDITION}{window_clause(window)}
+        """),
+        {"target": target, "threshold": threshold, **window_params(window)}
+    )
+    return result.rowcount
+
+def run(type_param, threshold=None, value_thresholds=None, dry_run=False,
+        remap=False, incremental=False, workers=None):
+    """
+        It normalizes the column of the type and returns the report of the run.
+        With dry_run everything is done in a transaction that is rolled back,
+        so the report shows what would be changed.
+        The incremental window starts WATERMARK_OVERLAP_S before the last
+        watermark, so rows committed late by a long transaction, whose
+        updated_at is its start time, are not missed. Processing them again
+        is harmless, the job is idempotent.
+    """
+    table, column, target = target_of(type_param)
+    threshold = NORMALIZE_THRESHOLD if threshold is None else threshold
+    workers = workers or os.cpu_count() or 1
+    engine = get_engine()
+
+    start = time.perf_counter()
+    window = None
+    with engine.connect() as conn:
+        if incremental:
+            since = read_watermark(conn, target)
+            if since is not None:
+                since -= timedelta(seconds=WATERMARK_OVERLAP_S)
+            window = (since, high_water_mark(conn, table))
+        values = {} if window and window[1] is None else \
+            pending_values(conn, table, column, target, remap, window)
+    vocabularies = load_vocabularies(engine, [type_param])
+    load_aliases(engine)
+    # the pooled connections must not be inherited by the forked workers
+    engine.dispose()
+    matches = reconcile_values(values, vocabularies, type_param, workers) if values else {}
+    reconcile_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        store_mappings(conn, target, matches)
+        set_value_thresholds(conn, target, value_thresholds)
+        updated = apply_mappings(conn, table, column, target, threshold, window)
+        # read before the rollback of a dry run, so it reports what was applied
+        applied = applied_values(conn, target, threshold, matches)
+        if window and window[1] is not None:
+            save_watermark(conn, target, window[1])
+        if dry_run:
+            transaction.rollback()
+        else:
+            transaction.commit()
+    update_s = time.perf_counter() - start
+
+    return {
+        "target": target,
+        "distinct_values": len(values),
+        "rows": sum(values.values()),
+        "values": [
+            {
+                "value": value,
+                "rows": values[value],
+                "entity_id": matches[value][0],
+                "entity_name": matches[value][1],
+                "score": matches[value][2],
+                "applied": value in applied,
+            } for value in sorted(matches)
+        ],
+        "updated_rows": updated,
+        "watermark": window[1].isoformat() if window and window[1] is not None else None,
+        "dry_run": dry_run,
+        "reconcile_s": round(reconcile_s, 2),
+        "update_s": round(update_s, 2),
+    }
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Normalize a column in the database")
+    parser.add_argument("--type", dest="type_param", required=True, choices=sorted(TYPE_TARGETS))
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"minimum score of the values to rewrite, default {NORMALIZE_THRESHOLD}")
+    parser.add_argument("--value-threshold", action="append", metavar="VALUE=SCORE",
+                        help="minimum score of one value, can be repeated")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report the changes and roll them back")
+    parser.add_argument("--remap", action="store_true",
+                        help="reconcile again the values already mapped")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only process the rows changed since the last incremental run")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    report = run(args.type_param,
+                 threshold=args.threshold,
+                 value_thresholds=parse_value_thresholds(args.value_threshold),
+                 dry_run=args.dry_run,
+                 remap=args.remap,
+                 incremental=args.incremental,
+                 workers=args.workers)
+    for value in report["values"]:
+        status = "apply" if value["applied"] else "skip"
+        print(f"{status}\t{value['rows']}\t{value['value']!r} -> "
+              f"{value['entity_name']!r} ({value['score']})")
+    print(f"{report['target']}: {report['distinct_values']} distinct values reconciled, "
+          f"{report['updated_rows']} rows {'would be ' if report['dry_run'] else ''}updated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+    PROFILING
+    On-demand sampling profiler for single requests. A flagged request is run
+    while a background thread records the call stack of the thread doing the
+    work every few milliseconds. The stacks are saved in the collapsed format
+    ("frame;frame;frame count") read by flamegraph.pl and speedscope, and they
+    can be downloaded from the admin endpoints.
+    Only one request is profiled at a time and only a fraction of the flagged
+    requests is sampled, so the profiler can stay enabled in production.
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from .config import (
+    ADMIN_TOKEN,
+    PROFILING_ENABLED,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_INTERVAL_MS,
+    PROFILE_DIR,
+    PROFILE_MAX_FILES
+)
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# a single capture at a time keeps the overhead bounded
+_capture_slot = threading.Semaphore(1)
+
+
+def is_admin(token) -> bool:
+    """
+        It checks the admin token in constant time.
+        Admin access is disabled when no token is configured.
+    """
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+def _frame_label(code) -> str:
+    """
+        A stack frame is labelled with the function name, the file
+        and the first line of the function.
+    """
+    filename = os.path.join(os.path.basename(os.path.dirname(code.co_filename)),
+                            os.path.basename(code.co_filename))
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class ProfileCapture:
+    """
+        It samples the stack of the thread that enters it, until it exits.
+        It is used through run_profiled, in the threadpool thread doing the
+        work, and never around awaits: the event loop thread runs the other
+        requests too. The capture slot is only taken while it is entered, so
+        a request cancelled before its work starts does not keep it; when
+        another capture holds the slot, the work runs without sampling.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.profile_id = uuid.uuid4().hex
+        self.interval = PROFILE_INTERVAL_MS / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._target = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+        self.active = False
+
+    def __enter__(self):
+        self.active = _capture_slot.acquire(blocking=False)
+        if not self.active:
+            return self
+        self._target = threading.get_ident()
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample,
+                                         name="profile-sampler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.active:
+            return False
+        self._stop.set()
+        self._sampler.join()
+        try:
+            self._save(time.perf_counter() - self._started)
+        finally:
+            _capture_slot.release()
+        return False
+
+    def _sample(self):
+        """
+            Sampler loop: the stack is read from the outermost frame
+            to the one currently running.
+        """
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def _save(self, duration):
+        """
+            It writes the collapsed stacks and their metadata,
+            then removes the oldest profiles above PROFILE_MAX_FILES.
+        """
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+        with open(os.path.join(PROFILE_DIR, f"{self.profile_id}.collapsed"),
+                  "w", encoding="utf-8") as f:
+            f.write(collapsed + "\n")
+        with open(os.path.join(PROFILE_DIR, f"{self.profile_id}.json"),
+                  "w", encoding="utf-8") as f:
+            json.dump({
+                "id": self.profile_id,
+                "label": self.label,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "duration_s": round(duration, 4),
+                "interval_ms": PROFILE_INTERVAL_MS,
+                "samples": self.samples,
+            }, f)
+        _rotate()
+
+
+def profile_request(request, label):
+    """
+        It returns a ProfileCapture when the request asks to be profiled
+        (X-Profile header or profile=1 query parameter), carries the admin
+        token and falls in the sampled fraction. Otherwise it returns None.
+    """
+    if not PROFILING_ENABLED:
+        return None
+    flagged = (request.headers.get("X-Profile") == "1"
+               or request.query_params.get("profile") == "1")
+    if not flagged or not is_admin(request.headers.get("X-Admin-Token")):
+        return None
+    if random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    return ProfileCapture(label)
+
+def run_profiled(capture, fn, *args):
+    """
+        It calls fn in the current thread, under the capture if there is one.
+    """
+    if capture is None:
+        return fn(*args)
+    with capture:
+        return fn(*args)
+
+def profile_headers(capture) -> dict:
+    """
+        It returns the header telling the client the id of its profile,
+        when its request was sampled.
+    """
+    if capture is None or not capture.active:
+        return {}
+    return {"X-Profile-Id": capture.profile_id}
+
+def list_profiles():
+    """
+        It returns the metadata of the stored profiles, newest first.
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILE_DIR):
+        if name.endswith(".json"):
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                profiles.append(json.load(f))
+    return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+def profile_path(profile_id):
+    """
+        It returns the path of the collapsed stacks of a profile,
+        or None if the id is not valid or the profile does not exist.
+    """
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.collapsed")
+    return path if os.path.exists(path) else None
+
+def _rotate():
+    """
+        It keeps only the newest PROFILE_MAX_FILES profiles.
+    """
+    for profile in list_profiles()[PROFILE_MAX_FILES:]:
+        for extension in (".collapsed", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile["id"] + extension))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,161 @@
+"""
+    INFERENCE SCHEDULER
+    Micro-batching of model inference across concurrent reconcile requests.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class InferenceScheduler:
+    """
+        The scheduler collects the texts submitted by every in-flight request
+        into a single queue. A background thread takes the texts out of the queue
+        and runs them through the model as one padded batch, as soon as either
+        max_batch_size texts are waiting or the oldest text has waited max_wait_ms.
+        Each caller receives a Future resolved with its own embedding, so callers
+        never see the batching. The model is only ever used by the background
+        thread, therefore it is never run concurrently.
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=32, max_wait_ms=5.0):
+        # batch_fn takes a list of strings and returns one vector per string
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        # metrics
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.last_batch_size = 0
+        self.batch_size_counts = {}
+        # optional callback receiving the size of every flushed batch
+        self.on_batch = None
+        # optional callback receiving the change of the queue depth,
+        # +1 for every text queued and minus the texts taken for a batch
+        self.on_queue = None
+
+    def _ensure_worker(self):
+        """
+            The worker thread is started on the first submission. It is also
+            restarted when the process has been forked, because threads are
+            not copied into the child process.
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run,
+                                            name=f"{self.name}-scheduler",
+                                            daemon=True)
+            self._thread.start()
+
+    def submit(self, text) -> Future:
+        """
+            It queues a text for the next batch and returns the Future
+            that will hold its embedding.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        if self.on_queue is not None:
+            self.on_queue(1)
+        return future
+
+    def map(self, texts):
+        """
+            It submits all the texts at once, so that they can share a batch,
+            and waits for every embedding. The results keep the input order.
+        """
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def _run(self):
+        """
+            Worker loop: block until a text arrives, then keep collecting
+            until the batch is full or the deadline of the first text expires.
+        """
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if self.on_queue is not None:
+                self.on_queue(-len(batch))
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """
+            It runs one forward pass for the whole batch. Identical texts are
+            encoded only once and the error of a failed pass is given to
+            every caller of the batch.
+        """
+        # cancelled callers are dropped from the batch
+        pending = [(text, future) for text, future in batch
+                   if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+
+        unique_texts = list(dict.fromkeys(text for text, _ in pending))
+        self._record(len(unique_texts))
+        try:
+            vectors = self.batch_fn(unique_texts)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            for _, future in pending:
+                future.set_exception(e)
+            return
+
+        by_text = dict(zip(unique_texts, vectors))
+        for text, future in pending:
+            future.set_result(by_text[text])
+
+    def _record(self, size):
+        """
+            It updates the batch-size metrics.
+        """
+        self.batches += 1
+        self.items += size
+        self.last_batch_size = size
+        self.largest_batch = max(self.largest_batch, size)
+        self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+        if self.on_batch is not None:
+            self.on_batch(size)
+
+    def queue_depth(self) -> int:
+        """
+            Number of texts waiting for the next batch.
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        """
+            It returns the queue depth and the batch-size metrics as a dictionary.
+        """
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue_depth(),
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+            "last_batch_size": self.last_batch_size,
+            "largest_batch_size": self.largest_batch,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+        }
@@ -0,0 +1,302 @@
+"""
+    SCORING
+    Candidate scoring for each reconciliation type. The sexual orientation
+    and ICD-11 scores go through a cascade of stages, from the cheapest to
+    the most expensive, and a stage only runs when the previous ones could not
+    decide the best candidate:
+    1. exact: the normalized query is equal to a normalized label or alias
+    2. lexical: partial ratio, decisive when the best candidate is above the
+       threshold and clearly ahead of the second one
+    3. semantic: SapBERT/SBERT cosine similarity, skipped when the request
+       budget is nearly spent (see deadline.py)
+    Each match reports the stage that decided it. When the exact stage finds
+    the query, only the exact matches are returned: the other candidates are
+    not scored.
+"""
+import heapq
+import re
+from thefuzz import fuzz
+from .config import (
+    CASCADE_ENABLED,
+    CASCADE_THRESHOLD,
+    CASCADE_MARGIN,
+    TOPK_PRUNING,
+    HIERARCHICAL_MATCHING,
+    SEMANTIC_RESERVE_S
+)
+from .deadline import allows
+from .hierarchy import matcher_for
+from .metrics import LEXICAL_SCORES, stage
+from .helper import (
+    partial_ratio,
+    partial_ratio_bound,
+    cosine_similarity,
+    remove_html_tags,
+    sap_encode_many,
+    encode,
+    encode_many
+)
+
+ETHNICITY_TYPE = [{"id": "/ethnicity", "name": "Ethnicity"}]
+SEXUAL_ORIENTATION_TYPE = [{"id": "/sexual-orientation", "name": "Sexual Orientation"}]
+ICD11_TYPE = [{"id": "/icd11", "name": "Diagnosis"}]
+
+STAGE_EXACT = "exact"
+STAGE_LEXICAL = "lexical"
+STAGE_SEMANTIC = "semantic"
+
+
+def normalize(value: str) -> str:
+    """
+        Cheap normalization used by the exact stage: lowercase,
+        no parentheses and single spaces.
+    """
+    value = value.lower().replace("(", "").replace(")", "")
+    return re.sub(r"\s+", " ", value).strip()
+
+def so_aliases(soname: str) -> list:
+    """
+        Normalize candidate labels:
+        Lowercase
+        Remove parentheses
+        Split on the word “or” and treat as multiple aliases
+        (e.g., “Gay or Lesbian” becomes ["Gay", "Lesbian"],
+        “All other sexual orientations” stays whole)
+    """
+    # Normalize and clean the soname string
+    clean_soname = soname.lower().replace("(", "").replace(")", "")
+    # Split and strip each alias
+    return [a.strip() for a in re.split(r"\bor\b", clean_soname)]
+
+def lexical_is_decisive(lexical_scores) -> bool:
+    """
+        The lexical stage settles the ranking when the best score reaches
+        the threshold and leads the runner-up by at least the margin.
+    """
+    if not lexical_scores:
+        return False
+    ranked = sorted(lexical_scores, reverse=True)
+    runner_up = ranked[1] if len(ranked) > 1 else 0
+    return ranked[0] >= CASCADE_THRESHOLD and ranked[0] - runner_up >= CASCADE_MARGIN
+
+def top_k_partial_ratio(query_string, labels, k):
+    """
+        The partial ratio of the query with the labels that can be among the
+        k best, index -> score. The labels are scored in decreasing order of
+        their upper bound (helper.partial_ratio_bound) and the scan stops at the
+        first bound below the k-th best score found so far: no label left can
+        reach it, so the k best are those of the exhaustive scoring, ties
+        included, as the sort of reconcile_query keeps the order of the labels.
+    """
+    if k <= 0:
+        return {}
+    bounds = [partial_ratio_bound(query_string, label) for label in labels]
+    best = []
+    scores = {}
+    for index in sorted(range(len(labels)), key=lambda i: -bounds[i]):
+        if len(best) == k and bounds[index] < best[0]:
+            break
+        scores[index] = partial_ratio(query_string, labels[index])
+        if len(best) < k:
+            heapq.heappush(best, scores[index])
+        else:
+            heapq.heappushpop(best, scores[index])
+    return scores
+
+def score_ethnicity(query_string, rows, limit=None):
+    """
+        Ethnicity candidates are only scored lexically,
+        with the partial ratio against each description.
+        With a limit, only the descriptions that can be among the limit best
+        are scored (see top_k_partial_ratio), the others are left out, or only
+        those of the best groups with the hierarchical matcher (hierarchy.py).
+    """
+    with stage("lexical", "/ethnicity"):
+        if limit is not None and HIERARCHICAL_MATCHING:
+            leaves, comparisons = matcher_for(rows).match(query_string, limit)
+            scored = [((ethnicity_id, description), score)
+                      for ethnicity_id, description, score in leaves]
+            LEXICAL_SCORES.labels("/ethnicity", "scored").inc(comparisons)
+            LEXICAL_SCORES.labels("/ethnicity", "pruned").inc(max(0, len(rows) - comparisons))
+        elif limit is None or not TOPK_PRUNING:
+            # Calculates similarity score with each entry
+            scored = list(zip(rows, (partial_ratio(query_string, description)
+                                     for _, description in rows)))
+        else:
+            scores = top_k_partial_ratio(query_string, [d for _, d in rows], limit)
+            scored = [(rows[i], scores[i]) for i in sorted(scores)]
+            LEXICAL_SCORES.labels("/ethnicity", "scored").inc(len(scored))
+            LEXICAL_SCORES.labels("/ethnicity", "pruned").inc(len(rows) - len(scored))
+
+    matches = []
+    for (ethnicity_id, description), score in scored:
+        matches.append({
+            "id": f"/ethnicity/{ethnicity_id}",
+            "name": description,
+            "score": score,
+            "match": score >= 90,
+            "stage": STAGE_LEXICAL,
+            "type": ETHNICITY_TYPE
+        })
+    return matches
+
+def score_sexual_orientation(query_string, rows, compiled=None):
+    """
+        Sexual orientation candidates go through the cascade. The exact stage
+        compares the query with every alias of the label, the lexical stage
+        uses the partial ratio against the whole label and the semantic stage
+        the SBERT similarity with the closest alias.
+        compiled is the compiled vocabulary of the rows (see artifact.py):
+        its hash table replaces the scan of the exact stage and its alias
+        embeddings are used instead of encoding the aliases again.
+    """
+    normalized_query = normalize(query_string)
+
+    # Stage 1: exact lookup
+    if CASCADE_ENABLED and normalized_query:
+        if compiled is not None:
+            exact = [rows[i] for i in compiled.exact(normalized_query)]
+        else:
+            exact = [(so_id, soname) for so_id, soname in rows
+                     if normalized_query in (normalize(soname), *so_aliases(soname))]
+        if exact:
+            return [{
+                "id": f"/sexual-orientation/{so_id}",
+                "name": soname,
+                "semantic_score": None,
+                "lexical_score": 100,
+                "score": 100,
+                "match": True,
+                "stage": STAGE_EXACT,
+                "type": SEXUAL_ORIENTATION_TYPE
+            } for so_id, soname in exact]
+
+    # Stage 2: lexical similarity
+    with stage("lexical", "/sexual-orientation"):
+        lexical_scores = [partial_ratio(query_string, soname) for _, soname in rows]
+    # the semantic stage is also skipped when the request is running out of time
+    if ((CASCADE_ENABLED and lexical_is_decisive(lexical_scores))
+            or not allows(STAGE_SEMANTIC, SEMANTIC_RESERVE_S)):
+        return [{
+            "id": f"/sexual-orientation/{so_id}",
+            "name": soname,
+            "semantic_score": None,
+            "lexical_score": lexical_score,
+            "score": lexical_score,
+            "match": lexical_score >= 90,
+            "stage": STAGE_LEXICAL,
+            "type": SEXUAL_ORIENTATION_TYPE
+        } for (so_id, soname), lexical_score in zip(rows, lexical_scores)]
+
+    # Stage 3: semantic similarity
+    with stage("sbert", "/sexual-orientation"):
+        # Lowercase the query once and encode it once for all the candidates
+        query_encoded = encode(query_string.lower())
+        if compiled is not None:
+            aliases = compiled.alias_groups()
+            alias_vecs = iter(compiled.sbert)
+        else:
+            # the aliases of all the labels are encoded in the same batch
+            aliases = [so_aliases(soname) for _, soname in rows]
+            alias_vecs = iter(encode_many([alias for group in aliases for alias in group]))
+
+    matches = []
+    for (so_id, soname), lexical_score, group in zip(rows, lexical_scores, aliases):
+        # Compute similarity scores for each alias
+        scores = [cosine_similarity(query_encoded, next(alias_vecs)) for _ in group]
+        semantic_score = max(scores) * 100
+
+        # Match if either score is above threshold
+        is_match = bool(semantic_score >= 90 or lexical_score >= 90)
+
+        matches.append({
+            "id": f"/sexual-orientation/{so_id}",
+            "name": soname,
+            "semantic_score": round(semantic_score, 2),
+            "lexical_score": lexical_score,
+            "score": max(semantic_score, lexical_score),
+            "match": is_match,
+            "stage": STAGE_SEMANTIC,
+            "type": SEXUAL_ORIENTATION_TYPE
+        })
+    return matches
+
+def score_icd11(query_string, icd_results):
+    """
+        ICD-11 entities returned by the search go through the cascade.
+        The exact stage compares the normalized query with the normalized title,
+        the lexical stage uses fuzz.partial_ratio and the semantic stage
+        the best of the SapBERT and SBERT similarities.
+    """
+    # Extract the unique ICD identifiers and clean the titles by removing any HTML tags
+    entities = [(entity.get("id", None), remove_html_tags(entity.get("title", "")))
+                for entity in icd_results]
+    # nothing to score, no stage is skipped
+    if not entities:
+        return []
+    normalized_query = normalize(query_string)
+
+    # Stage 1: exact lookup
+    if CASCADE_ENABLED and normalized_query:
+        exact = [(icd_id, title) for icd_id, title in entities
+                 if normalize(title) == normalized_query]
+        if exact:
+            return [{
+                "id": icd_id,
+                "name": title,
+                "semantic_score": None,
+                "lexical_score": 100,
+                "score": 100,
+                "match": True,
+                "stage": STAGE_EXACT,
+                "type": ICD11_TYPE
+            } for icd_id, title in exact]
+
+    # Stage 2: lexical similarity
+    with stage("lexical", "/icd11"):
+        lexical_scores = [fuzz.partial_ratio(query_string, title) for _, title in entities]
+    if ((CASCADE_ENABLED and lexical_is_decisive(lexical_scores))
+            or not allows(STAGE_SEMANTIC, SEMANTIC_RESERVE_S)):
+        return [{
+            "id": icd_id,
+            "name": title,
+            "semantic_score": None,
+            "lexical_score": lexical_score,
+            "score": lexical_score,
+            "match": lexical_score >= 90,
+            "stage": STAGE_LEXICAL,
+            "type": ICD11_TYPE
+        } for (icd_id, title), lexical_score in zip(entities, lexical_scores)]
+
+    # Stage 3: semantic similarity
+    # The query and all the titles are submitted together,
+    # so each model needs a single batched forward pass
+    titles = [title for _, title in entities]
+    with stage("sapbert", "/icd11"):
+        sap_query_vec, *sap_title_vecs = sap_encode_many([query_string, *titles])
+    with stage("sbert", "/icd11"):
+        sbert_query_vec, *sbert_title_vecs = encode_many([query_string, *titles])
+
+    matches = []
+    for (icd_id, title), lexical_score, sap_title_vec, sbert_title_vec in zip(
+            entities, lexical_scores, sap_title_vecs, sbert_title_vecs):
+        sap_score = cosine_similarity(sap_query_vec, sap_title_vec) * 100
+        sbert_score = cosine_similarity(sbert_query_vec, sbert_title_vec) * 100
+
+        # Combine scores
+        semantic_score = max(sap_score, sbert_score)
+
+        # Match logic
+        is_match = bool(semantic_score >= 90 or lexical_score >= 90)
+
+        matches.append({
+            "id": icd_id,
+            "name": title,
+            "semantic_score": round(semantic_score, 2),
+            "lexical_score": lexical_score,
+            "score": max(semantic_score, lexical_score),
+            "match": is_match,
+            "stage": STAGE_SEMANTIC,
+            "type": ICD11_TYPE
+        })
+    return matches
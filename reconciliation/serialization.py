@@ -0,0 +1,132 @@
+"""
+    RESPONSE SERIALIZATION
+    The reconcile responses are encoded with orjson, which writes the NumPy
+    scalars of the semantic scores (float32 from the models, bool_) natively
+    where the standard encoder of JSONResponse raises TypeError on them.
+    In compact mode the candidates only keep the fields of the reconciliation
+    API (id, name, score, match): the per-stage scores, the stage and the
+    type array repeated in every candidate are left out. Bodies of at least
+    COMPRESS_MIN_BYTES are compressed with brotli or gzip, as negotiated with
+    the Accept-Encoding header of the request.
+"""
+import gzip
+import brotli
+import numpy as np
+import orjson
+from fastapi import Response
+from .config import COMPACT_RESPONSES, COMPRESS_MIN_BYTES
+from .metrics import RESPONSE_BYTES, stage, timing_headers
+
+JSON_MEDIA_TYPE = "application/json"
+# fields of a candidate kept in compact mode
+COMPACT_FIELDS = ("id", "name", "score", "match")
+# preferred first, when the client accepts both with the same weight
+ENCODINGS = ("br", "gzip")
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+def _default(value):
+    """
+        The NumPy values orjson does not write natively, as Python values.
+    """
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content) -> bytes:
+    """
+        The content encoded as JSON bytes.
+    """
+    return orjson.dumps(content, default=_default,
+                        option=orjson.OPT_SERIALIZE_NUMPY)
+
+def compact_candidate(candidate) -> dict:
+    """
+        The candidate with only the fields of the reconciliation API.
+    """
+    return {field: candidate[field] for field in COMPACT_FIELDS if field in candidate}
+
+def compact_line(line) -> dict:
+    """
+        A key of the /reconcile response, or a line of /reconcile/stream,
+        with compact candidates. Its other fields are kept.
+    """
+    if "result" not in line:
+        return line
+    return {**line, "result": [compact_candidate(c) for c in line["result"]]}
+
+def compact_results(response) -> dict:
+    """
+        The response of /reconcile with compact candidates, key by key,
+        whatever the names of the keys.
+    """
+    return {key: compact_line(value) for key, value in response.items()}
+
+def is_compact(request) -> bool:
+    """
+        True when the request asks for compact candidates with compact=1,
+        False when it asks for the full ones with compact=0. Without the
+        parameter it is COMPACT_RESPONSES, off unless configured.
+    """
+    value = request.query_params.get("compact")
+    if value in (None, ""):
+        return COMPACT_RESPONSES
+    return value.lower() in ("1", "true", "yes")
+
+def negotiate_encoding(accept_encoding) -> str:
+    """
+        The content coding of the response: the accepted one with the highest
+        weight among brotli and gzip, None when neither is accepted.
+    """
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    best, best_weight = None, 0.0
+    for coding in ENCODINGS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+def compress(body, encoding) -> bytes:
+    """
+        The body compressed with the content coding.
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+def encode_response(content, request, timings=None, headers=None, compact=None,
+                    route="/reconcile"):
+    """
+        The JSON response of the content, in compact mode when asked and
+        compressed when it is large enough and the client accepts it.
+        The serialization is timed with the other stages of the request,
+        and the bytes sent are counted by encoding in RESPONSE_BYTES.
+    """
+    compact = is_compact(request) if compact is None else compact
+    encoding = None
+    with stage("serialize"):
+        body = dumps(compact_results(content) if compact else content)
+        if len(body) >= COMPRESS_MIN_BYTES:
+            encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            body = compress(body, encoding)
+    headers = {**timing_headers(timings), **(headers or {})}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    # the body depends on the Accept-Encoding of the request
+    headers["Vary"] = "Accept-Encoding"
+    RESPONSE_BYTES.labels(route, encoding or "identity").inc(len(body))
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers=headers)
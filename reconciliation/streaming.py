@@ -0,0 +1,236 @@
+"""
+    STREAMING QUERIES
+    Incremental parsing of the reconcile payload for /reconcile/stream: the
+    queries are yielded one key at a time while the body is still being
+    received, so that they can be scored before the end of a large batch.
+    The body is either the form sent by OpenRefine (queries=<JSON>) or the JSON
+    object of the queries itself.
+    The response is sent while the body is still being received, so the
+    disconnect of the client is only listened for once the body has been read
+    (see BodyStreamingResponse).
+"""
+import codecs
+import json
+import re
+from urllib.parse import unquote_to_bytes
+from fastapi.responses import StreamingResponse
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+class QueryStreamParser:
+    """
+        Incremental parser of a JSON object of queries, {"q0": {...}, "q1": {...}}.
+        feed() returns the (key, query) pairs completed by the new text, close()
+        raises ValueError when the object is incomplete. A query is only decoded
+        once its closing brace has been received.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        # start, key, colon, value, separator or done
+        self._state = "start"
+        self._key = None
+        self._count = 0
+
+    def _skip(self, pos):
+        return _WHITESPACE.match(self._buffer, pos).end()
+
+    def _decode(self, pos):
+        """
+            The JSON value at pos and the position after it, None when the
+            value is not complete yet.
+        """
+        try:
+            return self._decoder.raw_decode(self._buffer, pos)
+        except json.JSONDecodeError:
+            return None
+
+    def feed(self, text):
+        """
+            It adds text to the buffer and returns the queries it completes.
+        """
+        self._buffer += text
+        queries = []
+        pos = 0
+        while True:
+            pos = self._skip(pos)
+            if pos == len(self._buffer):
+                break
+            char = self._buffer[pos]
+            if self._state == "done":
+                raise ValueError("Unexpected data after the queries.")
+            if self._state == "start":
+                if char != "{":
+                    raise ValueError("The queries must be a JSON object.")
+                self._state, pos = "key", pos + 1
+            elif self._state == "key":
+                # only an empty object can close without a query
+                if char == "}" and self._count == 0:
+                    self._state, pos = "done", pos + 1
+                    continue
+                if char != '"':
+                    raise ValueError("Malformed JSON in request payload.")
+                decoded = self._decode(pos)
+                if decoded is None:
+                    break
+                self._key, pos = decoded
+                self._state = "colon"
+            elif self._state == "colon":
+                if char != ":":
+                    raise ValueError("Malformed JSON in request payload.")
+                self._state, pos = "value", pos + 1
+            elif self._state == "value":
+                decoded = self._decode(pos)
+                if decoded is None:
+                    if char != "{":
+                        raise ValueError("Malformed JSON in request payload.")
+                    break
+                query, pos = decoded
+                if not isinstance(query, dict):
+                    raise ValueError(f"Query {self._key} must be a JSON object.")
+                queries.append((self._key, query))
+                self._count += 1
+                self._state = "separator"
+            else:
+                if char not in ",}":
+                    raise ValueError("Malformed JSON in request payload.")
+                self._state, pos = ("key" if char == "," else "done"), pos + 1
+        self._buffer = self._buffer[pos:]
+        return queries
+
+    def close(self):
+        """
+            It checks that the whole object was received.
+        """
+        if self._state != "done":
+            raise ValueError("Malformed JSON in request payload.")
+
+
+class FormFieldDecoder:
+    """
+        Incremental decoder of one field of an application/x-www-form-urlencoded
+        body. feed() returns the decoded text of the field received so far, a
+        percent escape split between two chunks is kept until it is complete.
+    """
+
+    def __init__(self, field="queries"):
+        self._prefix = f"{field}=".encode("ascii")
+        self._pending = b""
+        # search, skip (another field), value or done
+        self._state = "search"
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    def _decode(self, data, final=False):
+        return self._utf8.decode(unquote_to_bytes(data.replace(b"+", b" ")), final)
+
+    def feed(self, data, final=False):
+        """
+            It adds bytes of the body and returns the new text of the field.
+        """
+        self._pending += data
+        text = ""
+        while self._pending or final:
+            if self._state == "done":
+                self._pending = b""
+                break
+            if self._state == "skip":
+                end = self._pending.find(b"&")
+                if end < 0:
+                    self._pending = b""
+                    break
+                self._state, self._pending = "search", self._pending[end + 1:]
+            elif self._state == "search":
+                if self._pending.startswith(self._prefix):
+                    self._state, self._pending = "value", self._pending[len(self._prefix):]
+                elif self._prefix.startswith(self._pending) and not final:
+                    break
+                elif not self._pending:
+                    break
+                else:
+                    self._state = "skip"
+            else:
+                end = self._pending.find(b"&")
+                if end >= 0:
+                    text += self._decode(self._pending[:end], final=True)
+                    self._state, self._pending = "done", b""
+                    break
+                # an escape split between two chunks waits for the next one
+                keep = 0
+                if not final and self._pending.endswith(b"%"):
+                    keep = 1
+                elif not final and self._pending[-2:-1] == b"%":
+                    keep = 2
+                ready = self._pending[:len(self._pending) - keep]
+                self._pending = self._pending[len(self._pending) - keep:]
+                text += self._decode(ready, final)
+                if final:
+                    self._state = "done"
+                break
+        return text
+
+    def close(self):
+        """
+            It decodes what is left and checks that the field was found.
+        """
+        text = self.feed(b"", final=True)
+        if self._state != "done":
+            raise ValueError("Missing 'queries' parameter.")
+        return text
+
+
+async def iter_queries(chunks, content_type=""):
+    """
+        It yields the (key, query) pairs of the body, given as an async
+        iterator of bytes, as soon as each query has been received.
+        It raises ValueError when the body is malformed.
+    """
+    parser = QueryStreamParser()
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        form = FormFieldDecoder()
+        async for chunk in chunks:
+            for query in parser.feed(form.feed(chunk)):
+                yield query
+        for query in parser.feed(form.close()):
+            yield query
+    else:
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        async for chunk in chunks:
+            for query in parser.feed(utf8.decode(chunk)):
+                yield query
+        for query in parser.feed(utf8.decode(b"", final=True)):
+            yield query
+    parser.close()
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+        StreamingResponse whose content is computed from the request body
+        while it is still being received. Before ASGI 2.4, StreamingResponse
+        listens for the disconnect from the start of the response, and its
+        receive() calls take the chunks of the body that the content is still
+        waiting for. Here the disconnect is only listened for once the body
+        has been read, as told by the body_read event.
+    """
+
+    def __init__(self, content, body_read, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def listen_for_disconnect(self, receive):
+        await self.body_read.wait()
+        await super().listen_for_disconnect(receive)
+
+
+async def read_body(request, body_read):
+    """
+        It yields the chunks of the request body and sets body_read once
+        they have all been read, or the reading has stopped.
+    """
+    try:
+        async for chunk in request.stream():
+            yield chunk
+    finally:
+        body_read.set()
+
@@ -0,0 +1,156 @@
+"""
+    TYPE INFERENCE
+    Cheap routing of the queries sent without a type. Instead of searching
+    every type (two vocabularies and the ICD-11 API with the transformer
+    models), the query is compared with a character trigram profile and
+    the keywords of each vocabulary, and the types already seen in the same
+    batch, usually the same OpenRefine column, are used as a prior.
+    Null-like values ("Unknown", "Prefer not to say") exist in both vocabularies,
+    so they are searched in both, but never sent to ICD-11.
+    When no type is plausible enough, all of them are searched.
+"""
+import math
+import re
+from collections import Counter
+from database.generate_patient import ethnicity_values, sexual_orientation_values
+from database.registration import ADMISSION_REASONS
+from .config import (
+    TYPE_ROUTER_ENABLED,
+    TYPE_ROUTER_MIN_SCORE,
+    TYPE_ROUTER_RELATIVE,
+    TYPE_ROUTER_PRIOR_WEIGHT
+)
+from .helper import NULL_TERMS
+from .metrics import ROUTED_QUERIES
+from .scoring import normalize
+
+TYPES = ("/ethnicity", "/sexual-orientation", "/icd11")
+# bonus of a query containing a word that belongs to a single vocabulary
+KEYWORD_BONUS = 0.5
+# vocabularies searched for null-like values
+NULL_TYPES = {"/ethnicity", "/sexual-orientation"}
+
+
+def trigrams(value: str) -> Counter:
+    """
+        Character trigrams of the normalized value, padded with spaces
+        so that the first and last letters of each word count too.
+    """
+    padded = f" {normalize(value)} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def words(value: str) -> set:
+    """
+        Words of at least three letters of the normalized value.
+    """
+    return {w for w in re.split(r"[^a-z0-9]+", normalize(value)) if len(w) >= 3}
+
+def _unit(counts: Counter) -> dict:
+    norm = math.sqrt(sum(c * c for c in counts.values()))
+    return {k: c / norm for k, c in counts.items()} if norm else {}
+
+
+class TypeClassifier:
+    """
+        It scores how plausible each type is for a query. The score is the
+        cosine similarity between the trigrams of the query and those of the
+        whole vocabulary of the type, plus a bonus when the query contains
+        a word only found in that vocabulary.
+    """
+
+    def __init__(self, examples):
+        # examples: type -> list of labels and known values of that type
+        self.profiles = {}
+        type_words = {}
+        for type_param, labels in examples.items():
+            profile = Counter()
+            for label in labels:
+                profile.update(trigrams(label))
+            self.profiles[type_param] = _unit(profile)
+            type_words[type_param] = set().union(*(words(label) for label in labels))
+        # words found in more than one vocabulary or in the null-like values
+        # do not tell the type apart
+        shared = Counter(w for ws in type_words.values() for w in ws)
+        null_words = set().union(*(words(term) for term in NULL_TERMS))
+        self.keywords = {t: {w for w in ws if shared[w] == 1 and w not in null_words}
+                         for t, ws in type_words.items()}
+
+    def scores(self, query_string) -> dict:
+        """
+            It returns the score of every type for the query.
+        """
+        query = _unit(trigrams(query_string))
+        query_words = words(query_string)
+        scores = {}
+        for type_param, profile in self.profiles.items():
+            score = sum(weight * profile.get(gram, 0.0) for gram, weight in query.items())
+            if query_words & self.keywords[type_param]:
+                score += KEYWORD_BONUS
+            scores[type_param] = score
+        return scores
+
+
+# classifiers already built, keyed by the vocabulary labels
+_classifiers = {}
+
+def classifier_for(vocabularies) -> TypeClassifier:
+    """
+        It returns the classifier of the given vocabularies, trained on their
+        labels, on the values written by generate_patient and, for ICD-11,
+        on the admission reasons. It is built once per distinct vocabulary.
+    """
+    examples = {
+        "/ethnicity": [label for _, label in vocabularies.get("/ethnicity", [])]
+                      + ethnicity_values,
+        "/sexual-orientation": [label for _, label in vocabularies.get("/sexual-orientation", [])]
+                               + sexual_orientation_values,
+        "/icd11": list(ADMISSION_REASONS),
+    }
+    key = tuple((t, tuple(labels)) for t, labels in examples.items())
+    if key not in _classifiers:
+        _classifiers[key] = TypeClassifier(examples)
+    return _classifiers[key]
+
+
+class TypeRouter:
+    """
+        It chooses the types to search for the untyped queries of one batch.
+        The types of the typed queries and of the matched untyped queries
+        are remembered, and their share is added to the classifier scores.
+    """
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.seen = Counter()
+
+    def observe(self, type_param):
+        """
+            It records a type seen in the batch.
+        """
+        if type_param in TYPES:
+            self.seen[type_param] += 1
+
+    def route(self, query_string) -> set:
+        """
+            It returns the plausible types of an untyped query,
+            or all the types when none is plausible enough.
+        """
+        if not TYPE_ROUTER_ENABLED:
+            return set(TYPES)
+        if query_string.strip().lower() in NULL_TERMS:
+            for type_param in NULL_TYPES:
+                ROUTED_QUERIES.labels(type_param).inc()
+            return set(NULL_TYPES)
+        scores = self.classifier.scores(query_string)
+        total = sum(self.seen.values())
+        if total:
+            for type_param in scores:
+                scores[type_param] += TYPE_ROUTER_PRIOR_WEIGHT * self.seen[type_param] / total
+        best = max(scores.values())
+        if best < TYPE_ROUTER_MIN_SCORE:
+            ROUTED_QUERIES.labels("all").inc()
+            return set(TYPES)
+        routed = {t for t, score in scores.items() if score >= best * TYPE_ROUTER_RELATIVE}
+        for type_param in routed:
+            ROUTED_QUERIES.labels(type_param).inc()
+        return routed
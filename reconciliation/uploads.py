@@ -0,0 +1,142 @@
+"""
+    UPLOADED FILES
+    Readers of the reconciled files uploaded to /fetch-update-reconciled-data.
+    CSV is parsed by pandas, a chunk at a time. Parquet and Arrow IPC (stream
+    or file) are read a record batch at a time: the columns are taken from the
+    batch without copying, only the rows with a patient id and a value are kept,
+    and the columns are turned into the Python lists the bulk UPDATE binds as
+    arrays, without building a DataFrame.
+"""
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+FORMATS = ("csv", "parquet", "arrow")
+BATCH_ROWS = 65_536
+
+CONTENT_TYPES = {
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+}
+EXTENSIONS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+    ".ipc": "arrow",
+    ".feather": "arrow",
+}
+PARQUET_MAGIC = b"PAR1"
+ARROW_FILE_MAGIC = b"ARROW1"
+# every message of an Arrow IPC stream starts with the continuation marker
+ARROW_STREAM_MAGIC = b"\xff\xff\xff\xff"
+
+
+def upload_format(fileobj, filename=None, content_type=None, requested=None):
+    """
+        The format is the one requested, or the one of the content type,
+        of the file extension or of the first bytes of the file, CSV otherwise.
+    """
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported format: {requested}")
+        return requested
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    extension = "." + (filename or "").lower().rpartition(".")[2]
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+    head = fileobj.read(len(ARROW_FILE_MAGIC))
+    fileobj.seek(0)
+    if head.startswith(PARQUET_MAGIC):
+        return "parquet"
+    if head.startswith((ARROW_FILE_MAGIC, ARROW_STREAM_MAGIC)):
+        return "arrow"
+    return "csv"
+
+def _arrow_batches(fileobj, fmt, columns, batch_rows):
+    """
+        The record batches of a Parquet or Arrow IPC file, with only the columns
+        it has among the requested ones.
+    """
+    if fmt == "parquet":
+        parquet = pq.ParquetFile(fileobj)
+        present = [c for c in columns if c in parquet.schema_arrow.names]
+        yield from parquet.iter_batches(batch_size=batch_rows, columns=present)
+        return
+    is_file = fileobj.read(len(ARROW_FILE_MAGIC)) == ARROW_FILE_MAGIC
+    fileobj.seek(0)
+    if is_file:
+        reader = pa.ipc.open_file(fileobj)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+    else:
+        yield from pa.ipc.open_stream(fileobj)
+
+def _strings(array):
+    """
+        The values of a text column as Python strings, None for the nulls.
+        A reconciled column repeats a few labels, so only the distinct ones
+        are converted, and shared by the rows through the dictionary indices.
+    """
+    encoded = pc.dictionary_encode(pc.cast(array, pa.string()))
+    labels = encoded.dictionary.to_pylist() + [None]
+    return [labels[i] for i in encoded.indices.fill_null(-1).to_numpy().tolist()]
+
+def _arrow_updates(batch, columns):
+    """
+        The patient ids, values and entity ids of the rows of a record batch
+        that have a patient id and a value.
+    """
+    names = batch.schema.names
+    patientids, values, entity_ids = (batch.column(names.index(c)) if c in names else None
+                                      for c in columns)
+    if patientids is None or values is None:
+        return [], [], []
+    valid = pc.and_(pc.is_valid(patientids), pc.is_valid(values))
+    if pa.types.is_floating(patientids.type):
+        valid = pc.and_(valid, pc.invert(pc.is_nan(patientids)))
+    if not pc.all(valid).as_py():
+        patientids, values = patientids.filter(valid), values.filter(valid)
+        entity_ids = entity_ids.filter(valid) if entity_ids is not None else None
+    patientids = pc.cast(patientids, pa.int64()).to_numpy(zero_copy_only=False).tolist()
+    values = _strings(values)
+    entity_ids = _strings(entity_ids) if entity_ids is not None else [None] * len(values)
+    return patientids, values, entity_ids
+
+def _csv_updates(chunk, columns):
+    """
+        The patient ids, values and entity ids of the rows of a CSV chunk
+        that have a patient id and a value.
+    """
+    patientid_column, value_column, id_column = columns
+    ids_column = chunk.get(id_column, [None] * len(chunk))
+    patientids, values, entity_ids = [], [], []
+    for patientid, value, entity_id in zip(chunk.get(patientid_column, []),
+                                           chunk.get(value_column, []), ids_column):
+        # skip missing values
+        if pd.isna(patientid) or pd.isna(value):
+            continue
+        patientids.append(int(patientid))
+        values.append(str(value))
+        entity_ids.append(str(entity_id) if not pd.isna(entity_id) else None)
+    return patientids, values, entity_ids
+
+def iter_updates(fileobj, fmt, column_name, batch_rows=BATCH_ROWS):
+    """
+        It reads the uploaded file a batch at a time and yields, for each batch,
+        the lists of patient ids, reconciled values and entity ids (None when
+        the file has no <column>_id value) of the rows to update.
+    """
+    columns = ("patientid", column_name, f"{column_name}_id")
+    if fmt == "csv":
+        # the entity ids are read as text, so that a chunk with a missing id
+        # does not turn the others into floats
+        for chunk in pd.read_csv(fileobj, chunksize=batch_rows, dtype={columns[2]: str}):
+            yield _csv_updates(chunk, columns)
+    else:
+        for batch in _arrow_batches(fileobj, fmt, columns, batch_rows):
+            yield _arrow_updates(batch, columns)
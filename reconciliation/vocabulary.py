@@ -0,0 +1,63 @@
+"""
+    VOCABULARY
+    Reference vocabularies the queries are reconciled against,
+    and the table column written for each reconciliation type.
+"""
+from sqlalchemy import text
+from database.engine import get_async_engine
+from .metrics import stage
+
+# the queries are module constants, so SQLAlchemy compiles them once and
+# asyncpg reuses the same prepared statement on every connection
+VOCABULARY_QUERIES = {
+    "/ethnicity": text("SELECT ethnicityid, description FROM ethnicity"),
+    "/sexual-orientation": text("SELECT soid, soname FROM sexual_orientation"),
+}
+
+# table and column updated with the reconciled values of each type
+TYPE_TARGETS = {
+    "/ethnicity": ("patient", "ethnicity"),
+    "/sexual-orientation": ("patient", "sexual_orientation"),
+    "/icd11": ("registration", "reason_for_admission"),
+}
+
+
+def needed_vocabularies(payload):
+    """
+        It returns the vocabularies needed by the queries of a payload,
+        untyped queries are searched in all of them.
+    """
+    needed = set()
+    for q in payload.values():
+        type_param = q.get("type")
+        if not type_param:
+            return set(VOCABULARY_QUERIES)
+        if type_param in VOCABULARY_QUERIES:
+            needed.add(type_param)
+    return needed
+
+async def fetch_vocabularies(types):
+    """
+        It loads the rows of the given vocabularies with the async engine,
+        once for the whole request.
+    """
+    vocabularies = {}
+    async with get_async_engine().connect() as conn:
+        for type_param in sorted(types):
+            with stage("postgres", type_param):
+                result = await conn.execute(VOCABULARY_QUERIES[type_param])
+                vocabularies[type_param] = [tuple(row) for row in result.fetchall()]
+    return vocabularies
+
+def load_vocabularies(engine, types=None):
+    """
+        It loads the rows of the given vocabularies, or of all of them,
+        with a synchronous engine, for the command line jobs.
+    """
+    vocabularies = {}
+    with engine.connect() as conn:
+        for type_param in sorted(types or VOCABULARY_QUERIES):
+            if type_param in VOCABULARY_QUERIES:
+                rows = conn.execute(VOCABULARY_QUERIES[type_param]).fetchall()
+                vocabularies[type_param] = [tuple(row) for row in rows]
+    return vocabularies
@@ -16,6 +16,26 @@ SET xmloption = content;
 SET client_min_messages = warning;
 SET row_security = off;
 
+--
+-- Name: set_updated_at(); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.set_updated_at() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    -- the normalization job sets drreconcile.skip_tracking, so the values
+    -- it rewrites are not seen as new changes by the next incremental run
+    IF current_setting('drreconcile.skip_tracking', true) IS DISTINCT FROM 'on' THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+
+ALTER FUNCTION public.set_updated_at() OWNER TO postgres;
+
 SET default_tablespace = '';
 
 SET default_table_access_method = heap;
@@ -111,7 +131,8 @@ CREATE TABLE public.patient (
     dod date,
     age integer,
     ethnicity character varying(255),
-    sexual_orientation character varying(255)
+    sexual_orientation character varying(255),
+    updated_at timestamp with time zone DEFAULT now() NOT NULL
 );
 
 
@@ -150,7 +171,8 @@ CREATE TABLE public.registration (
     datedischarge date,
     patientid integer,
     orgid integer,
-    reason_for_admission character varying(255)
+    reason_for_admission character varying(255),
+    updated_at timestamp with time zone DEFAULT now() NOT NULL
 );
 
 
@@ -212,6 +234,80 @@ ALTER SEQUENCE public.sexual_orientation_soid_seq OWNER TO postgres;
 ALTER SEQUENCE public.sexual_orientation_soid_seq OWNED BY public.sexual_orientation.soid;
 
 
+--
+-- Name: reconciliation_alias; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.reconciliation_alias (
+    aliasid integer NOT NULL,
+    type character varying(50) NOT NULL,
+    raw_value character varying(255) NOT NULL,
+    entity_id character varying(255) NOT NULL,
+    entity_name character varying(255) NOT NULL,
+    confidence double precision NOT NULL,
+    source character varying(255),
+    confirmations integer DEFAULT 1 NOT NULL,
+    reviewed boolean DEFAULT false NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    updated_at timestamp with time zone DEFAULT now() NOT NULL,
+    retracted_at timestamp with time zone
+);
+
+
+ALTER TABLE public.reconciliation_alias OWNER TO postgres;
+
+--
+-- Name: reconciliation_alias_aliasid_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+CREATE SEQUENCE public.reconciliation_alias_aliasid_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER SEQUENCE public.reconciliation_alias_aliasid_seq OWNER TO postgres;
+
+--
+-- Name: reconciliation_alias_aliasid_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
+--
+
+ALTER SEQUENCE public.reconciliation_alias_aliasid_seq OWNED BY public.reconciliation_alias.aliasid;
+
+
+--
+-- Name: reconciliation_mapping; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.reconciliation_mapping (
+    target character varying(100) NOT NULL,
+    raw_value character varying(255) NOT NULL,
+    entity_id character varying(255),
+    entity_name character varying(255),
+    score double precision,
+    min_score double precision,
+    reconciled_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.reconciliation_mapping OWNER TO postgres;
+
+--
+-- Name: reconciliation_watermark; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.reconciliation_watermark (
+    target character varying(100) NOT NULL,
+    watermark timestamp with time zone NOT NULL,
+    recorded_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.reconciliation_watermark OWNER TO postgres;
+
 --
 -- Name: ethnicity ethnicityid; Type: DEFAULT; Schema: public; Owner: postgres
 --
@@ -240,6 +336,13 @@ ALTER TABLE ONLY public.patient ALTER COLUMN patientid SET DEFAULT nextval('publ
 ALTER TABLE ONLY public.registration ALTER COLUMN registrationid SET DEFAULT nextval('public.registration_registrationid_seq'::regclass);
 
 
+--
+-- Name: reconciliation_alias aliasid; Type: DEFAULT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.reconciliation_alias ALTER COLUMN aliasid SET DEFAULT nextval('public.reconciliation_alias_aliasid_seq'::regclass);
+
+
 --
 -- Name: sexual_orientation soid; Type: DEFAULT; Schema: public; Owner: postgres
 --
@@ -279,6 +382,38 @@ ALTER TABLE ONLY public.registration
     ADD CONSTRAINT registration_pkey PRIMARY KEY (registrationid);
 
 
+--
+-- Name: reconciliation_alias reconciliation_alias_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.reconciliation_alias
+    ADD CONSTRAINT reconciliation_alias_pkey PRIMARY KEY (aliasid);
+
+
+--
+-- Name: reconciliation_alias reconciliation_alias_type_raw_value_key; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.reconciliation_alias
+    ADD CONSTRAINT reconciliation_alias_type_raw_value_key UNIQUE (type, raw_value);
+
+
+--
+-- Name: reconciliation_mapping reconciliation_mapping_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.reconciliation_mapping
+    ADD CONSTRAINT reconciliation_mapping_pkey PRIMARY KEY (target, raw_value);
+
+
+--
+-- Name: reconciliation_watermark reconciliation_watermark_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.reconciliation_watermark
+    ADD CONSTRAINT reconciliation_watermark_pkey PRIMARY KEY (target);
+
+
 --
 -- Name: sexual_orientation sexual_orientation_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -287,6 +422,34 @@ ALTER TABLE ONLY public.sexual_orientation
     ADD CONSTRAINT sexual_orientation_pkey PRIMARY KEY (soid);
 
 
+--
+-- Name: patient_updated_at_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX patient_updated_at_idx ON public.patient USING btree (updated_at);
+
+
+--
+-- Name: registration_updated_at_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX registration_updated_at_idx ON public.registration USING btree (updated_at);
+
+
+--
+-- Name: patient patient_set_updated_at; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER patient_set_updated_at BEFORE UPDATE ON public.patient FOR EACH ROW EXECUTE FUNCTION public.set_updated_at();
+
+
+--
+-- Name: registration registration_set_updated_at; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER registration_set_updated_at BEFORE UPDATE ON public.registration FOR EACH ROW EXECUTE FUNCTION public.set_updated_at();
+
+
 --
 -- Name: registration registration_orgid_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -331,6 +494,34 @@ GRANT ALL ON TABLE public.patient TO myuser;
 GRANT ALL ON TABLE public.registration TO myuser;
 
 
+--
+-- Name: TABLE reconciliation_alias; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.reconciliation_alias TO myuser;
+
+
+--
+-- Name: SEQUENCE reconciliation_alias_aliasid_seq; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON SEQUENCE public.reconciliation_alias_aliasid_seq TO myuser;
+
+
+--
+-- Name: TABLE reconciliation_mapping; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.reconciliation_mapping TO myuser;
+
+
+--
+-- Name: TABLE reconciliation_watermark; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.reconciliation_watermark TO myuser;
+
+
 --
 -- Name: TABLE sexual_orientation; Type: ACL; Schema: public; Owner: postgres
 --
@@ -0,0 +1,160 @@
+"""
+    PRE-FORK SERVER
+    Multi-worker launcher sharing the model weights between the workers.
+    `uvicorn main:app --workers N` starts N fresh interpreters, each loading
+    SapBERT and all-mpnet-base-v2 again, so the memory grows with every worker.
+    Here the application, and with it the models, is imported once in the
+    parent process, the listening socket is opened there too, and the workers
+    are forked from it: the tensors of the weights are never written after
+    loading, so their pages stay shared copy-on-write by all the workers.
+    The objects alive at fork time are moved out of the garbage collector
+    (gc.freeze), so that collections in the workers do not write to their
+    pages and copy them.
+    The CPU budget is divided between the workers and each one limits the
+    torch intra-op threads to its share, instead of every worker starting one
+    thread per core. The parent restarts the workers that die and stops them
+    all on SIGINT or SIGTERM.
+
+    Usage:
+        python serve.py --workers 4 --cpu-budget 8 --host 0.0.0.0 --port 8000
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+import torch
+import uvicorn
+
+
+def threads_per_worker(cpu_budget, workers):
+    """
+        Intra-op threads of each worker, at least one.
+    """
+    return max(1, cpu_budget // workers)
+
+def bind_socket(host, port, backlog=2048):
+    """
+        It opens the listening socket shared by all the workers,
+        the kernel hands every new connection to one of them.
+    """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock, intra_threads, log_level):
+    """
+        Body of a forked worker: it serves the application on the shared socket.
+    """
+    torch.set_num_threads(intra_threads)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def spawn(app, sock, intra_threads, log_level):
+    """
+        It forks a worker and returns its pid.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_worker(app, sock, intra_threads, log_level)
+        except BaseException:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)  # pylint: disable=protected-access
+    return pid
+
+def load_application(intra_threads, inter_threads):
+    """
+        It imports the application in the parent, loading the models once.
+        The torch thread pools are sized here, before any inference and before
+        the fork, because the inter-op pool can only be sized once per process.
+        No inference runs in the parent, so the workers never inherit a
+        started OpenMP pool.
+    """
+    torch.set_num_threads(intra_threads)
+    torch.set_num_interop_threads(inter_threads)
+    from main import app  # pylint: disable=import-outside-toplevel
+    return app
+
+def main(argv=None):
+    """
+        Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Serve DrReconcile with pre-forked workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--cpu-budget", type=int, default=os.cpu_count() or 1,
+                        help="cores shared by all the workers, default all of them")
+    parser.add_argument("--interop-threads", type=int, default=1,
+                        help="torch inter-op threads of each worker")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    intra_threads = threads_per_worker(args.cpu_budget, args.workers)
+    # the metrics of all the workers are aggregated through this directory,
+    # it must be set before prometheus_client is imported
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    owns_metrics_dir = metrics_dir is None
+    if owns_metrics_dir:
+        metrics_dir = tempfile.mkdtemp(prefix="drreconcile-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+    app = load_application(intra_threads, args.interop_threads)
+    # imported after the variable is set, see above
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+    sock = bind_socket(args.host, args.port)
+    gc.collect()
+    gc.freeze()
+
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers, "
+          f"{intra_threads} torch threads each")
+    workers = {spawn(app, sock, intra_threads, args.log_level) for _ in range(args.workers)}
+
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        multiprocess.mark_process_dead(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting it", file=sys.stderr)
+            # do not spin when the workers die at startup
+            time.sleep(1)
+            workers.add(spawn(app, sock, intra_threads, args.log_level))
+
+    sock.close()
+    if owns_metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,18 @@
     CONFIGURATION
 """
 
+import asyncio
+import os
+import tempfile
 import pytest
 from fastapi.testclient import TestClient
 from fastapi import FastAPI
+
+# the mocked ICD-11 responses must not be cached with the real ones,
+# the directory is set before the configuration is imported
+os.environ["DRRECONCILE_ICD_CACHE_DIR"] = tempfile.mkdtemp(prefix="drreconcile-icd-test-")
+
+# pylint: disable=wrong-import-position
 from reconciliation.api import router
 
 @pytest.fixture(scope="module")
@@ -15,3 +24,45 @@ def client():
     app = FastAPI()
     app.include_router(router, prefix="/api")
     return TestClient(app)
+
+@pytest.fixture
+def post_in_chunks():
+    """
+        This function returns a helper posting a form body to an ASGI app in
+        several http.request messages, as a server receiving a large body
+        does, and returning the status and the body of the response.
+    """
+    async def post(app, path, body, chunks, spec_version="2.3"):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": spec_version},
+            "http_version": "1.1", "method": "POST", "scheme": "http",
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"content-type", b"application/x-www-form-urlencoded"),
+                        (b"content-length", str(len(body)).encode())],
+            "client": ("testclient", 50000), "server": ("testserver", 80),
+        }
+        size = -(-len(body) // chunks)
+        messages = [{"type": "http.request", "body": body[i:i + size],
+                     "more_body": i + size < len(body)}
+                    for i in range(0, len(body), size)]
+        finished = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if messages:
+                # the response is already being sent between two chunks
+                await asyncio.sleep(0.001)
+                return messages.pop(0)
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        finished.set()
+        status = next(m["status"] for m in sent if m["type"] == "http.response.start")
+        return status, b"".join(m.get("body", b"") for m in sent
+                                if m["type"] == "http.response.body")
+
+    return lambda *args, **kwargs: asyncio.run(post(*args, **kwargs))
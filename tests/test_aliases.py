@@ -0,0 +1,108 @@
+"""
+    ALIAS MEMORY TESTS
+"""
+import asyncio
+from reconciliation.aliases import (
+    MAX_VALUE_LENGTH,
+    REPOINT_CONDITION,
+    STAGE_ALIAS,
+    AliasMemory,
+    canonical_values,
+    learn_aliases
+)
+
+
+def test_alias_memory_lookup_and_retraction():
+    """
+        This test checks that a confirmed value is found whatever its case and
+        spacing, only for its own type, and that a retracted alias is forgotten.
+    """
+    memory = AliasMemory()
+    assert memory.is_stale()
+    memory.replace([("/ethnicity", "white brit", "/ethnicity/5001", "British", 1.0)])
+    assert not memory.is_stale()
+
+    match = memory.lookup("/ethnicity", "  White   BRIT ")
+    assert match["id"] == "/ethnicity/5001"
+    assert match["match"] is True
+    assert match["score"] == 100
+    assert match["stage"] == STAGE_ALIAS
+    assert memory.lookup("/sexual-orientation", "white brit") is None
+
+    memory.discard("/ethnicity", "White Brit")
+    assert memory.lookup("/ethnicity", "white brit") is None
+
+
+class RecordingConnection:
+    """
+        An async connection recording the statements, returning every
+        inserted alias as active when they are reviewed.
+    """
+
+    def __init__(self):
+        self.statement = None
+        self.params = None
+
+    async def execute(self, statement, params=None):
+        self.statement = str(statement)
+        self.params = params
+        return self
+
+    def fetchall(self):
+        return [
+            (self.params["type"], raw, entity_id, name, 1.0,
+             self.params["reviewed"], self.params["reviewed"])
+            for raw, entity_id, name in zip(self.params["raw_values"],
+                                            self.params["entity_ids"],
+                                            self.params["entity_names"])
+        ]
+
+
+def test_relabel_is_not_learned():
+    """
+        This test checks that correcting a row from one label to another does
+        not make the old label an alias of the new entity, while a misspelling
+        is learned, and only active once reviewed.
+    """
+    vocabulary = [(5001, "White - British"), (5002, "White - Irish")]
+    canonical = canonical_values(vocabulary, "/ethnicity")
+    pairs = [("White - British", "/ethnicity/5002", "White - Irish"),
+             ("white  IRSH", "/ethnicity/5002", "White - Irish")]
+
+    conn = RecordingConnection()
+    learned = asyncio.run(learn_aliases(conn, "/ethnicity", pairs, "upload:test.csv", canonical))
+    assert conn.params["raw_values"] == ["white irsh"]
+    assert [row[5] for row in learned] == [False]
+
+    # a value of the file is a label too, even for a type without vocabulary
+    conn = RecordingConnection()
+    pairs = [("Asthma", "http://id.who.int/icd/entity/2", "Acute asthma"),
+             ("Acute asthma", "http://id.who.int/icd/entity/2", "Acute asthma"),
+             ("Ashtma", "http://id.who.int/icd/entity/1", "Asthma")]
+    learned = asyncio.run(learn_aliases(conn, "/icd11", pairs, "upload:test.csv", reviewed=True))
+    assert conn.params["raw_values"] == ["ashtma"]
+    assert [row[5] for row in learned] == [True]
+
+
+def test_sexual_orientation_aliases_are_canonical():
+    """
+        This test checks that the aliases of the exact stage cannot be taken over.
+    """
+    canonical = canonical_values([(1, "Gay or Lesbian")], "/sexual-orientation")
+    assert {"gay or lesbian", "gay", "lesbian"} <= canonical
+
+
+def test_unreviewed_upload_cannot_repoint_a_reviewed_alias():
+    """
+        This test checks that the upsert of an upload without the admin token
+        only updates a reviewed alias that names the same entity, and that the
+        values too long for the table are not learned.
+    """
+    pairs = [("white irsh", "/ethnicity/5001", "White - British"),
+             ("x" * (MAX_VALUE_LENGTH + 1), "/ethnicity/5001", "White - British")]
+    conn = RecordingConnection()
+    asyncio.run(learn_aliases(conn, "/ethnicity", pairs, "upload:test.csv"))
+    assert conn.params["raw_values"] == ["white irsh"]
+    update = conn.statement.split("DO UPDATE")[1]
+    assert f"WHERE {REPOINT_CONDITION}" in update
+    assert "OR NOT reconciliation_alias.reviewed" in update
@@ -3,6 +3,9 @@
 """
 import json
 import io
+import time
+from urllib.parse import urlencode
+import requests
 from reconciliation.helper import query_icd11_api
 
 
@@ -150,3 +153,129 @@ def test_fetch_update_invalid_type_param(client):
 
     assert response.status_code == 500
     assert response.json()["detail"]
+
+def test_reconcile_cascade_exact_stage(mocker, client):
+    """
+        This test checks that an exact ICD-11 title is decided by the exact stage
+        of the scoring cascade, so the semantic models are never called.
+    """
+    mocker.patch('reconciliation.api.query_icd11_api', return_value=[
+        {"id": "1", "title": "Stroke"},
+        {"id": "2", "title": "Hypertension"},
+    ])
+    sap = mocker.patch('reconciliation.scoring.sap_encode_many')
+
+    payload = {
+        "query": "hypertension",
+        "limit": 5,
+        "type": "/icd11"
+    }
+    response = client.post("/api/reconcile", data={"queries": json.dumps({"test": payload})})
+    assert response.status_code == 200
+    results = response.json()["test"]["result"]
+
+    assert results[0]["id"] == "2"
+    assert results[0]["stage"] == "exact"
+    assert results[0]["match"] is True
+    sap.assert_not_called()
+
+def test_reconcile_stream(client):
+    """
+        This test checks that /reconcile/stream returns one NDJSON line
+        per query, with the same results as /reconcile.
+    """
+    queries = {f"q{i}": {"query": value, "limit": 3, "type": "/ethnicity"}
+               for i, value in enumerate(["Indian", "Chinese", "White British"])}
+    response = client.post("/api/reconcile/stream", data={"queries": json.dumps(queries)})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    expected = client.post("/api/reconcile", data={"queries": json.dumps(queries)}).json()
+    assert {line["key"] for line in lines} == set(queries)
+    for line in lines:
+        assert line["result"] == expected[line["key"]]["result"]
+
+    response = client.post("/api/reconcile/stream", data={"other": "1"})
+    assert response.status_code == 400
+
+def test_reconcile_stream_chunked_body(client, post_in_chunks):
+    """
+        This test checks that a large body received in many chunks gives one
+        line per query when the server speaks ASGI 2.3, whose disconnect
+        listener must not take the chunks of the body.
+    """
+    queries = {f"q{i}": {"query": "Indian", "limit": 1, "type": "/ethnicity"}
+               for i in range(200)}
+    body = urlencode({"queries": json.dumps(queries)}).encode()
+    status, text = post_in_chunks(client.app, "/api/reconcile/stream", body, 25, "2.3")
+    assert status == 200
+    lines = [json.loads(line) for line in text.decode().splitlines()]
+    assert "error" not in lines[-1]
+    assert sorted(line["key"] for line in lines) == sorted(queries)
+
+def test_reconcile_stream_budget_spent(client):
+    """
+        This test checks that the queries of a stream share the request budget.
+    """
+    queries = {"q0": {"query": "Indian", "type": "/ethnicity"}}
+    response = client.post("/api/reconcile/stream", data={"queries": json.dumps(queries)},
+                           headers={"X-Request-Budget-Ms": "0.001"})
+    assert response.status_code == 200
+    assert json.loads(response.text) == {"key": "q0", "result": [], "degradation": "unscored"}
+
+def test_reconcile_budget_spent(client):
+    """
+        This test checks that a batch which runs out of time is still answered,
+        with every key flagged instead of a 500 error.
+    """
+    queries = {"q0": {"query": "Indian", "type": "/ethnicity"},
+               "q1": {"query": "Bisexual", "type": "/sexual-orientation"}}
+    response = client.post("/api/reconcile", data={"queries": json.dumps(queries)},
+                           headers={"X-Request-Budget-Ms": "0.001"})
+    assert response.status_code == 200
+    for key in queries:
+        assert response.json()[key] == {"result": [], "degradation": "unscored"}
+
+def test_reconcile_compact(client):
+    """
+        This test checks that compact=1 only returns the fields of the
+        reconciliation API for every candidate, and that a large batch is
+        compressed when the client accepts it.
+    """
+    queries = {f"q{i}": {"query": "Indian", "type": "/ethnicity"} for i in range(20)}
+    response = client.post("/api/reconcile?compact=1", data={"queries": json.dumps(queries)},
+                           headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    for candidate in response.json()["q0"]["result"]:
+        assert set(candidate) == {"id", "name", "score", "match"}
+
+def test_reconcile_icd11_call_cut_by_budget(mocker, monkeypatch, client):
+    """
+        This test checks that a slow ICD-11 search is given no more than the
+        time left to the request, and that the query is then answered as
+        partial instead of overrunning the budget.
+    """
+    monkeypatch.setattr("reconciliation.api.ICD_RESERVE_S", 0.1)
+    mocker.patch("reconciliation.api.get_token", return_value="token")
+    timeouts = []
+
+    def slow_search(search_term, access_token, limit, timeout):
+        timeouts.append(timeout)
+        time.sleep(timeout)
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    mocker.patch("reconciliation.api.query_icd11_api", side_effect=slow_search)
+    queries = {"q0": {"query": "Slow budget diagnosis", "type": "/icd11"}}
+    start = time.perf_counter()
+    response = client.post("/api/reconcile", data={"queries": json.dumps(queries)},
+                           headers={"X-Request-Budget-Ms": "500"})
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    assert response.json()["q0"] == {"result": [], "degradation": "partial",
+                                     "skipped": ["icd11"]}
+    assert len(timeouts) == 1 and timeouts[0] <= 0.5
+    assert elapsed < 2
@@ -0,0 +1,60 @@
+"""
+    VOCABULARY ARTIFACT TESTS
+"""
+import numpy as np
+from reconciliation import artifact
+from reconciliation.artifact import build_section, fingerprint, load, save
+
+ROWS = [(1, "Heterosexual or Straight"), (2, "Gay or Lesbian"), (3, "Bisexual")]
+
+
+def fake_encoder(texts):
+    """
+        Deterministic stand-in for the models: one small vector per text.
+    """
+    return [np.array([len(t), t.count("a"), 1.0], dtype=np.float32) for t in texts]
+
+
+def test_artifact_round_trip(tmp_path):
+    """
+        This test checks that a saved artifact is memory-mapped back with the
+        same arrays, and that the hash table finds the rows of every alias.
+    """
+    section = build_section("/sexual-orientation", ROWS, (fake_encoder, fake_encoder))
+    path = str(tmp_path / "vocabulary.drvocab")
+    save([section], path)
+
+    header, sections = load(path)
+    loaded = sections["/sexual-orientation"]
+    assert header["sections"]["/sexual-orientation"]["rows"] == 3
+    assert loaded.fingerprint == fingerprint("/sexual-orientation", ROWS)
+    assert isinstance(loaded.sbert.base, np.memmap)
+    for name, array in section.arrays.items():
+        assert np.array_equal(loaded.arrays[name], array)
+
+    assert loaded.exact("straight") == [0]
+    assert loaded.exact("gay or lesbian") == [1]
+    assert loaded.exact("lesbian") == [1]
+    assert loaded.exact("pansexual") == []
+    assert [len(group) for group in loaded.alias_groups()] == [2, 2, 1]
+
+
+def test_stale_artifact_is_rebuilt(tmp_path, monkeypatch):
+    """
+        This test checks that a section whose fingerprint does not match the
+        rows is not used, and that the rows are compiled instead.
+    """
+    path = str(tmp_path / "vocabulary.drvocab")
+    save([build_section("/sexual-orientation", ROWS, (fake_encoder, fake_encoder))], path)
+    monkeypatch.setattr(artifact, "_artifact", {"loaded": False, "sections": {}})
+    monkeypatch.setattr(artifact, "_built", {})
+    monkeypatch.setattr(artifact, "encode_many", fake_encoder)
+    monkeypatch.setattr(artifact, "sap_encode_many", fake_encoder)
+    artifact.load_artifact(path)
+
+    assert artifact.compiled_section("/sexual-orientation", ROWS).fingerprint == \
+        fingerprint("/sexual-orientation", ROWS)
+    changed = ROWS + [(4, "Pansexual")]
+    section = artifact.compiled_section("/sexual-orientation", changed)
+    assert section.exact("pansexual") == [3]
+    assert artifact.compiled_section("/sexual-orientation", changed) is section
@@ -0,0 +1,56 @@
+"""
+    BULK RECONCILIATION TESTS
+"""
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from reconciliation.batch import distinct_values, write_output
+
+
+def test_batch_reconciles_distinct_values_once(tmp_path):
+    """
+        This test checks that the column is reduced to its distinct values and
+        that every row is written back, chunk by chunk, with the match of its value.
+    """
+    source = tmp_path / "patients.csv"
+    output = tmp_path / "reconciled.csv"
+    pd.DataFrame({
+        "patientid": [1, 2, 3, 4, 5],
+        "ethnicity": ["Asian", " Asian", "", "Irish", "Asian"],
+    }).to_csv(source, index=False)
+
+    values, rows = distinct_values(str(source), "csv", "ethnicity", chunk_size=2)
+    assert rows == 5
+    assert values == {"Asian", "Irish"}
+
+    matches = {"Asian": (5001, "Asian or Asian British", 100.0), "Irish": (None, None, None)}
+    write_output(str(source), "csv", str(output), "csv", "ethnicity", matches, chunk_size=2)
+    result = pd.read_csv(output)
+
+    assert result["patientid"].tolist() == [1, 2, 3, 4, 5]
+    assert result["ethnicity_match_id"].tolist()[:2] == [5001, 5001]
+    assert result["ethnicity_match_id"].isna().tolist() == [False, False, True, True, False]
+
+
+def test_parquet_output_first_chunk_without_matches(tmp_path):
+    """
+        This test checks that a CSV whose first chunk has no matches and an
+        empty column is still written to Parquet, with the types of the matches.
+    """
+    source = tmp_path / "patients.csv"
+    output = tmp_path / "reconciled.parquet"
+    pd.DataFrame({
+        "patientid": [1, 2, 3, 4],
+        "ethnicity": ["", "Unknown", "Asian", "Irish"],
+        "notes": ["", "", "seen", ""],
+    }).to_csv(source, index=False)
+
+    matches = {"Unknown": (None, None, None), "Asian": ("/ethnicity/5001", "Asian", 100.0),
+               "Irish": (None, None, None)}
+    write_output(str(source), "csv", str(output), "parquet", "ethnicity", matches, chunk_size=2)
+    table = pq.read_table(output)
+
+    assert table.schema.field("ethnicity_match_id").type == pa.string()
+    assert table.schema.field("ethnicity_match_score").type == pa.float64()
+    assert table.column("ethnicity_match_id").to_pylist() == [None, None, "/ethnicity/5001", None]
+    assert table.column("notes").to_pylist() == [None, None, "seen", None]
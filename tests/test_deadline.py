@@ -0,0 +1,68 @@
+"""
+    DEADLINE BUDGET TESTS
+"""
+import contextvars
+import time
+import pytest
+from reconciliation.deadline import (
+    DeadlineExceeded,
+    allows,
+    begin_query,
+    degradation,
+    expired,
+    start_deadline,
+    time_left
+)
+
+
+def run_in_context(fn):
+    """
+        It runs fn in a copy of the context, as a request does.
+    """
+    return contextvars.copy_context().run(fn)
+
+
+def test_optional_stages_are_skipped_near_the_deadline():
+    """
+        This test checks that a stage needing more than the time left is
+        skipped and reported, and that nothing is skipped without a budget.
+    """
+    def nearly_spent():
+        start_deadline(0.5)
+        begin_query()
+        assert allows("icd11", 0.1)
+        assert not allows("semantic", 1.0)
+        return degradation(), expired()
+
+    assert run_in_context(nearly_spent) == (
+        {"degradation": "partial", "skipped": ["semantic"]}, False)
+
+    def no_budget():
+        start_deadline(0)
+        begin_query()
+        return allows("semantic", 1000.0), degradation()
+
+    assert run_in_context(no_budget) == (True, {"degradation": "none"})
+
+
+def test_calls_get_the_time_left():
+    """
+        This test checks that a call is given the time left to the request
+        when it is shorter than its own timeout, and is not made once the
+        deadline has passed.
+    """
+    def nearly_spent():
+        start_deadline(0.5)
+        return time_left(10.0), time_left(0.1), time_left(None)
+
+    left, short, unbounded = run_in_context(nearly_spent)
+    assert 0.4 < left <= 0.5 and short == 0.1 and 0.4 < unbounded <= 0.5
+
+    def spent():
+        start_deadline(0.001)
+        time.sleep(0.002)
+        with pytest.raises(DeadlineExceeded):
+            time_left(10.0)
+
+    run_in_context(spent)
+    assert run_in_context(lambda: (start_deadline(0), time_left(10.0))[1]) == 10.0
@@ -0,0 +1,60 @@
+"""
+    HIERARCHICAL MATCHING TESTS
+"""
+from database.generate_patient import ethnicity_values
+from database.ethnicity import ETHNICITY_DESCRIPTIONS
+from reconciliation.helper import partial_ratio
+from reconciliation.hierarchy import HierarchicalMatcher
+
+ROWS = [(5000 + i, description) for i, (_, description) in enumerate(ETHNICITY_DESCRIPTIONS)]
+CHAPTERS = ["Infections", "Neoplasms", "Circulatory diseases", "Injuries"]
+BLOCKS = ["Acute", "Chronic", "Congenital", "Unspecified"]
+TERMS = ["fever", "ulcer", "lesion", "fracture", "stenosis", "cyst"]
+TREE = [(i + 1, f"{chapter} - {block} {term} - {block.lower()} {term} of {site}")
+        for i, (chapter, block, term, site) in enumerate(
+            (c, b, t, s) for c in CHAPTERS for b in BLOCKS for t in TERMS
+            for s in ("arm", "leg", "head"))]
+
+
+def flat(query, rows, limit):
+    """
+        The ids of the limit best rows of the exhaustive scoring.
+    """
+    scored = sorted(((-partial_ratio(query, label), i, entity_id)
+                     for i, (entity_id, label) in enumerate(rows)))
+    return [entity_id for _, _, entity_id in scored[:limit]]
+
+
+def test_tree_of_the_labels():
+    """
+        This test checks that the labels are split into headings and leaves.
+    """
+    matcher = HierarchicalMatcher(ROWS)
+    assert matcher.root.size() == len(ROWS)
+    asian = matcher.root.groups["Asian or Asian British"]
+    assert asian.heading == "Asian or Asian British"
+    assert "Asian or Asian British - Indian" in [label for _, _, label in asian.leaves]
+
+
+def test_ethnicity_matches_exhaustive_scoring():
+    """
+        This test checks that the routed search finds the best label of the
+        exhaustive scoring for the ethnicity values of the generator.
+    """
+    matcher = HierarchicalMatcher(ROWS)
+    for value in ethnicity_values:
+        leaves, _ = matcher.match(value, 5)
+        assert leaves[0][0] == flat(value, ROWS, 1)[0], value
+
+
+def test_tree_scores_fewer_labels():
+    """
+        This test checks that on a three-level vocabulary a query only scores
+        the leaves of its groups, and still finds its label.
+    """
+    matcher = HierarchicalMatcher(TREE)
+    entity_id, label = TREE[100]
+    leaves, comparisons = matcher.match(label.lower(), 5)
+    assert leaves[0][0] == entity_id
+    assert leaves[0][2] == partial_ratio(label.lower(), label)
+    assert comparisons < len(TREE) / 2
@@ -0,0 +1,73 @@
+"""
+    ICD-11 SEARCH CACHE TESTS
+"""
+import threading
+import time
+import pytest
+from reconciliation.icd_cache import CircuitBreaker, IcdSearchCache, IcdUnavailable
+
+RESULTS = [{"id": "1", "title": "Hypertension"}, {"id": "2", "title": "Hypertensive heart disease"}]
+
+
+def test_cache_coalesces_and_serves_stale(tmp_path):
+    """
+        This test checks that concurrent lookups of the same term make a single
+        request, that the cached response is served, and that a stale response
+        is returned immediately while it is refreshed in the background.
+    """
+    calls = []
+    release = threading.Event()
+
+    def slow_fetch(term):
+        calls.append(term)
+        release.wait(5)
+        return RESULTS
+
+    cache = IcdSearchCache(str(tmp_path), ttl_s=60, stale_s=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.search("Hypertension", 1, slow_fetch))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["hypertension"]
+    assert results == [RESULTS[:1]] * 4
+    assert cache.search(" HYPERTENSION ", 5, slow_fetch) == RESULTS
+    assert len(calls) == 1
+
+    stale = IcdSearchCache(str(tmp_path), ttl_s=0, stale_s=60)
+    assert stale.search("hypertension", 5, lambda term: []) == RESULTS
+    for _ in range(50):
+        if stale.read("hypertension")["results"] == []:
+            break
+        time.sleep(0.01)
+    assert stale.read("hypertension")["results"] == []
+
+def test_circuit_breaker_degrades_to_cache(tmp_path):
+    """
+        This test checks that after repeated failures the API is no longer called,
+        cached terms are still served, and uncached terms are reported unavailable.
+    """
+    calls = []
+
+    def failing_fetch(term):
+        calls.append(term)
+        raise ValueError("ICD-11 API error 503")
+
+    cache = IcdSearchCache(str(tmp_path), ttl_s=0, stale_s=0,
+                           breaker=CircuitBreaker(max_failures=2, reset_s=60))
+    cache.write("stroke", RESULTS)
+
+    for _ in range(2):
+        with pytest.raises(IcdUnavailable):
+            cache.search("diabetes", 5, failing_fetch)
+    assert cache.breaker.state == "open"
+
+    with pytest.raises(IcdUnavailable):
+        cache.search("diabetes", 5, failing_fetch)
+    assert cache.search("stroke", 5, failing_fetch) == RESULTS
+    assert calls == ["diabetes", "diabetes"]
@@ -0,0 +1,48 @@
+"""
+    LOAD TEST HARNESS TESTS
+"""
+import random
+from fastapi.testclient import TestClient
+from loadtest.fake_who import create_app
+from loadtest.generator import make_batch, parse_mix, summarise
+
+
+def test_fake_who_search_and_errors():
+    """
+        This test checks that the fake WHO API issues tokens, returns highlighted
+        admission reasons for a search, and fails at the configured rate.
+    """
+    client = TestClient(create_app(latency_ms=0))
+    assert client.post("/connect/token", data={"grant_type": "client_credentials"}).json()[
+        "access_token"]
+    entities = client.get("/icd/entity/search", params={"q": "chest pain"}).json()[
+        "destinationEntities"]
+    assert entities
+    assert "<em class='found'>" in entities[0]["title"]
+
+    failing = TestClient(create_app(latency_ms=0, error_rate=1.0))
+    assert failing.get("/icd/entity/search", params={"q": "chest pain"}).status_code == 503
+
+def test_generator_batches_and_report():
+    """
+        This test checks the OpenRefine-shaped batches and the percentiles
+        and error rates of the report.
+    """
+    assert parse_mix("ethnicity=0.5,/icd11=0.5") == {"/ethnicity": 0.5, "/icd11": 0.5}
+    batch = make_batch(random.Random(0), "/icd11", 3)
+    assert list(batch) == ["q0", "q1", "q2"]
+    assert all(q["type"] == "/icd11" for q in batch.values())
+    assert all("type" not in q for q in make_batch(random.Random(0), "/icd11", 3, 1.0).values())
+
+    samples = [{"latency": i / 1000, "ok": True, "empty": False, "dropped": False, "queries": 10}
+               for i in range(1, 101)]
+    samples.append({"latency": 0.0, "ok": False, "empty": False, "dropped": False, "queries": 10})
+    samples.append({"latency": 0.0, "ok": False, "empty": False, "dropped": True, "queries": 10})
+    report = summarise(samples, elapsed=10.0)
+
+    assert report["p50_ms"] == 50.0
+    assert report["p95_ms"] == 95.0
+    assert report["p99_ms"] == 99.0
+    assert report["errors"] == 1
+    assert report["dropped"] == 1
+    assert report["queries_per_second"] == 100.0
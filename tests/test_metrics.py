@@ -0,0 +1,33 @@
+"""
+    STAGE METRICS TESTS
+"""
+import json
+from prometheus_client import REGISTRY
+
+
+def stage_count(stage_name, type_param):
+    """
+        The number of samples of the stage in the drreconcile_stage_seconds histogram.
+    """
+    return REGISTRY.get_sample_value("drreconcile_stage_seconds_count",
+                                     {"stage": stage_name, "type": type_param}) or 0
+
+
+def test_reconcile_server_timing(client):
+    """
+        This test checks that a reconcile request reports the stages that ran
+        in its Server-Timing header, and observes them in the histogram.
+    """
+    before = stage_count("lexical", "/ethnicity")
+    queries = {"q0": {"query": "Indian", "type": "/ethnicity"}}
+    response = client.post("/api/reconcile", data={"queries": json.dumps(queries)})
+    assert response.status_code == 200
+
+    entries = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+    assert {"postgres", "lexical", "total"} <= set(entries)
+    # stages that did not run are not listed
+    assert "sapbert" not in entries and "icd_search" not in entries
+    assert entries[-1] == "total"
+    for entry in response.headers["Server-Timing"].split(", "):
+        assert float(entry.split("dur=")[1]) >= 0
+    assert stage_count("lexical", "/ethnicity") == before + 1
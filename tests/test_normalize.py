@@ -0,0 +1,118 @@
+"""
+    NORMALIZATION TESTS
+"""
+import os
+import pytest
+from reconciliation import normalize
+from reconciliation.normalize import (
+    APPLY_CONDITION,
+    apply_mappings,
+    applied_values,
+    parse_value_thresholds,
+    target_of,
+    window_clause
+)
+
+
+def test_value_thresholds_and_targets():
+    """
+        This test checks that the per-value thresholds are parsed at the last "="
+        and that only the reconciled columns can be normalized.
+    """
+    assert parse_value_thresholds(["Other=99", "a=b=80.5"]) == {"Other": 99.0, "a=b": 80.5}
+    assert target_of("/icd11") == ("registration", "reason_for_admission",
+                                   "registration.reason_for_admission")
+    with pytest.raises(ValueError):
+        parse_value_thresholds(["Other"])
+    with pytest.raises(ValueError):
+        target_of("/hospital")
+
+def test_incremental_window_clause():
+    """
+        This test checks that a full run has no condition on updated_at and that
+        the first incremental run, without a watermark, has no lower bound.
+    """
+    assert window_clause(None) == ""
+    assert window_clause((None, "now")) == " AND t.updated_at <= :until"
+    assert window_clause(("then", "now")).endswith("AND t.updated_at > :since")
+
+class RecordingConnection:
+    """
+        A connection recording the statements, returning the given rows.
+    """
+
+    def __init__(self, rows=()):
+        self.statements = []
+        self.rows = list(rows)
+        self.rowcount = 0
+
+    def execute(self, statement, params=None):
+        self.statements.append((str(statement), params))
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def begin(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class RecordingEngine:
+    """
+        An engine whose connections are the given one.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def connect(self):
+        return self.conn
+
+    def dispose(self):
+        pass
+
+def test_report_uses_the_update_condition():
+    """
+        This test checks that the applied flag of the report is read with the
+        condition of the UPDATE, so it honours the min_score of the mapping table.
+    """
+    conn = RecordingConnection(rows=[("Asian",)])
+    assert applied_values(conn, "patient.ethnicity", 90, {"Asian": None, "Other": None}) == {"Asian"}
+    sql, params = conn.statements[0]
+    assert APPLY_CONDITION in sql
+    assert params["values"] == ["Asian", "Other"] and params["threshold"] == 90
+
+    apply_mappings(conn, "patient", "ethnicity", "patient.ethnicity", 90)
+    assert APPLY_CONDITION in conn.statements[-1][0]
+    assert applied_values(RecordingConnection(), "patient.ethnicity", 90, {}) == set()
+
+def test_run_without_workers(monkeypatch):
+    """
+        This test checks that a run without --workers reconciles the pending
+        values with one worker per core, as the bulk reconciliation does.
+    """
+    calls = []
+    def reconcile_values(values, vocabularies, type_param, workers):
+        calls.append(workers)
+        return {value: ("1", "Asian or Asian British - Indian", 97.0) for value in values}
+    conn = RecordingConnection(rows=[("Indian",)])
+    monkeypatch.setattr(normalize, "get_engine", lambda: RecordingEngine(conn))
+    monkeypatch.setattr(normalize, "pending_values", lambda *args: {"Indian": 3})
+    monkeypatch.setattr(normalize, "load_vocabularies", lambda *args: {})
+    monkeypatch.setattr(normalize, "load_aliases", lambda *args: None)
+    monkeypatch.setattr(normalize, "reconcile_values", reconcile_values)
+
+    report = normalize.run("/ethnicity", dry_run=True)
+    assert calls == [os.cpu_count() or 1]
+    assert report["values"][0]["applied"] and report["rows"] == 3
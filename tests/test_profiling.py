@@ -0,0 +1,102 @@
+"""
+    PROFILING TESTS
+"""
+import os
+import time
+from reconciliation import profiling
+from reconciliation.profiling import ProfileCapture, profile_headers, run_profiled
+
+TOKEN = "secret-admin-token"
+
+
+def busy(seconds):
+    """
+        Work for the sampler to see.
+    """
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+def test_is_admin(monkeypatch):
+    """
+        This test checks that only the configured token is accepted,
+        and that admin access is off when no token is configured.
+    """
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", TOKEN)
+    assert profiling.is_admin(TOKEN)
+    assert not profiling.is_admin("wrong-token")
+    assert not profiling.is_admin(None)
+    assert not profiling.is_admin("")
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "")
+    assert not profiling.is_admin("")
+    assert not profiling.is_admin(TOKEN)
+
+
+def test_profile_path(monkeypatch, tmp_path):
+    """
+        This test checks that only existing profiles with a valid id are
+        served, so that the id cannot name another file.
+    """
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    profile_id = "0123456789abcdef0123456789abcdef"
+    (tmp_path / f"{profile_id}.collapsed").write_text("main 1\n")
+    assert profiling.profile_path(profile_id) == os.path.join(str(tmp_path),
+                                                              f"{profile_id}.collapsed")
+    assert profiling.profile_path("fedcba9876543210fedcba9876543210") is None
+    for invalid in ("../../etc/passwd", f"{profile_id}.collapsed", profile_id.upper(),
+                    profile_id[:-1], f"{profile_id}\n"):
+        assert profiling.profile_path(invalid) is None, invalid
+
+
+def test_run_profiled(monkeypatch, tmp_path):
+    """
+        This test checks that a profiled call returns its result, writes its
+        stacks and metadata, and releases the capture slot.
+    """
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_INTERVAL_MS", 1.0)
+    capture = ProfileCapture("test")
+    capture.interval = 0.001
+    assert run_profiled(capture, busy, 0.05) > 0
+    assert capture.active
+    assert profile_headers(capture) == {"X-Profile-Id": capture.profile_id}
+
+    collapsed = (tmp_path / f"{capture.profile_id}.collapsed").read_text()
+    assert "busy (" in collapsed
+    [profile] = profiling.list_profiles()
+    assert profile["id"] == capture.profile_id and profile["samples"] > 0
+
+    # the slot is free for the next capture
+    assert profiling._capture_slot.acquire(blocking=False)  # pylint: disable=protected-access
+    profiling._capture_slot.release()  # pylint: disable=protected-access
+
+
+def test_slot_released_on_error_and_when_busy(monkeypatch, tmp_path):
+    """
+        This test checks that a failing call releases the slot, that a capture
+        never entered does not hold it, and that a call made while another
+        capture runs is not profiled.
+    """
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    def fail():
+        raise ValueError("failed")
+
+    try:
+        run_profiled(ProfileCapture("error"), fail)
+    except ValueError:
+        pass
+    # a request cancelled before its work started
+    ProfileCapture("cancelled")
+
+    with ProfileCapture("outer") as outer:
+        inner = ProfileCapture("inner")
+        assert run_profiled(inner, busy, 0.001) > 0
+        assert not inner.active
+        assert profile_headers(inner) == {}
+    assert outer.active
+    assert profiling._capture_slot.acquire(blocking=False)  # pylint: disable=protected-access
+    profiling._capture_slot.release()  # pylint: disable=protected-access
@@ -0,0 +1,64 @@
+"""
+    INFERENCE SCHEDULER TESTS
+"""
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import REGISTRY
+from reconciliation.metrics import register_scheduler
+from reconciliation.scheduler import InferenceScheduler
+
+
+def test_scheduler_batches_concurrent_callers():
+    """
+        This test submits texts from several threads at the same time and checks
+        that every caller gets its own result and that the texts were grouped
+        into batches no larger than the configured maximum.
+    """
+    scheduler = InferenceScheduler("test", lambda texts: [len(t) for t in texts],
+                                   max_batch_size=4, max_wait_ms=50)
+    texts = [f"text {i}" * (i + 1) for i in range(10)]
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(lambda t: scheduler.submit(t).result(), texts))
+
+    assert results == [len(t) for t in texts]
+    stats = scheduler.stats()
+    assert stats["items"] == 10
+    assert stats["largest_batch_size"] <= 4
+    assert stats["batches"] < 10
+
+def test_scheduler_propagates_errors():
+    """
+        This test checks that a failing forward pass is reported
+        to the caller instead of leaving its future unresolved.
+    """
+    def failing(_):
+        raise RuntimeError("model failed")
+
+    scheduler = InferenceScheduler("failing", failing, max_batch_size=2, max_wait_ms=1)
+    future = scheduler.submit("Bisexual")
+    try:
+        future.result(timeout=5)
+        assert False, "Expected the model error to be raised"
+    except RuntimeError as e:
+        assert str(e) == "model failed"
+
+def test_scheduler_reports_queue_depth():
+    """
+        This test checks that the queue depth gauge goes up with every text
+        queued and back to zero once the batches have been taken.
+    """
+    scheduler = InferenceScheduler("depth-test", lambda texts: [len(t) for t in texts],
+                                   max_batch_size=4, max_wait_ms=20)
+    register_scheduler(scheduler)
+    depths = []
+    gauge_inc = scheduler.on_queue
+
+    def on_queue(delta):
+        gauge_inc(delta)
+        depths.append(delta)
+
+    scheduler.on_queue = on_queue
+    assert scheduler.map(["a", "bb", "ccc", "dddd", "eeeee"]) == [1, 2, 3, 4, 5]
+    assert depths.count(1) == 5 and sum(depths) == 0
+    assert REGISTRY.get_sample_value("drreconcile_inference_queue_depth",
+                                     {"model": "depth-test"}) == 0
@@ -0,0 +1,34 @@
+"""
+    SCORING CASCADE TESTS
+"""
+from reconciliation import scoring
+from reconciliation.scoring import (
+    STAGE_EXACT,
+    score_sexual_orientation,
+    so_aliases
+)
+
+ROWS = [(1, "Straight or Heterosexual"), (2, "Gay or Lesbian"), (3, "Bisexual"),
+        (4, "All other sexual orientations")]
+
+
+def test_labels_are_split_on_the_word_or():
+    """
+        This test checks that a label is only split on the word "or",
+        not inside the words that contain it.
+    """
+    assert so_aliases("Gay or Lesbian") == ["gay", "lesbian"]
+    assert so_aliases("All other sexual orientations") == ["all other sexual orientations"]
+    assert so_aliases("Straight (or Heterosexual)") == ["straight", "heterosexual"]
+
+
+def test_fragment_of_a_word_is_not_an_exact_match(monkeypatch):
+    """
+        This test checks that only a whole alias is an exact match.
+    """
+    # the semantic stage is not needed to tell the stage apart
+    monkeypatch.setattr(scoring, "allows", lambda *args: False)
+    matches = score_sexual_orientation("Lesbian", ROWS)
+    assert [(m["id"], m["stage"]) for m in matches] == [("/sexual-orientation/2", STAGE_EXACT)]
+    matches = score_sexual_orientation("ientations", ROWS)
+    assert all(m["stage"] != STAGE_EXACT for m in matches)
@@ -0,0 +1,105 @@
+"""
+    RESPONSE SERIALIZATION TESTS
+"""
+import gzip
+import json
+import brotli
+import numpy as np
+import pytest
+from starlette.requests import Request
+from reconciliation.serialization import (
+    compact_line,
+    compact_results,
+    dumps,
+    encode_response,
+    negotiate_encoding
+)
+
+CANDIDATE = {
+    "id": "/sexual-orientation/2",
+    "name": "Bisexual",
+    "semantic_score": np.float32(93.5),
+    "lexical_score": 80,
+    "score": np.float32(93.5),
+    "match": np.bool_(True),
+    "stage": "semantic",
+    "type": [{"id": "/sexual-orientation", "name": "Sexual Orientation"}]
+}
+RESPONSE = {f"q{i}": {"result": [CANDIDATE] * 3, "degradation": "none"} for i in range(20)}
+
+
+def request(query_string=b"", accept_encoding=None):
+    """
+        A request to /api/reconcile with the query string and Accept-Encoding.
+    """
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []
+    return Request({"type": "http", "method": "POST", "path": "/api/reconcile",
+                    "query_string": query_string, "headers": headers})
+
+
+def test_numpy_scalars():
+    """
+        This test checks that the NumPy scores the standard encoder
+        rejects are written as JSON numbers and booleans.
+    """
+    with pytest.raises(TypeError):
+        json.dumps(CANDIDATE)
+    decoded = json.loads(dumps(CANDIDATE))
+    assert decoded["score"] == 93.5
+    assert decoded["match"] is True
+    assert json.loads(dumps({"n": np.int64(3), "v": np.arange(2)})) == {"n": 3, "v": [0, 1]}
+
+
+def test_compact_results():
+    """
+        This test checks that compact candidates keep only the fields of the
+        reconciliation API, and the keys their other fields.
+    """
+    compact = compact_results(RESPONSE)
+    assert compact["q0"]["degradation"] == "none"
+    assert compact["q0"]["result"][0] == {"id": "/sexual-orientation/2", "name": "Bisexual",
+                                          "score": CANDIDATE["score"], "match": CANDIDATE["match"]}
+    assert len(dumps(compact)) < len(dumps(RESPONSE)) / 2
+
+    # a query key named "result" is a key like the others
+    batch = {"result": RESPONSE["q0"], "q1": RESPONSE["q1"]}
+    assert compact_results(batch) == {"result": compact["q0"], "q1": compact["q1"]}
+    assert compact_line({"key": "q0", **RESPONSE["q0"]})["result"] == compact["q0"]["result"]
+    assert compact_line({"error": "Malformed JSON in request payload."}) == {
+        "error": "Malformed JSON in request payload."}
+
+
+def test_negotiate_encoding():
+    """
+        This test checks the content coding chosen for Accept-Encoding headers.
+    """
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip, deflate, br") == "br"
+    assert negotiate_encoding("br;q=0.5, gzip") == "gzip"
+    assert negotiate_encoding("br;q=0, gzip;q=0") is None
+    assert negotiate_encoding("*") == "br"
+
+
+def test_encode_response():
+    """
+        This test checks that large bodies are compressed as negotiated,
+        and that small ones are sent as they are.
+    """
+    response = encode_response(RESPONSE, request(accept_encoding="br"))
+    assert response.headers["content-encoding"] == "br"
+    assert json.loads(brotli.decompress(response.body)) == json.loads(dumps(RESPONSE))
+
+    response = encode_response(RESPONSE, request(b"compact=1", "gzip"))
+    assert response.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.body)) == json.loads(dumps(compact_results(RESPONSE)))
+
+    response = encode_response(RESPONSE, request(b"compact=0", "identity"))
+    assert "content-encoding" not in response.headers
+    assert json.loads(response.body) == json.loads(dumps(RESPONSE))
+
+    response = encode_response({"q0": {"result": []}}, request(accept_encoding="gzip"))
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert json.loads(response.body) == {"q0": {"result": []}}
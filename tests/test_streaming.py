@@ -0,0 +1,86 @@
+"""
+    STREAMING QUERIES TESTS
+"""
+import asyncio
+import json
+from urllib.parse import urlencode
+import pytest
+from fastapi import FastAPI, Request
+from reconciliation.streaming import BodyStreamingResponse, iter_queries, read_body
+
+PAYLOAD = {f"q{i}": {"query": f"White & British + {i}%", "limit": 5, "type": "/ethnicity"}
+           for i in range(20)}
+
+
+def collect(body, content_type, size):
+    """
+        The queries parsed from the body sent in chunks of size bytes.
+    """
+    async def chunks():
+        for i in range(0, len(body), size):
+            yield body[i:i + size]
+
+    async def run():
+        return [query async for query in iter_queries(chunks(), content_type)]
+
+    return asyncio.run(run())
+
+
+def test_queries_are_parsed_across_chunks():
+    """
+        This test checks that the form and the JSON bodies give every query,
+        in order, however the body is split, escapes and characters included.
+    """
+    form = urlencode({"queries": json.dumps(PAYLOAD)}).encode()
+    raw = json.dumps({**PAYLOAD, "q20": {"query": "Métis"}}, ensure_ascii=False).encode()
+    for size in (1, 2, 5, 4096):
+        assert collect(form, "application/x-www-form-urlencoded", size) == list(PAYLOAD.items())
+        assert dict(collect(raw, "application/json", size))["q20"] == {"query": "Métis"}
+
+
+def test_malformed_payloads():
+    """
+        This test checks that a malformed body raises ValueError.
+    """
+    for body in (b'{"q0": {"query": "a"}', b'{"q0": "a"}', b'[]', b'{"q0": {},}'):
+        with pytest.raises(ValueError):
+            collect(body, "application/json", 3)
+    with pytest.raises(ValueError):
+        collect(b"other=1", "application/x-www-form-urlencoded", 3)
+
+
+def echo_app():
+    """
+        An app streaming back the keys of the queries while they are received.
+    """
+    app = FastAPI()
+
+    @app.post("/stream")
+    async def stream(request: Request):
+        body_read = asyncio.Event()
+        queries = iter_queries(read_body(request, body_read),
+                               request.headers.get("content-type", ""))
+
+        async def lines():
+            try:
+                async for key, _ in queries:
+                    yield f"{key}\n"
+            except ValueError as e:
+                yield f"{e}\n"
+
+        return BodyStreamingResponse(lines(), body_read, media_type="text/plain")
+
+    return app
+
+
+def test_body_received_while_streaming(post_in_chunks):
+    """
+        This test checks that the whole body reaches the content of the response
+        when the server does not implement ASGI 2.4, so that StreamingResponse
+        would listen for the disconnect while the body is still being received.
+    """
+    body = urlencode({"queries": json.dumps(PAYLOAD)}).encode()
+    for spec_version in ("2.3", "2.4"):
+        status, text = post_in_chunks(echo_app(), "/stream", body, 10, spec_version)
+        assert status == 200
+        assert text.decode().splitlines() == list(PAYLOAD)
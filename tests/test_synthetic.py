@@ -0,0 +1,95 @@
+"""
+    SYNTHETIC DATA TESTS
+"""
+from datetime import date
+from database import synthetic
+from database.synthetic import build_name_pools, generate_shard
+
+
+def _settings(seed):
+    return {
+        "seed": seed,
+        "patients": 2500,
+        "chunk_size": 1000,
+        "registrations_per_patient": 3,
+        "max_per_patient": 5,
+        "hospitals": 394,
+        "registration_id_start": 6000,
+        "today": date(2025, 1, 1),
+        "pools": build_name_pools(seed, size=100),
+    }
+
+def test_shard_is_deterministic_per_seed():
+    """
+        This test checks that a shard only depends on the seed and on its index,
+        so that the same dataset is generated whatever the number of workers.
+    """
+    patients, registrations = generate_shard(_settings(0), 1)
+    patients_again, registrations_again = generate_shard(_settings(0), 1)
+    other_patients, _ = generate_shard(_settings(1), 1)
+
+    assert patients.equals(patients_again)
+    assert registrations.equals(registrations_again)
+    assert not patients.equals(other_patients)
+
+def test_shard_ids_and_references():
+    """
+        This test checks the id ranges of the last, partial shard and that every
+        patient has between one and max_per_patient registrations.
+    """
+    patients, registrations = generate_shard(_settings(0), 2)
+
+    assert len(patients) == 500
+    assert patients["patientid"].tolist() == list(range(3000, 3500))
+    assert registrations["registrationid"].is_unique
+    assert registrations["registrationid"].min() == 6000 + 2000 * 5
+    counts = registrations.groupby("patientid").size()
+    assert set(counts.index) == set(patients["patientid"])
+    assert counts.between(1, 5).all()
+    assert (registrations["datedischarge"] >= registrations["dateregistration"]).all()
+
+def test_reference_date_from_the_command_line(monkeypatch):
+    """
+        This test checks that --today reaches the generator, so that a load
+        can be repeated with the same data on another day.
+    """
+    calls = []
+    def run(patients, **kwargs):
+        calls.append(kwargs)
+        return {"patients": patients, "registrations": 0, "seconds": 0, "rows_per_second": 0}
+    monkeypatch.setattr(synthetic, "run", run)
+    synthetic.main(["--patients", "10", "--today", "2025-01-01", "--dry-run"])
+    synthetic.main(["--patients", "10", "--dry-run"])
+    assert calls[0]["today"] == date(2025, 1, 1)
+    assert calls[1]["today"] is None
+
+class RecordingEngine:
+    """
+        An engine recording the statements of its transactions.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def begin(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+
+def test_sequences_follow_the_loaded_ids():
+    """
+        This test checks that the serial sequence of every id loaded with COPY
+        is set past the largest loaded id.
+    """
+    engine = RecordingEngine()
+    synthetic.advance_sequences(engine)
+    assert len(engine.statements) == 2
+    assert "pg_get_serial_sequence('patient', 'patientid')" in engine.statements[0]
+    assert "COALESCE(max(registrationid), 0) + 1 FROM registration" in engine.statements[1]
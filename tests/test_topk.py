@@ -0,0 +1,41 @@
+"""
+    TOP-K PRUNING TESTS
+"""
+from database.generate_patient import ethnicity_values
+from database.ethnicity import ETHNICITY_DESCRIPTIONS
+from database.registration import ADMISSION_REASONS
+from reconciliation.helper import partial_ratio, partial_ratio_bound
+from reconciliation.scoring import score_ethnicity, top_k_partial_ratio
+
+ROWS = [(5000 + i, description) for i, (_, description) in enumerate(ETHNICITY_DESCRIPTIONS)]
+
+
+def ranked(matches, limit):
+    """
+        The matches as reconcile_query returns them.
+    """
+    return sorted(matches, key=lambda x: x["score"], reverse=True)[:limit]
+
+
+def test_bound_is_an_upper_bound():
+    """
+        This test checks that the bound is never below the partial ratio.
+    """
+    pairs = [(v, d) for v in ethnicity_values for _, d in ROWS]
+    pairs += [(a, b) for a in ADMISSION_REASONS[:10] for b in ADMISSION_REASONS]
+    for a, b in pairs:
+        assert partial_ratio_bound(a, b) >= partial_ratio(a, b), (a, b)
+
+
+def test_top_k_matches_exhaustive_scoring():
+    """
+        This test checks that the pruned search returns the same top k as the
+        exhaustive scoring, in the same order, while scoring fewer candidates.
+    """
+    scored = 0
+    for value in ethnicity_values + ["", "other", "white and black caribbean"]:
+        for limit in (1, 3, 5, len(ROWS)):
+            assert ranked(score_ethnicity(value, ROWS, limit), limit) == \
+                ranked(score_ethnicity(value, ROWS), limit), (value, limit)
+        scored += len(top_k_partial_ratio(value, [d for _, d in ROWS], 5))
+    assert scored < (len(ethnicity_values) + 3) * len(ROWS)
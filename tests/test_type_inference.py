@@ -0,0 +1,38 @@
+"""
+    TYPE ROUTER TESTS
+"""
+from database.ethnicity import ETHNICITY_DESCRIPTIONS
+from database.sexual_orientation import SO_CATEGORIES
+from reconciliation.type_inference import TYPES, TypeRouter, classifier_for
+
+VOCABULARIES = {
+    "/ethnicity": [(5000 + i, d) for i, (_, d) in enumerate(ETHNICITY_DESCRIPTIONS)],
+    "/sexual-orientation": [(3000 + i, n) for i, n in enumerate(SO_CATEGORIES)],
+}
+
+
+def test_router_dispatches_plausible_types():
+    """
+        This test checks that untyped queries clearly belonging to one
+        vocabulary are only sent to that type, that null-like values are never
+        sent to ICD-11 and that unrecognised values fall back to all the types.
+    """
+    router = TypeRouter(classifier_for(VOCABULARIES))
+
+    assert router.route("Asian") == {"/ethnicity"}
+    assert router.route("Heterosexual") == {"/sexual-orientation"}
+    assert router.route("Chest pain") == {"/icd11"}
+    assert router.route("Unknown") == {"/ethnicity", "/sexual-orientation"}
+    assert router.route("xqzv") == set(TYPES)
+
+def test_router_uses_batch_prior():
+    """
+        This test checks that an ambiguous value is routed to the type
+        the previous queries of the same batch were reconciled with.
+    """
+    router = TypeRouter(classifier_for(VOCABULARIES))
+    assert len(router.route("Other")) > 1
+
+    for _ in range(5):
+        router.observe("/ethnicity")
+    assert router.route("Other") == {"/ethnicity"}
@@ -0,0 +1,46 @@
+"""
+    UPLOADED FILES TESTS
+"""
+import io
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from reconciliation.uploads import iter_updates, upload_format
+
+DF = pd.DataFrame({
+    "patientid": [1, 2, 3, 4],
+    "ethnicity": ["Indian", None, "Chinese", "Any other Asian background"],
+    "ethnicity_id": ["5001", "5002", None, "5004"],
+})
+
+
+def encode(fmt):
+    """
+        The test rows written in the given format.
+    """
+    buffer = io.BytesIO()
+    table = pa.Table.from_pandas(DF, preserve_index=False)
+    if fmt == "csv":
+        DF.to_csv(buffer, index=False)
+    elif fmt == "parquet":
+        pq.write_table(table, buffer)
+    else:
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table, max_chunksize=2)
+    buffer.seek(0)
+    return buffer
+
+
+def test_formats_give_the_same_updates():
+    """
+        This test checks that the format is detected from the first bytes and
+        that CSV, Parquet and Arrow give the same rows, without the empty values.
+    """
+    expected = ([1, 3, 4], ["Indian", "Chinese", "Any other Asian background"],
+                ["5001", None, "5004"])
+    for fmt in ("csv", "parquet", "arrow"):
+        buffer = encode(fmt)
+        assert upload_format(buffer, "upload") == fmt
+        batches = list(iter_updates(buffer, fmt, "ethnicity", batch_rows=2))
+        rows = tuple(sum((list(batch[i]) for batch in batches), []) for i in range(3))
+        assert rows == expected, fmt